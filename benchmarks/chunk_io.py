@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.9
+
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+from os.path import abspath, dirname
+from tempfile import TemporaryDirectory
+
+REPOSITORY = dirname(dirname(abspath(__file__)))
+
+# Runs in a fresh interpreter, so peak memory only covers one encryption and one decryption
+WORKER = '''
+import json, os, sys, time
+from base64 import urlsafe_b64encode
+from resource import getrusage, RUSAGE_SELF
+
+sys.path.insert(0, sys.argv[1])
+import crycript
+
+directory, size, chunk_size, jobs = sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5])
+crycript.constants.ENCRYPTION_BUFFER_SIZE = chunk_size
+crycript.constants.PARALLEL_JOBS = jobs
+crycript.constants.QUIET = True
+key = urlsafe_b64encode(b'k' * 32)
+
+path = os.path.join(directory, 'data')
+with open(path, 'wb') as data_file:
+    for _ in range(0, size, 1_000_000):
+        data_file.write(os.urandom(min(1_000_000, size - data_file.tell())))
+
+baseline = getrusage(RUSAGE_SELF).ru_maxrss
+
+start = time.perf_counter()
+crycript.encrypt(path, key)
+encryption = time.perf_counter() - start
+
+encrypted = os.path.join(directory, [name for name in os.listdir(directory) if name.endswith('.cry')][0])
+
+start = time.perf_counter()
+crycript.decrypt(encrypted, key)
+decryption = time.perf_counter() - start
+
+print(json.dumps({
+    'encrypt_mb_s': round(size / encryption / 1_000_000, 1),
+    'decrypt_mb_s': round(size / decryption / 1_000_000, 1),
+    'peak_rss_mb': round(getrusage(RUSAGE_SELF).ru_maxrss * 1024 / 1_000_000, 1),
+    'peak_rss_growth_mb': round((getrusage(RUSAGE_SELF).ru_maxrss - baseline) * 1024 / 1_000_000, 1)
+}))
+'''
+
+
+def run(source: str, size: int, chunk_size: int, jobs: int) -> dict:
+    """Returns the throughput and peak memory of encrypting and decrypting one file of random data.
+
+    source: str -> directory containing the crycript package to measure
+    size: int -> file size (in bytes)
+    chunk_size: int -> crycript.constants.ENCRYPTION_BUFFER_SIZE
+    jobs: int -> crycript.constants.PARALLEL_JOBS"""
+    with TemporaryDirectory() as directory:
+        output = subprocess.run(
+            [sys.executable, '-c', WORKER, source, directory, str(size), str(chunk_size), str(jobs)],
+            check=True, capture_output=True, text=True
+        ).stdout
+
+    return json.loads(output)
+
+
+def best(source: str, size: int, chunk_size: int, jobs: int, repeat: int) -> dict:
+    """Returns the best of repeat runs (highest throughput, lowest memory), see run()."""
+    results = [run(source, size, chunk_size, jobs) for _ in range(repeat)]
+
+    return {
+        name: (max if name.endswith('mb_s') else min)(result[name] for result in results)
+        for name in results[0]
+    }
+
+
+# Set argument parser
+parser = ArgumentParser(description='Measure chunk I/O: throughput and peak memory of encrypt() and decrypt()')
+
+# Set size argument
+parser.add_argument('--size', help='file size in MB (default: 200)', type=int, default=200)
+
+# Set chunk sizes argument
+parser.add_argument('--chunk-sizes', help='chunk sizes in MB (default: 1 4 30)', type=int, nargs='+',
+                    default=[1, 4, 30], dest='chunk_sizes')
+
+# Set jobs argument
+parser.add_argument('-j', '--jobs', help='parallel jobs (default: 1)', type=int, default=1)
+
+# Set repeat argument
+parser.add_argument('--repeat', help='runs per measure, the best one is kept (default: 3)', type=int, default=3)
+
+# Set compare argument
+parser.add_argument('--compare', help='directory of another crycript checkout (e.g. a git worktree) to measure too',
+                    metavar='PATH')
+
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+
+    sources = {'current': REPOSITORY}
+    if arguments.compare:
+        sources['compare'] = abspath(arguments.compare)
+
+    results = []
+    for chunk_size in arguments.chunk_sizes:
+        for name, source in sources.items():
+            result = best(source, arguments.size * 1_000_000, chunk_size * 1_000_000, arguments.jobs, arguments.repeat)
+            result.update(source=name, chunk_size_mb=chunk_size, size_mb=arguments.size, jobs=arguments.jobs)
+
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,100 @@
+from os import makedirs
+from os.path import join as os_join
+from random import Random
+
+# Half random bytes, half text: compression has something to do, but not everything
+TEXT: bytes = b'crycript benchmark line, compressible on purpose. 0123456789\n'
+
+
+def synthetic_data(size: int, seed: int = 0) -> bytes:
+    """Returns reproducible data of the given size, half random and half repeated text.
+
+    size: int -> number of bytes
+    seed: int -> random seed, the same seed gives the same data"""
+    generator = Random(seed)
+    random_size = size // 2
+
+    text = TEXT * (-(-(size - random_size) // len(TEXT)))
+
+    return generator.randbytes(random_size) + text[:size - random_size]
+
+
+def large_file(directory: str, size: int, seed: int = 0) -> str:
+    """Creates one file, returns its path.
+
+    directory: str -> parent directory
+    size: int -> file size (in bytes)
+    seed: int -> random seed"""
+    path = os_join(directory, 'large.bin')
+
+    with open(path, 'wb') as large:
+        for block, start in enumerate(range(0, size, 16_000_000)):
+            large.write(synthetic_data(min(16_000_000, size - start), seed + block))
+
+    return path
+
+
+def small_files(directory: str, count: int, size: int, seed: int = 0) -> str:
+    """Creates a flat directory of small files, returns its path.
+
+    directory: str -> parent directory
+    count: int -> number of files
+    size: int -> size of every file (in bytes)"""
+    path = os_join(directory, 'small')
+    makedirs(path)
+
+    for number in range(count):
+        with open(os_join(path, f'{number:06}.txt'), 'wb') as small:
+            small.write(synthetic_data(size, seed + number))
+
+    return path
+
+
+def deep_tree(directory: str, depth: int, width: int, size: int, seed: int = 0) -> str:
+    """Creates a tree of directories, width subdirectories and width files per level, returns its path.
+
+    directory: str -> parent directory
+    depth: int -> number of levels
+    width: int -> subdirectories (and files) per directory
+    size: int -> size of every file (in bytes)"""
+    root = os_join(directory, 'deep')
+    level = [root]
+    number = 0
+
+    for _ in range(depth):
+        next_level = []
+
+        for parent in level:
+            makedirs(parent, exist_ok=True)
+
+            for branch in range(width):
+                with open(os_join(parent, f'{branch}.dat'), 'wb') as leaf:
+                    leaf.write(synthetic_data(size, seed + number))
+                number += 1
+
+                next_level.append(os_join(parent, f'd{branch}'))
+
+        level = next_level
+
+    return root
+
+
+def create(name: str, directory: str, scale: float = 1.0) -> str:
+    """Creates one of the standard datasets, returns its path.
+
+    large: one 200 MB file, small: 5000 files of 4 KB, deep: 6 levels of 3 directories with 16 KB files
+
+    name: str -> large, small or deep
+    directory: str -> parent directory
+    scale: float -> multiply sizes (large) or counts (small) by this factor, e.g. 0.1 for quick runs"""
+    if name == 'large':
+        return large_file(directory, max(int(200_000_000 * scale), 1))
+    if name == 'small':
+        return small_files(directory, max(int(5_000 * scale), 1), 4_000)
+    if name == 'deep':
+        return deep_tree(directory, 6 if scale >= 1 else 4, 3, 16_000)
+
+    raise ValueError(f'unknown dataset {name!r} (choose from {", ".join(DATASETS)})')
+
+
+DATASETS: tuple = ('large', 'small', 'deep')
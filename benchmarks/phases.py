@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.9
+"""Measures every phase of encryption on its own: key derivation, tar, compression, encryption (with every
+cipher engine) and write.
+
+Usage: phases.py SOURCE WORK_DIRECTORY SIZE CHUNK_SIZE JOBS [TAR_PATH]"""
+
+import json
+import sys
+from functools import partial
+from os import fsync, remove
+from os.path import abspath, dirname, join as os_join
+from time import perf_counter
+
+sys.path.insert(0, dirname(abspath(__file__)))
+from datasets import synthetic_data
+
+
+def chunks_of(data: bytes, chunk_size: int) -> list:
+    """Returns (index, flags, chunk) tuples of data, like container.iter_chunks()."""
+    from crycript.utils import container
+
+    view = memoryview(data)
+    starts = range(0, max(len(data), 1), chunk_size)
+
+    return [
+        (index, container.FLAG_FINAL if index == len(starts) - 1 else 0, view[start:start + chunk_size])
+        for index, start in enumerate(starts)
+    ]
+
+
+def rate(size: int, seconds: float) -> dict:
+    """Returns seconds and MB/s of a phase that processed size bytes."""
+    return {'seconds': round(seconds, 4), 'mb_s': round(size / seconds / 1_000_000, 1) if seconds else None}
+
+
+def kdf() -> dict:
+    """Measures one password key derivation (crycript.constants.PBKDF2_ITERATIONS)."""
+    from crycript import constants
+    from crycript.utils.kdf import derive_key
+
+    start = perf_counter()
+    derive_key('Benchmark-password-1', b's' * constants.SALT_SIZE)
+
+    return {'seconds': round(perf_counter() - start, 4), 'iterations': constants.PBKDF2_ITERATIONS}
+
+
+def tar(path: str) -> dict:
+    """Measures archiving a directory without compression (the tar stream of encrypt())."""
+    from crycript import utils
+
+    size = 0
+    start = perf_counter()
+
+    with utils.path_to_tar_stream(path) as tar_stream:
+        for block in iter(partial(tar_stream.read, 1_000_000), b''):
+            size += len(block)
+
+    return {**rate(size, perf_counter() - start), 'bytes': size}
+
+
+def compression(data: bytes, chunk_size: int) -> dict:
+    """Measures every available codec at its default level: speed and compressed size."""
+    from crycript import utils
+    from crycript.utils.compression import CODECS
+
+    results = {}
+
+    for codec in CODECS.values():
+        if not codec.available or codec.name == 'none':
+            continue
+
+        start = perf_counter()
+        compressed = sum(len(block) for block in utils.compress_chunks(
+            (chunk for _, _, chunk in chunks_of(data, chunk_size)), codec, codec.default_level
+        ))
+        results[codec.name] = {**rate(len(data), perf_counter() - start), 'ratio': round(compressed / len(data), 4)}
+
+    return results
+
+
+def encryption(data: bytes, chunk_size: int, cipher: str = 'fernet') -> tuple:
+    """Measures sealing and opening every frame of data with a cipher engine, returns the measures and the payloads."""
+    from crycript import utils
+    from crycript.utils import container
+    from crycript.utils.ciphers import FrameCipher
+
+    # Sources without cipher engines only have the Fernet construction
+    file_cipher = FrameCipher(FrameCipher.generate_key())
+    if hasattr(utils, 'parse_cipher'):
+        file_cipher = utils.parse_cipher(cipher).file_cipher(FrameCipher.generate_key())
+
+    chunks = chunks_of(data, chunk_size)
+
+    start = perf_counter()
+    payloads = list(utils.ordered_map(partial(container.seal_frame, file_cipher), chunks))
+    sealing = perf_counter() - start
+
+    start = perf_counter()
+    for _ in utils.ordered_map(
+            partial(container.open_frame, file_cipher),
+            ((index, flags, payload) for (index, flags, _), payload in zip(chunks, payloads))
+    ):
+        pass
+    opening = perf_counter() - start
+
+    return {'encrypt': rate(len(data), sealing), 'decrypt': rate(len(data), opening)}, payloads
+
+
+def ciphers(data: bytes, chunk_size: int) -> dict:
+    """Measures every cipher engine, with its encryption speed relative to Fernet."""
+    from crycript import utils
+
+    if not hasattr(utils, 'parse_cipher'):
+        return {}
+
+    from crycript.utils.ciphers import CIPHERS
+
+    results = {name: encryption(data, chunk_size, name)[0] for name in CIPHERS}
+
+    for result in results.values():
+        result['speedup'] = round(results['fernet']['encrypt']['seconds'] / result['encrypt']['seconds'], 2)
+
+    return results
+
+
+def write(directory: str, payloads: list) -> dict:
+    """Measures writing frames to disk, including fsync."""
+    from crycript.utils import container
+
+    path = os_join(directory, 'frames.bin')
+    size = 0
+    start = perf_counter()
+
+    with open(path, 'wb', buffering=0) as frames:
+        for payload in payloads:
+            container.write_frame(frames, payload)
+            size += container.FRAME_HEADER.size + len(payload)
+        fsync(frames.fileno())
+
+    seconds = perf_counter() - start
+    remove(path)
+
+    return rate(size, seconds)
+
+
+def main(source: str, directory: str, size: int, chunk_size: int, jobs: int, tar_path: str = None) -> dict:
+    """Returns the measures of every phase, see the module docstring.
+
+    source: str -> directory containing the crycript package to measure
+    directory: str -> directory for temporary files
+    size: int -> bytes of synthetic data for compression, encryption and write
+    chunk_size: int -> chunk size (in bytes)
+    jobs: int -> crycript.constants.PARALLEL_JOBS
+    tar_path: str -> directory to archive, tar is not measured if None"""
+    sys.path.insert(0, source)
+    from crycript import constants
+
+    constants.PARALLEL_JOBS = jobs
+    data = synthetic_data(size)
+
+    results = {'chunk_size': chunk_size, 'jobs': jobs, 'bytes': size, 'kdf': kdf()}
+
+    if tar_path is not None:
+        results['tar'] = tar(tar_path)
+
+    results['compression'] = compression(data, chunk_size)
+    results['cipher'], payloads = encryption(data, chunk_size)
+    results['ciphers'] = ciphers(data, chunk_size)
+    results['write'] = write(directory, payloads)
+
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(main(
+        sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]),
+        sys.argv[6] if len(sys.argv) > 6 else None
+    )))
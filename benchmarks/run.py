@@ -0,0 +1,146 @@
+#!/usr/bin/env python3.9
+import json
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from copy import deepcopy
+from datetime import datetime, timezone
+from os import cpu_count
+from os.path import abspath, dirname, join as os_join
+from tempfile import TemporaryDirectory
+
+import datasets
+
+BENCHMARKS = dirname(abspath(__file__))
+REPOSITORY = dirname(BENCHMARKS)
+
+
+def run_script(script: str, *arguments) -> dict:
+    """Returns the JSON printed by a benchmark script, run in a fresh interpreter.
+
+    script: str -> script filename, inside the benchmarks directory
+    arguments -> script arguments"""
+    output = subprocess.run(
+        [sys.executable, os_join(BENCHMARKS, script), *map(str, arguments)],
+        check=True, capture_output=True, text=True
+    ).stdout
+
+    return json.loads(output)
+
+
+def best(results: list) -> dict:
+    """Returns the first of repeated action measures, keeping the fastest time of every action and the lowest memory."""
+    merged = deepcopy(results[0])
+
+    for result in results[1:]:
+        for action, seconds in result['seconds'].items():
+            if seconds < merged['seconds'][action]:
+                merged['seconds'][action] = seconds
+                if action in merged['mb_s']:
+                    merged['mb_s'][action] = result['mb_s'][action]
+
+        merged['peak_rss_mb'] = min(merged['peak_rss_mb'], result['peak_rss_mb'])
+
+    return merged
+
+
+def version(source: str) -> str:
+    """Returns the crycript version of a source directory."""
+    code = f'import sys; sys.path.insert(0, {source!r}); import crycript; print(crycript.STRING_VERSION)'
+    return subprocess.run(
+        [sys.executable, '-c', code],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+# Set argument parser
+# Every measure runs in a fresh interpreter (worker.py, phases.py), so peak memory is not shared between measures
+parser = ArgumentParser(description='Benchmark crycript on synthetic datasets (end-to-end actions and every phase), '
+                                    'print JSON results')
+
+# Set datasets argument
+parser.add_argument('--datasets', help=f'datasets to measure (default: {" ".join(datasets.DATASETS)})', nargs='+',
+                    choices=datasets.DATASETS, default=list(datasets.DATASETS))
+
+# Set scale argument
+parser.add_argument('--scale', help='multiply dataset sizes, e.g. 0.1 for a quick run (default: 1)', type=float,
+                    default=1.0)
+
+# Set chunk sizes argument
+parser.add_argument('--chunk-sizes', help='chunk sizes (ENCRYPTION_BUFFER_SIZE) in MB (default: 1 4 30)', type=int,
+                    nargs='+', default=[1, 4, 30], dest='chunk_sizes')
+
+# Set jobs argument
+parser.add_argument('-j', '--jobs', help='parallel jobs (default: 1)', type=int, default=1)
+
+# Set repeat argument
+parser.add_argument('--repeat', help='runs per measure, the fastest one is kept (default: 3)', type=int, default=3)
+
+# Set phases size argument
+parser.add_argument('--phases-size', help='MB of synthetic data for the phase measures (default: 64)', type=int,
+                    default=64, dest='phases_size')
+
+# Set compare argument
+parser.add_argument('--compare', help='directory of another crycript checkout (e.g. a git worktree) to measure too',
+                    metavar='PATH')
+
+# Set output argument
+parser.add_argument('-o', '--output', help='write the JSON results to FILE instead of standard output', metavar='FILE')
+
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+
+    sources = {'current': REPOSITORY}
+    if arguments.compare:
+        sources['compare'] = abspath(arguments.compare)
+
+    report = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': cpu_count(),
+        'arguments': vars(arguments),
+        'versions': {name: version(source) for name, source in sources.items()},
+        'actions': [],
+        'phases': []
+    }
+
+    with TemporaryDirectory(prefix='crycript-benchmarks-') as directory:
+        paths = {name: datasets.create(name, directory, arguments.scale) for name in arguments.datasets}
+        tar_path = paths.get('deep', paths.get('small'))
+
+        for chunk_size in arguments.chunk_sizes:
+            for source_name, source in sources.items():
+                for dataset, path in paths.items():
+                    result = best([
+                        run_script('worker.py', source, path, chunk_size * 1_000_000, arguments.jobs)
+                        for _ in range(arguments.repeat)
+                    ])
+                    result['source'] = source_name
+
+                    report['actions'].append(result)
+                    print(f'{source_name} {dataset} {chunk_size} MB: {result["mb_s"]} MB/s, '
+                          f'{result["peak_rss_mb"]} MB peak', file=sys.stderr)
+
+                phases = [
+                    run_script('phases.py', source, directory, arguments.phases_size * 1_000_000,
+                               chunk_size * 1_000_000, arguments.jobs, *([tar_path] if tar_path else []))
+                    for _ in range(arguments.repeat)
+                ]
+                result = min(phases, key=lambda phase: phase['cipher']['encrypt']['seconds'])
+                result['source'] = source_name
+
+                report['phases'].append(result)
+                print(f'{source_name} phases {chunk_size} MB: cipher {result["cipher"]["encrypt"]["mb_s"]} MB/s, '
+                      f'kdf {result["kdf"]["seconds"]} seconds', file=sys.stderr)
+                for cipher, measures in result.get('ciphers', {}).items():
+                    print(f'{source_name} {cipher} {chunk_size} MB: {measures["encrypt"]["mb_s"]} MB/s encrypt, '
+                          f'{measures["decrypt"]["mb_s"]} MB/s decrypt, {measures["speedup"]}x fernet', file=sys.stderr)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
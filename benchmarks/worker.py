@@ -0,0 +1,105 @@
+#!/usr/bin/env python3.9
+"""Encrypts, changes the password of and decrypts one dataset, printing JSON measures.
+
+Runs in a fresh interpreter for every measure (see run.py), so peak memory only covers one dataset.
+
+Usage: worker.py SOURCE DATASET CHUNK_SIZE JOBS"""
+
+import json
+import sys
+from base64 import urlsafe_b64encode
+from os import listdir, rename, walk
+from os.path import basename, dirname, getsize, isdir, join as os_join
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+
+
+def dataset_size(path: str) -> int:
+    """Returns the size of a file, or of every file inside a directory (in bytes).
+
+    path: str -> file or directory"""
+    if not isdir(path):
+        return getsize(path)
+
+    return sum(getsize(os_join(root, name)) for root, _, files in walk(path) for name in files)
+
+
+def peak_rss() -> int:
+    """Returns the peak resident memory of this process (in bytes)."""
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(function, *arguments) -> tuple:
+    """Returns the seconds taken by function(*arguments) and its result."""
+    start = perf_counter()
+    result = function(*arguments)
+
+    return perf_counter() - start, result
+
+
+def main(source: str, dataset: str, chunk_size: int, jobs: int) -> dict:
+    """Returns the measures of every action on dataset, see the module docstring.
+
+    source: str -> directory containing the crycript package to measure
+    dataset: str -> file or directory to encrypt (it is preserved)
+    chunk_size: int -> crycript.constants.ENCRYPTION_BUFFER_SIZE
+    jobs: int -> crycript.constants.PARALLEL_JOBS"""
+    sys.path.insert(0, source)
+    import crycript
+
+    crycript.constants.ENCRYPTION_BUFFER_SIZE = chunk_size
+    crycript.constants.PARALLEL_JOBS = jobs
+    crycript.constants.PRESERVE_ORIGINAL_FILES = True
+    crycript.constants.QUIET = True
+
+    key, new_key = urlsafe_b64encode(b'k' * 32), urlsafe_b64encode(b'n' * 32)
+    size = dataset_size(dataset)
+
+    # Work next to the dataset (same filesystem), without touching it
+    work_directory = mkdtemp(prefix='crycript-', dir=dirname(dataset))
+
+    try:
+        seconds, phases = {}, {}
+
+        seconds['encrypt'], result = measure(crycript.encrypt, dataset, key)
+        phases['encrypt'] = result.stats.as_dict()
+
+        encrypted = [name for name in listdir(dirname(dataset)) if name.endswith('.cry')][0]
+        encrypted_path = os_join(work_directory, encrypted)
+        rename(os_join(dirname(dataset), encrypted), encrypted_path)
+
+        crycript.constants.PRESERVE_ORIGINAL_FILES = False
+        seconds['change_password'], result = measure(crycript.change_password, encrypted_path, key, new_key)
+        phases['change_password'] = result.stats.as_dict()
+
+        crycript.constants.PRESERVE_ORIGINAL_FILES = True
+        seconds['decrypt'], result = measure(crycript.decrypt, encrypted_path, new_key)
+        phases['decrypt'] = result.stats.as_dict()
+
+        encrypted_size = getsize(encrypted_path)
+    finally:
+        rmtree(work_directory)
+
+    return {
+        'dataset': basename(dataset),
+        'bytes': size,
+        'encrypted_bytes': encrypted_size,
+        'chunk_size': chunk_size,
+        'jobs': jobs,
+        'seconds': {action: round(value, 4) for action, value in seconds.items()},
+        'mb_s': {
+            action: round(size / value / 1_000_000, 1)
+            for action, value in seconds.items() if action != 'change_password'
+        },
+        'peak_rss_mb': round(peak_rss() / 1_000_000, 1),
+        'phases': phases
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(main(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))))
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3.9
 
+import json
+import sys
 from argparse import ArgumentParser
+from os.path import abspath
+from time import time
 
 import crycript
 
@@ -34,11 +38,176 @@ parser.add_argument(
     dest='preserve'
 )
 
+# Set pack argument
+parser.add_argument(
+    '--pack',
+    help='with -e, encrypt directories as packs instead of tars: an encrypted index lets --list and --extract '
+         'find single files without decrypting the rest',
+    action='store_true',
+    dest='pack'
+)
+
+# Set resume argument
+parser.add_argument(
+    '--resume',
+    help='continue interrupted encryptions of uncompressed files from their last checkpoint, instead of '
+         'starting over (fernet and fernet-wrapped ciphers only)',
+    action='store_true',
+    dest='resume'
+)
+
+# Set jobs argument
+parser.add_argument(
+    '-j',
+    '--jobs',
+    help='number of chunks to encrypt or decrypt at the same time (default: 1)',
+    type=int,
+    default=1,
+    metavar='N',
+    dest='jobs'
+)
+
+# Set workers argument
+parser.add_argument(
+    '-w',
+    '--workers',
+    help='number of paths to process at the same time, with one progress bar for all of them and one password '
+         'for all of them, like -s (default: 1)',
+    type=int,
+    default=1,
+    metavar='N',
+    dest='workers'
+)
+
+# Set scan jobs argument
+parser.add_argument(
+    '--scan-jobs',
+    help='number of directories to read at the same time while checking paths, faster on network '
+         'filesystems (default: 1)',
+    type=int,
+    default=1,
+    metavar='N',
+    dest='scan_jobs'
+)
+
+# Set write jobs argument
+parser.add_argument(
+    '--write-jobs',
+    help='number of files to write at the same time while decrypting directories, faster with many small files '
+         '(default: 1)',
+    type=int,
+    default=1,
+    metavar='N',
+    dest='write_jobs'
+)
+
+# Set summary argument
+parser.add_argument(
+    '--summary',
+    help='write a JSON summary with the timing and result of every path to FILE (- for standard output), '
+         'failed paths do not stop the others',
+    metavar='FILE',
+    dest='summary'
+)
+
+# Set snapshot argument
+parser.add_argument(
+    '--snapshot',
+    help='with --restore, snapshot to restore (default: the newest one, see --snapshots)',
+    metavar='NAME',
+    dest='snapshot'
+)
+
+# Set stats argument
+parser.add_argument(
+    '--stats',
+    help='show the time, bytes and chunks of every phase (key derivation, tar, compression, encryption, write...) '
+         'after every path, as text or as one JSON object per line',
+    choices=('text', 'json'),
+    metavar='FORMAT',
+    dest='stats'
+)
+
+# Set profile argument
+parser.add_argument(
+    '--profile',
+    help='write cProfile statistics to FILE (read them with python -m pstats FILE), use -j 1 so chunks are '
+         'profiled too',
+    metavar='FILE',
+    dest='profile'
+)
+
+# Set trace memory argument
+parser.add_argument(
+    '--trace-memory',
+    help='trace memory allocations with tracemalloc, then show the peak and the largest allocations left',
+    action='store_true',
+    dest='trace_memory'
+)
+
+# Set chunk size argument
+parser.add_argument(
+    '--chunk-size',
+    help='size of the encrypted chunks, in bytes (K, M and G suffixes allowed) or auto to choose it '
+         f'from the file size and the available memory (default: {crycript.constants.ENCRYPTION_BUFFER_SIZE})',
+    metavar='SIZE',
+    dest='chunk_size'
+)
+
+# Set range argument
+parser.add_argument(
+    '--range',
+    help='with -d, write only START:LENGTH bytes of the decrypted contents to standard output, '
+         'decrypting only the chunks that contain them (negative START counts from the end, '
+         'LENGTH can be omitted to read up to the end)',
+    metavar='START:LENGTH',
+    dest='range'
+)
+
+# Set header only argument
+parser.add_argument(
+    '--header-only',
+    help='with --verify, only authenticate the header and check the file size, without reading every frame',
+    action='store_true',
+    dest='header_only'
+)
+
+# Set compression argument
+parser.add_argument(
+    '-z',
+    '--compress',
+    help='compression codec and optional level: gzip, xz, zstd, lz4 or none, e.g. zstd:19 '
+         '(default: none for files, gzip for directories)',
+    metavar='CODEC[:LEVEL]',
+    dest='compress'
+)
+
+# Set cipher argument
+parser.add_argument(
+    '--cipher',
+    help='with -e, cipher engine of the frames: fernet (AES-128-CBC and HMAC-SHA256, chunk keys derived from the '
+         'file key), fernet-wrapped (random chunk keys stored in every frame, readable by older versions), '
+         'aes-256-gcm or chacha20-poly1305 (one pass, hardware accelerated, one key per file) '
+         f'(default: {crycript.constants.CIPHER})',
+    choices=list(crycript.utils.ciphers.CIPHERS),
+    metavar='NAME',
+    dest='cipher'
+)
+
+# Set agent time to live argument
+parser.add_argument(
+    '--agent-ttl',
+    help=f'seconds the key agent keeps keys and the unlocked password (default: {crycript.constants.KEY_AGENT_TTL})',
+    type=float,
+    metavar='SECONDS',
+    dest='agent_ttl'
+)
+
 # Set path argument
 parser.add_argument(
     'path',
     help='path to file or directory',
-    nargs='+'
+    nargs='*'
 )
 
 # Set mutually exclusive arguments
@@ -69,46 +238,377 @@ parser_action_group.add_argument(
     dest='change_password'
 )
 
+# Set verify action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--verify',
+    help='authenticate every encrypted frame without writing the decrypted contents, showing the corrupted ones '
+         '(exit status 1 if any file is corrupted)',
+    action='store_true'
+)
+
+# Set list action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--list',
+    help='list the files of encrypted packs (see --pack), only decrypting their index',
+    action='store_true'
+)
+
+# Set extract action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--extract',
+    help='decrypt only the file or directory NAME (as shown by --list) of encrypted directories, next to them, '
+         'can be repeated (packs only decrypt NAME, other directories are decrypted but only NAME is written)',
+    action='append',
+    metavar='NAME'
+)
+
+# Set backup action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '-b',
+    '--backup',
+    help='store a snapshot of every path in the REPOSITORY directory (created if needed), only reading files '
+         'changed since their last snapshot and only storing new contents, original files are never deleted',
+    metavar='REPOSITORY'
+)
+
+# Set restore action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--restore',
+    help='restore a snapshot of REPOSITORY inside the given directory',
+    metavar='REPOSITORY'
+)
+
+# Set snapshots action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--snapshots',
+    help='list the snapshots of REPOSITORY',
+    metavar='REPOSITORY'
+)
+
+# Set key agent action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--agent',
+    help='run a key agent that caches derived keys in memory (until interrupted)',
+    action='store_true'
+)
+
+# Set unlock agent action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--unlock',
+    help='give a password to the running key agent, so it is not asked again',
+    action='store_true'
+)
+
+# Set lock agent action (inside mutually exclusive group)
+parser_action_group.add_argument(
+    '--lock',
+    help='make the running key agent forget its password and every cached key',
+    action='store_true'
+)
+
 
 if __name__ == '__main__':
     # Parse arguments
     arguments = parser.parse_args()
 
+    if arguments.agent_ttl is not None and arguments.agent_ttl <= 0:
+        parser.error('argument --agent-ttl: must be greater than 0')
+
+    # The command line uses the key agent when one is running (its socket is checked, see utils.agent)
+    crycript.constants.USE_KEY_AGENT = True
+
+    # Key agent actions do not use paths
+    if arguments.agent:
+        try:
+            print(f'Key agent listening on {crycript.utils.agent.socket_path()}')
+            crycript.utils.agent.serve(ttl=arguments.agent_ttl)
+        except KeyboardInterrupt:
+            pass
+        except OSError as error:
+            crycript.utils.kill(f'Aborted: {error}')
+        raise SystemExit
+
+    if arguments.unlock or arguments.lock:
+        if arguments.unlock:
+            try:
+                password = crycript.utils.ask_password()
+            except crycript.CrycriptError as error:
+                crycript.utils.kill(f'Aborted: {error}')
+
+            response = crycript.utils.agent.request({
+                'command': 'unlock',
+                'password': password,
+                'ttl': arguments.agent_ttl
+            })
+        else:
+            response = crycript.utils.agent.request({'command': 'lock'})
+
+        if response is None:
+            crycript.utils.kill('Aborted: no key agent is running')
+
+        print('Key agent unlocked' if response['unlocked'] else 'Key agent locked')
+        raise SystemExit
+
+    # Listing snapshots does not use paths
+    if arguments.snapshots is not None:
+        try:
+            for snapshot in crycript.snapshots(abspath(arguments.snapshots)):
+                print(f'{snapshot.name}  {snapshot.files} files  {round(snapshot.size / 1_000_000, 1)} MB'
+                      f'  {snapshot.source}')
+        except (crycript.CrycriptError, OSError) as error:
+            crycript.utils.kill(f'Aborted: {error}')
+        raise SystemExit
+
+    if not arguments.path:
+        parser.error('the following arguments are required: path')
+
+    if arguments.snapshot is not None and arguments.restore is None:
+        parser.error('argument --snapshot: only valid with --restore')
+
+    if arguments.restore is not None and len(arguments.path) != 1:
+        parser.error('argument --restore: expected exactly one destination directory')
+
+    if arguments.restore is not None and (arguments.workers > 1 or arguments.summary is not None):
+        parser.error('argument --restore: not valid with -w/--workers or --summary')
+
+    if arguments.list and (arguments.workers > 1 or arguments.summary is not None or arguments.stats is not None):
+        parser.error('argument --list: not valid with -w/--workers, --summary or --stats')
+
     # Set preserve
     crycript.constants.PRESERVE_ORIGINAL_FILES = arguments.preserve
 
-    # Verify paths
+    # Set pack
+    if arguments.pack and not arguments.encrypt:
+        parser.error('argument --pack: only valid with -e/--encrypt')
+    crycript.constants.PACK_DIRECTORIES = arguments.pack
+
+    # Set resume
+    if arguments.resume and not arguments.encrypt:
+        parser.error('argument --resume: only valid with -e/--encrypt')
+    crycript.constants.RESUME_ENCRYPTION = arguments.resume
+
+    # Set jobs
+    if arguments.jobs < 1:
+        parser.error('argument -j/--jobs: must be at least 1')
+    crycript.constants.PARALLEL_JOBS = arguments.jobs
+
+    # Set workers
+    if arguments.workers < 1:
+        parser.error('argument -w/--workers: must be at least 1')
+    crycript.constants.BATCH_WORKERS = arguments.workers
+
+    # Set scan jobs
+    if arguments.scan_jobs < 1:
+        parser.error('argument --scan-jobs: must be at least 1')
+    crycript.constants.PATH_VALIDATION_JOBS = arguments.scan_jobs
+
+    # Set write jobs
+    if arguments.write_jobs < 1:
+        parser.error('argument --write-jobs: must be at least 1')
+    crycript.constants.EXTRACTION_JOBS = arguments.write_jobs
+
+    # Many paths at once share one progress bar and one password, and failures do not stop the others
+    batch = arguments.workers > 1 or arguments.summary is not None
+
+    # Set range
+    if arguments.range is not None:
+        if not arguments.decrypt:
+            parser.error('argument --range: only valid with -d/--decrypt')
+
+        if batch:
+            parser.error('argument --range: not valid with -w/--workers or --summary')
+
+        if arguments.stats is not None:
+            parser.error('argument --range: not valid with --stats')
+
+        start, _, length = arguments.range.partition(':')
+        try:
+            arguments.range = (int(start), int(length) if length else None)
+        except ValueError:
+            parser.error('argument --range: expected START:LENGTH, e.g. -1000000: or 0:4096')
+
+    # Set header only
+    if arguments.header_only and not arguments.verify:
+        parser.error('argument --header-only: only valid with --verify')
+
+    # Set chunk size
+    if arguments.chunk_size is not None:
+        if arguments.chunk_size.strip().lower() == 'auto':
+            crycript.constants.AUTOMATIC_BUFFER_SIZE = True
+        else:
+            try:
+                crycript.constants.ENCRYPTION_BUFFER_SIZE = crycript.utils.parse_size(arguments.chunk_size)
+            except ValueError as error:
+                parser.error(f'argument --chunk-size: {error}')
+
+    # Set compression
+    if arguments.compress is not None:
+        try:
+            crycript.utils.parse_compression(arguments.compress)
+        except ValueError as error:
+            parser.error(f'argument -z/--compress: {error}')
+        crycript.constants.FILE_COMPRESSION = arguments.compress
+        crycript.constants.DIRECTORY_COMPRESSION = arguments.compress
+
+    # Set cipher
+    if arguments.cipher is not None:
+        if not arguments.encrypt:
+            parser.error('argument --cipher: only valid with -e/--encrypt')
+        crycript.constants.CIPHER = arguments.cipher
+
+    # AEAD nonces are frame indexes, a resumed encryption would seal them again
+    if arguments.resume and not crycript.utils.ciphers.CIPHERS[crycript.constants.CIPHER].resumable:
+        parser.error(f'argument --resume: not valid with --cipher {crycript.constants.CIPHER}, it always starts over')
+
+    # Verify paths, directories to encrypt are archived as they were scanned here
+    trees = {}
     paths, filenames = crycript.path_validator(
         arguments.path, sort=False,
-        action=(arguments.encrypt, arguments.decrypt, arguments.change_password)
+        action=(
+            arguments.encrypt,
+            arguments.decrypt or arguments.verify or arguments.list or arguments.extract is not None,
+            arguments.change_password
+        ),
+        writable=not (arguments.verify or arguments.list),
+        trees=trees
     )
 
-    key, old_key, new_key = None, None, None
-    if arguments.same_password and len(paths) > 1:
-        if arguments.encrypt:
-            key = crycript.password_to_key()
-
-        elif arguments.decrypt:
-            key = crycript.password_to_key(confirm_password=False, generate_token=False)
-
-        elif arguments.change_password:
-            old_key = crycript.password_to_key(
-                confirm_password=False, password_message='Old Password: ',
-                generate_token=False)
-
-            new_key = crycript.password_to_key(
-                password_message='New Password: ',
-                confirmation_message='Repeat Password: ',
-                generate_token=True)
-
-    for i, path in enumerate(paths):
-        if len(paths) > 1:
-            print(f'-> {filenames[i]}', end='\r') if arguments.same_password else print(f'-> {filenames[i]}')
-
-        if arguments.encrypt:
-            status = crycript.encrypt(path, key)
-        elif arguments.decrypt:
-            status = crycript.decrypt(path, key)
-        elif arguments.change_password:
-            status = crycript.change_password(path, old_key, new_key)
-        print(status)
+    # Files that failed verification, they set the exit status
+    corrupted = 0
+
+    # Actions raise CrycriptError (or OSError) on failure, profiling (if asked) covers all of them
+    with crycript.utils.profiling(arguments.profile, arguments.trace_memory) as profile_report:
+        try:
+            key, old_key, new_key = None, None, None
+            if arguments.backup is not None:
+                # Every path goes to the same repository, so they all use its password
+                repository = abspath(arguments.backup)
+                key = crycript.PasswordKeys(confirm_password=not crycript.is_repository(repository))
+
+            elif (arguments.same_password and len(paths) > 1) or batch:
+                if arguments.encrypt:
+                    key = crycript.PasswordKeys()
+
+                elif arguments.decrypt or arguments.verify or arguments.list or arguments.extract is not None:
+                    key = crycript.PasswordKeys(confirm_password=False)
+
+                elif arguments.change_password:
+                    old_key = crycript.PasswordKeys(confirm_password=False, password_message='Old Password: ')
+
+                    new_key = crycript.PasswordKeys(
+                        password_message='New Password: ',
+                        confirmation_message='Repeat Password: ',
+                        use_agent=False)
+
+            if batch:
+                if arguments.encrypt:
+                    action, keys = crycript.encrypt, (key,)
+                elif arguments.decrypt:
+                    action, keys = crycript.decrypt, (key,)
+                elif arguments.verify:
+                    action, keys = crycript.verify, (key, arguments.header_only)
+                elif arguments.extract is not None:
+                    action, keys = crycript.extract, (arguments.extract, None, key)
+                elif arguments.change_password:
+                    action, keys = crycript.change_password, (old_key, new_key)
+                elif arguments.backup is not None:
+                    action, keys = crycript.backup, (repository, key)
+
+                start = time()
+                results = crycript.run_batch(action, paths, *keys, trees=trees)
+                summary = crycript.batch_summary(results, time() - start)
+
+                if arguments.summary == '-':
+                    print(json.dumps(summary, indent=2))
+                elif arguments.summary is not None:
+                    with open(arguments.summary, 'w') as summary_file:
+                        json.dump(summary, summary_file, indent=2)
+
+                if arguments.summary != '-':
+                    megabytes_per_second = round((summary['bytes_per_second'] or 0) / 1_000_000, 1)
+                    print(f'{summary["succeeded"]} of {summary["paths"]} paths in {summary["seconds"]} seconds'
+                          f' ({megabytes_per_second} MB/s), {summary["failed"]} failed')
+
+                # Phases of every path that succeeded, added up
+                if arguments.stats is not None:
+                    stats = crycript.Stats()
+                    for result in results:
+                        if result.stats is not None:
+                            stats.merge(result.stats)
+
+                    if arguments.stats == 'json':
+                        print(json.dumps({'action': action.__name__, 'paths': len(results), 'stats': stats.as_dict()}))
+                    else:
+                        print(stats)
+
+            for i, path in enumerate(() if batch else paths):
+                # Standard output only receives the decrypted range
+                if arguments.range is not None:
+                    sys.stdout.buffer.write(crycript.read_range(path, *arguments.range, key))
+                    sys.stdout.buffer.flush()
+                    continue
+
+                if len(paths) > 1:
+                    print(f'-> {filenames[i]}', end='\r') if arguments.same_password else print(f'-> {filenames[i]}')
+
+                # Packs are listed, one member per line, instead of showing a result
+                if arguments.list:
+                    for entry in crycript.list_pack(path, key):
+                        print(f'{entry.size:>12}  {entry.name}{"/" if entry.kind == "directory" else ""}')
+                    continue
+
+                if arguments.encrypt:
+                    status = crycript.encrypt(path, key, entries=trees.get(path))
+                elif arguments.decrypt:
+                    status = crycript.decrypt(path, key)
+                elif arguments.change_password:
+                    status = crycript.change_password(path, old_key, new_key)
+                elif arguments.extract is not None:
+                    status = crycript.extract(path, arguments.extract, None, key)
+                elif arguments.verify:
+                    status = crycript.verify(path, key, arguments.header_only)
+                    corrupted += bool(status.corrupted_frames)
+                elif arguments.backup is not None:
+                    status = crycript.backup(path, repository, key)
+                elif arguments.restore is not None:
+                    status = crycript.restore(abspath(arguments.restore), path, arguments.snapshot, key)
+                print(status)
+
+                if arguments.stats == 'json' and arguments.verify:
+                    print(json.dumps({
+                        'action': 'verify',
+                        'path': status.path,
+                        'frames': status.frames,
+                        'corrupted_frames': status.corrupted_frames,
+                        'seconds': round(status.seconds, 4),
+                        'stats': status.stats.as_dict()
+                    }))
+                elif arguments.stats == 'json':
+                    print(json.dumps({
+                        'action': status.action,
+                        'path': status.path,
+                        'output_path': status.output_path,
+                        'seconds': round(status.seconds, 4),
+                        'stats': status.stats.as_dict()
+                    }))
+                elif arguments.stats == 'text':
+                    print(status.stats)
+        except (crycript.CrycriptError, OSError) as error:
+            crycript.utils.kill(f'Aborted: {error}')
+
+    if arguments.trace_memory:
+        if arguments.stats == 'json':
+            print(json.dumps({'memory': profile_report}))
+        else:
+            print(f'Peak traced memory: {round(profile_report["peak_traced_bytes"] / 1_000_000, 1)} MB')
+            for allocation in profile_report['largest_live_allocations']:
+                print(f'{allocation["location"]}: {round(allocation["bytes"] / 1_000, 1)} KB'
+                      f' in {allocation["count"]} blocks')
+
+    # Chunks bound the memory used, show how much was needed
+    if arguments.chunk_size is not None:
+        print(f'Peak memory: {round(crycript.utils.peak_memory() / 1_000_000, 1)} MB')
+
+    # Let scripts know some paths failed
+    if (batch and summary['failed']) or corrupted:
+        raise SystemExit(1)
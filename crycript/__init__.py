@@ -1,3 +1,9 @@
-from .actions import encrypt, decrypt, change_password
+from .actions import encrypt, decrypt, change_password, verify, read_range, open_encrypted as open
+from .actions import run_batch, batch_summary, ActionResult, VerifyResult
+from .actions import backup, restore, snapshots, is_repository
+from .actions import list_pack, extract
 from .constants import STRING_VERSION
-from .utils import password_to_key, path_validator
+from .utils import password_to_key, path_validator, KeyProvider, PasswordKeys, Stats
+from .utils.errors import CrycriptError, InvalidKey, InvalidPassword, PasswordPolicyError, VersionMismatch
+from .utils.errors import UnsupportedCodec, UnsupportedCipher, CorruptedFile, TamperedBlock
+from . import aio
@@ -1,3 +1,9 @@
+from .backup import backup, restore, snapshots, is_repository, Repository, SnapshotInfo
+from .batch import run_batch, batch_summary, BatchResult
 from .change_password import change_password
 from .decryption import decrypt
 from .encryption import encrypt
+from .packing import list_pack, extract
+from .reading import read_range, open_encrypted, EncryptedFileReader
+from .results import ActionResult, VerifyResult
+from .verification import verify
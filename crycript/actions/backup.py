@@ -0,0 +1,483 @@
+import hmac
+import json
+import zlib
+from datetime import datetime, timezone
+from functools import partial
+from hashlib import sha256
+from os import chmod, fstat, fsync, listdir, makedirs, readlink, remove, rename, symlink, utime
+from os.path import abspath, basename, dirname, exists, join as os_join, lexists
+from random import choice
+from stat import S_IMODE, S_ISDIR, S_ISLNK, S_ISREG
+from tempfile import mkdtemp, mkstemp
+from time import time
+from typing import Iterator, NamedTuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.ciphers import FrameCipher
+from crycript.utils.errors import CorruptedFile, CrycriptError, TamperedBlock, UnsupportedCodec
+from crycript.utils.stats import Stats
+from .headers import open_header
+from .results import ActionResult
+
+KEY_FILENAME: str = 'key' + constants.ENCRYPTED_FILE_EXTENSION
+CHUNKS_DIRECTORY: str = 'chunks'
+SNAPSHOTS_DIRECTORY: str = 'snapshots'
+
+# Encrypted name of the key file, so decrypting it by mistake is harmless
+REPOSITORY_NAME: str = 'crycript repository'
+
+
+def is_repository(path: str) -> bool:
+    """Returns True if path is a crycript repository (see Repository)."""
+    return exists(os_join(path, KEY_FILENAME))
+
+
+class SnapshotInfo(NamedTuple):
+    """Summary of one snapshot of a repository."""
+    name: str
+    source: str
+    created: str
+    files: int
+    size: int
+
+
+class Repository:
+    """Directory of content addressed encrypted chunks, and encrypted snapshots pointing to them.
+
+    Repository structure:
+
+    [key.cry] crycript header (no frames) holding the repository key, change its password with crycript -c
+    [chunks/ab/abcdef...] one encrypted chunk per file, named by a keyed hash of its plaintext
+    [snapshots/YYYY-MM-DDTHHMMSS.ffffffZ-xxxxxx] encrypted manifest: path, type, mode, size, mtime, hash and chunks of
+    every file, directory and symbolic link of a tree
+
+    Chunk names are keyed, so they do not reveal the contents to someone without the password.
+    Chunks and snapshots are authenticated together with their name, so they can not be swapped."""
+
+    def __init__(self, path: str, repository_key: bytes):
+        """path: str -> repository directory
+        repository_key: bytes -> 32 bytes key stored in key.cry"""
+        self.path = path
+        self._cipher = FrameCipher(hmac.digest(repository_key, b'encryption', 'sha256'))
+        self._name_key = hmac.digest(repository_key, b'chunk names', 'sha256')
+
+    @classmethod
+    def open(cls, path: str, key=None) -> 'Repository':
+        """Returns an existing repository, raise a CrycriptError if it is not one or the key is not valid.
+
+        path: str -> repository directory
+        key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)"""
+        key_path = os_join(path, KEY_FILENAME)
+
+        if not is_repository(path):
+            raise CrycriptError(f'{basename(path)}: not a crycript repository')
+
+        with open(key_path, 'rb') as key_file:
+            salt = container.read_header(key_file, KEY_FILENAME).fields.get(container.FIELD_SALT)
+            key = utils.file_key(key, salt, confirm_password=False)
+
+            key_file.seek(0)
+            header, _, name, _ = open_header(key_file, key, KEY_FILENAME)
+
+        if name != REPOSITORY_NAME:
+            raise CorruptedFile(f'{KEY_FILENAME}: not a repository key')
+
+        # The repository key is the file key of key.cry
+        return cls(path, Fernet(key).decrypt(header.wrapped_key))
+
+    @classmethod
+    def create(cls, path: str, key=None) -> 'Repository':
+        """Creates an empty repository, returns it.
+
+        It is built in a temporal directory and renamed to path once complete, so concurrent backups to a new
+        repository never see half of it: the one that renames it last opens the repository of the first one.
+
+        path: str -> repository directory, created if it does not exist (it must be empty)
+        key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)"""
+        if exists(path) and listdir(path):
+            raise CrycriptError(f'{basename(path)}: directory is not empty')
+
+        salt, key = utils.new_file_key(key)
+        repository_key = FrameCipher.generate_key()
+
+        fields = {container.FIELD_CODEC: bytes((utils.compression.CODECS['none'].identifier,))}
+        if salt is not None:
+            fields[container.FIELD_SALT] = salt
+
+        raw_fields = container.encode_fields(fields)
+        metadata = FrameCipher(repository_key).encrypt(
+            REPOSITORY_NAME.encode(),
+            container.metadata_associated_data(constants.BYTES_VERSION, raw_fields)
+        )
+
+        parent_dir = dirname(abspath(path))
+        makedirs(parent_dir, exist_ok=True)
+        temporal_path = mkdtemp(suffix=constants.TEMPORAL_FILE_EXTENSION, dir=parent_dir)
+
+        try:
+            makedirs(os_join(temporal_path, CHUNKS_DIRECTORY))
+            makedirs(os_join(temporal_path, SNAPSHOTS_DIRECTORY))
+
+            with open(os_join(temporal_path, KEY_FILENAME), 'wb') as key_file:
+                container.write_header(key_file, Fernet(key).encrypt(repository_key), raw_fields, metadata)
+                key_file.flush()
+                fsync(key_file.fileno())
+
+            # Replaces path if it is an empty directory, fails if it is not empty anymore
+            rename(temporal_path, path)
+        except OSError:
+            utils.delete_directory(temporal_path)
+
+            if is_repository(path):
+                return cls.open(path, key)
+            raise
+
+        utils.fsync_directory(path)
+        return cls(path, repository_key)
+
+    def chunk_name(self, data: bytes) -> str:
+        """Returns the name of a chunk, a keyed hash of its plaintext."""
+        return hmac.digest(self._name_key, data, 'sha256').hex()
+
+    def chunk_path(self, name: str) -> str:
+        """Returns the path of a chunk, inside a directory named by its first two characters."""
+        return os_join(self.path, CHUNKS_DIRECTORY, name[:2], name)
+
+    def store_chunk(self, data: bytes, codec: utils.compression.Codec, level: int, stats: Stats) -> str:
+        """Stores a chunk unless an identical one is stored already, returns its name.
+
+        data: bytes -> chunk plaintext
+        codec: Codec -> compression algorithm
+        level: int -> compression level
+        stats: Stats -> records the hash, compress, encrypt, write and deduplicated phases"""
+        with stats.measure('hash', len(data)):
+            name = self.chunk_name(data)
+        path = self.chunk_path(name)
+
+        if exists(path):
+            stats.record('deduplicated', 0, len(data), 1)
+            return name
+
+        with stats.measure('compress', len(data)):
+            plaintext = bytes((codec.identifier,)) + b''.join(utils.compress_chunks((data,), codec, level))
+
+        with stats.measure('encrypt', len(plaintext)):
+            token = self._cipher.encrypt(plaintext, name.encode())
+
+        with stats.measure('write', len(token)):
+            self._write(path, token)
+
+        return name
+
+    def load_chunk(self, name: str, stats: Stats) -> bytes:
+        """Returns the plaintext of a chunk, raise a CorruptedFile if it is missing, modified or replaced.
+
+        name: str -> chunk name
+        stats: Stats -> records the read, decrypt and decompress phases"""
+        try:
+            with open(self.chunk_path(name), 'rb') as chunk_file:
+                with stats.measure('read', fstat(chunk_file.fileno()).st_size):
+                    token = chunk_file.read()
+        except FileNotFoundError:
+            raise CorruptedFile(f'chunk {name} is missing')
+
+        try:
+            with stats.measure('decrypt', len(token)):
+                plaintext = self._cipher.decrypt(token, name.encode())
+        except InvalidToken:
+            raise TamperedBlock(f'chunk {name} was modified')
+
+        try:
+            codec = utils.codec_from_identifier(plaintext[0])
+        except IndexError:
+            raise CorruptedFile(f'chunk {name} is corrupted')
+        except ValueError as error:
+            raise UnsupportedCodec(f'chunk {name}: {error}')
+
+        try:
+            with stats.measure('decompress'):
+                data = b''.join(utils.decompress_chunks((memoryview(plaintext)[1:],), codec))
+        except ValueError as error:
+            raise CorruptedFile(f'chunk {name}: {error}')
+
+        if not hmac.compare_digest(self.chunk_name(data), name):
+            raise TamperedBlock(f'chunk {name} was replaced')
+
+        return data
+
+    def snapshots(self) -> list:
+        """Returns the snapshot names, oldest first."""
+        return sorted(
+            name for name in listdir(os_join(self.path, SNAPSHOTS_DIRECTORY))
+            if not name.endswith(constants.TEMPORAL_FILE_EXTENSION)
+        )
+
+    def save_snapshot(self, manifest: dict) -> str:
+        """Stores a snapshot manifest, returns its path."""
+        # Names sort by creation time
+        name = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H%M%S.%fZ-')
+        name += ''.join(choice(constants.ENCRYPTED_FILENAME_CHARSET) for _ in range(6))
+
+        token = self._cipher.encrypt(
+            zlib.compress(json.dumps(manifest, separators=(',', ':')).encode()),
+            b'snapshot ' + name.encode()
+        )
+
+        path = os_join(self.path, SNAPSHOTS_DIRECTORY, name)
+        self._write(path, token)
+
+        return path
+
+    def load_snapshot(self, name: str) -> dict:
+        """Returns a snapshot manifest, raise a CrycriptError if it does not exist or was modified.
+
+        name: str -> snapshot name, see snapshots()"""
+        try:
+            with open(os_join(self.path, SNAPSHOTS_DIRECTORY, basename(name)), 'rb') as snapshot_file:
+                token = snapshot_file.read()
+        except FileNotFoundError:
+            raise CrycriptError(f'snapshot {name} does not exist')
+
+        try:
+            return json.loads(zlib.decompress(self._cipher.decrypt(token, b'snapshot ' + basename(name).encode())))
+        except InvalidToken:
+            raise TamperedBlock(f'snapshot {name} was modified')
+        except (zlib.error, ValueError) as error:
+            raise CorruptedFile(f'snapshot {name} is corrupted: {error}')
+
+    def latest_snapshot(self, source: str) -> dict:
+        """Returns the manifest of the newest snapshot of a source path, None if there is none."""
+        for name in reversed(self.snapshots()):
+            manifest = self.load_snapshot(name)
+
+            if manifest['source'] == source:
+                return manifest
+
+        return None
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # Existing chunks are trusted by later backups, so they are only visible once they are complete on disk
+        makedirs(dirname(path), exist_ok=True)
+        descriptor, temporal_path = mkstemp(suffix=constants.TEMPORAL_FILE_EXTENSION, dir=dirname(path))
+
+        try:
+            with open(descriptor, 'wb') as temporal_file:
+                temporal_file.write(data)
+                temporal_file.flush()
+                fsync(temporal_file.fileno())
+            rename(temporal_path, path)
+        except OSError:
+            remove(temporal_path)
+            raise
+
+
+def backup(path: str, repository: str, key=None, stats: Stats = None) -> ActionResult:
+    """Stores a snapshot of a file or directory in a repository, raise a CrycriptError (or OSError) if it can not
+    be done.
+
+    Only files whose size or modification time changed since the last snapshot of the same path are read,
+    and only chunks that are not stored yet are encrypted and written. Sockets, pipes and devices are skipped
+    (counted by the skipped phase). See Repository for the structure.
+
+    path: str -> absolute path to file or directory to back up (it is never modified)
+    repository: str -> repository directory, created if it does not exist
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (key, scan, read, checksum, hash, compress, encrypt, write, snapshot),
+    plus the bytes of unchanged files and deduplicated chunks and the skipped entries, a new one if None"""
+    stats = Stats() if stats is None else stats
+
+    if abspath(repository).startswith(os_join(abspath(path), '')):
+        raise CrycriptError(f'{basename(path)}: repository can not be inside the backed up path')
+
+    try:
+        codec, level = utils.parse_compression(constants.DIRECTORY_COMPRESSION)
+    except ValueError as error:
+        raise UnsupportedCodec(str(error))
+
+    with stats.measure('key'):
+        if is_repository(repository):
+            repository = Repository.open(repository, key)
+        else:
+            try:
+                repository = Repository.create(repository, key)
+            except CrycriptError:
+                # Created by a concurrent backup after it was checked
+                if not is_repository(repository):
+                    raise
+                repository = Repository.open(repository, key)
+
+    start = time()
+
+    with stats.measure('scan'):
+        previous = repository.latest_snapshot(path)
+        entries = list(_scan(path, stats))
+
+    # Unchanged files point to the chunks of the previous snapshot, without being read
+    previous = {} if previous is None else {entry['path']: entry for entry in previous['entries']}
+    changed = []
+
+    for entry in entries:
+        if entry['type'] != 'file':
+            continue
+
+        old = previous.get(entry['path'])
+        if old is not None and old['type'] == 'file' and (old['size'], old['mtime_ns']) == (
+                entry['size'], entry['mtime_ns']):
+            entry['hash'], entry['chunks'] = old['hash'], old['chunks']
+            stats.record('unchanged', 0, entry['size'], 1)
+        else:
+            entry['chunks'] = []
+            changed.append(entry)
+
+    for entry, name in utils.ordered_map(
+            partial(_store_chunk, repository, codec, level, stats),
+            _read_changed(path, changed, stats)
+    ):
+        entry['chunks'].append(name)
+
+    manifest = {
+        'version': constants.STRING_VERSION,
+        'source': path,
+        'name': basename(path),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'chunk_size': constants.BACKUP_CHUNK_SIZE,
+        'entries': entries
+    }
+
+    with stats.measure('snapshot'):
+        snapshot_path = repository.save_snapshot(manifest)
+
+    return ActionResult('backup', path, snapshot_path, time() - start, stats)
+
+
+def restore(repository: str, destination: str, snapshot: str = None, key=None, stats: Stats = None) -> ActionResult:
+    """Restores a snapshot of a repository inside a directory, raise a CrycriptError (or OSError) if it can not be done.
+
+    Every chunk is authenticated, and every file is checked against the hash recorded when it was backed up.
+
+    repository: str -> repository directory
+    destination: str -> directory where the backed up file or directory is restored (with its original name),
+    created if it does not exist
+    snapshot: str -> snapshot name, the newest one if None (see snapshots())
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (key, read, decrypt, decompress, write), a new one if None"""
+    stats = Stats() if stats is None else stats
+
+    with stats.measure('key'):
+        repository = Repository.open(repository, key)
+
+    start = time()
+
+    names = repository.snapshots()
+    if not names:
+        raise CrycriptError(f'{basename(repository.path)}: repository has no snapshots')
+
+    snapshot = names[-1] if snapshot is None else basename(snapshot)
+    manifest = repository.load_snapshot(snapshot)
+
+    root = os_join(destination, manifest['name'])
+    if lexists(root):
+        raise CrycriptError(f'{manifest["name"]}: path already exists')
+
+    makedirs(destination, exist_ok=True)
+
+    directories = []
+
+    for entry in manifest['entries']:
+        target = os_join(destination, manifest['name'], *entry['path'].split('/')) if entry['path'] else root
+
+        if entry['type'] == 'directory':
+            makedirs(target, exist_ok=True)
+            directories.append((target, entry))
+        elif entry['type'] == 'symlink':
+            symlink(entry['target'], target)
+        else:
+            _restore_file(repository, entry, target, stats)
+
+    # Children change the modification time of their parent, so directories go last, deepest first
+    for target, entry in reversed(directories):
+        chmod(target, entry['mode'])
+        utime(target, ns=(entry['mtime_ns'], entry['mtime_ns']))
+
+    return ActionResult('restore', os_join(repository.path, SNAPSHOTS_DIRECTORY, snapshot), root, time() - start, stats)
+
+
+def snapshots(repository: str, key=None) -> list:
+    """Returns the SnapshotInfo of every snapshot of a repository, oldest first.
+
+    repository: str -> repository directory
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)"""
+    repository = Repository.open(repository, key)
+    infos = []
+
+    for name in repository.snapshots():
+        manifest = repository.load_snapshot(name)
+        files = [entry for entry in manifest['entries'] if entry['type'] == 'file']
+
+        infos.append(SnapshotInfo(
+            name, manifest['source'], manifest['created'], len(files), sum(entry['size'] for entry in files)
+        ))
+
+    return infos
+
+
+def _scan(path: str, stats: Stats) -> Iterator[dict]:
+    for tree_entry in utils.scan_tree(path):
+        status = tree_entry.status
+        entry = {'path': tree_entry.relative_path, 'mode': S_IMODE(status.st_mode), 'mtime_ns': status.st_mtime_ns}
+
+        if S_ISLNK(status.st_mode):
+            yield {**entry, 'type': 'symlink', 'target': readlink(tree_entry.path)}
+        elif S_ISDIR(status.st_mode):
+            yield {**entry, 'type': 'directory'}
+        elif S_ISREG(status.st_mode):
+            yield {**entry, 'type': 'file', 'size': status.st_size}
+        else:
+            # Opening a pipe would wait for a writer, sockets and devices have no contents to back up
+            stats.record('skipped', 0, 0, 1)
+
+
+def _read_changed(path: str, entries: list, stats: Stats) -> Iterator[tuple]:
+    for entry in entries:
+        file_path = os_join(path, *entry['path'].split('/')) if entry['path'] else path
+        file_hash = sha256()
+        size = 0
+
+        with open(file_path, 'rb') as original_file:
+            for data in stats.iterate('read', iter(partial(original_file.read, constants.BACKUP_CHUNK_SIZE), b'')):
+                with stats.measure('checksum', len(data)):
+                    file_hash.update(data)
+                size += len(data)
+
+                yield entry, data
+
+        # The file may have changed since it was scanned, the snapshot records what was read
+        entry['hash'], entry['size'] = file_hash.hexdigest(), size
+
+
+def _store_chunk(repository: Repository, codec, level: int, stats: Stats, entry: dict, data: bytes) -> tuple:
+    return entry, repository.store_chunk(data, codec, level, stats)
+
+
+def _restore_file(repository: Repository, entry: dict, target: str, stats: Stats) -> None:
+    file_hash = sha256()
+
+    with open(target, 'wb') as restored_file:
+        for data in utils.ordered_map(
+                partial(repository.load_chunk, stats=stats),
+                ((name,) for name in entry['chunks'])
+        ):
+            file_hash.update(data)
+
+            with stats.measure('write', len(data)):
+                restored_file.write(data)
+
+    if file_hash.hexdigest() != entry['hash']:
+        raise CorruptedFile(f'{entry["path"] or basename(target)}: restored contents do not match the snapshot')
+
+    chmod(target, entry['mode'])
+    utime(target, ns=(entry['mtime_ns'], entry['mtime_ns']))
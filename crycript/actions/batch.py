@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import basename
+from threading import Lock
+from time import time
+from typing import Callable, NamedTuple
+
+from tqdm import tqdm
+
+from crycript import constants, utils
+from crycript.utils.stats import Stats
+from .results import VerifyResult
+
+# Phases whose bytes are the input of an action (the file, tar or pack read), they advance the progress bar
+PROGRESS_PHASES: tuple = ('read', 'tar', 'pack')
+
+
+class BatchResult(NamedTuple):
+    """Outcome of one path of a batch run, stats is None if it failed."""
+    path: str
+    succeeded: bool
+    message: str
+    seconds: float
+    size: int
+    stats: Stats = None
+
+
+def run_batch(action: Callable, paths: list, *arguments, workers: int = None, trees: dict = None) -> list:
+    """Runs action(path, *arguments) for every path, up to workers paths at once, returns their BatchResult in order.
+
+    A path that fails (any exception) is reported in its result, the other paths keep going.
+    One progress bar shows the bytes of all paths, advanced as every chunk is read (through the stats of each
+    action, see PROGRESS_PHASES), per-path progress bars and messages are disabled meanwhile.
+
+    action: Callable -> encrypt, decrypt, change_password, verify, extract or backup (it takes a stats keyword)
+    paths: list -> absolute paths to process
+    arguments -> keys passed to action, use a KeyProvider (or bytes) so no password is asked per path
+    workers: int -> number of paths processed at once, crycript.constants.BATCH_WORKERS if None
+    trees: dict -> directories scanned by utils.path_validator(trees), they size the progress bar and are given
+    to action (encrypt) as its entries, so they are not scanned again"""
+    workers = constants.BATCH_WORKERS if workers is None else workers
+    trees = {} if trees is None else trees
+    sizes = [_path_size(path, trees.get(path)) for path in paths]
+    results = [None] * len(paths)
+    done, failures = 0, 0
+
+    quiet = constants.QUIET
+    constants.QUIET = True
+
+    try:
+        with tqdm(
+                total=sum(sizes),
+                desc=action.__name__,
+                dynamic_ncols=True,
+                unit='B',
+                unit_scale=True,
+                disable=quiet
+        ) as progress_bar:
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                futures = {
+                    executor.submit(
+                        _run_path, action, path, _ProgressStats(progress_bar, size), arguments, trees.get(path)
+                    ): i
+                    for i, (path, size) in enumerate(zip(paths, sizes))
+                }
+
+                for future in as_completed(futures):
+                    result = results[futures[future]] = future.result()
+                    done += 1
+
+                    if not result.succeeded:
+                        failures += 1
+                        progress_bar.write(f'{basename(result.path)}: {result.message}')
+
+                    progress_bar.set_postfix(files=f'{done}/{len(paths)}', failed=failures)
+    finally:
+        constants.QUIET = quiet
+
+    return results
+
+
+def batch_summary(results: list, seconds: float) -> dict:
+    """Returns a JSON serializable summary of a batch run, with totals and every path.
+
+    results: list -> BatchResult returned by run_batch()
+    seconds: float -> duration of the whole run"""
+    size = sum(result.size for result in results)
+
+    return {
+        'paths': len(results),
+        'succeeded': sum(result.succeeded for result in results),
+        'failed': sum(not result.succeeded for result in results),
+        'bytes': size,
+        'seconds': round(seconds, 4),
+        'bytes_per_second': round(size / seconds) if seconds > 0 else None,
+        'results': [
+            {**result._asdict(), 'stats': None if result.stats is None else result.stats.as_dict()}
+            for result in results
+        ]
+    }
+
+
+def _path_size(path: str, entries: list) -> int:
+    # Paths that can not be read count as empty, their action reports why
+    try:
+        return utils.tree_size(path, entries)
+    except OSError:
+        return 0
+
+
+class _ProgressStats(Stats):
+    # Stats of one path that advance the shared progress bar by the bytes read, up to the size of the path
+    _bar_lock = Lock()
+
+    def __init__(self, progress_bar: tqdm, size: int):
+        super().__init__()
+        self.progress_bar = progress_bar
+        self.size = size
+        self.reported = 0
+
+    def record(self, phase: str, seconds: float, size: int = 0, chunks: int = 0) -> None:
+        super().record(phase, seconds, size, chunks)
+
+        if phase in PROGRESS_PHASES:
+            self.advance(size)
+
+    def advance(self, size: int) -> None:
+        with self._bar_lock:
+            size = min(size, self.size - self.reported)
+
+            if size > 0:
+                self.reported += size
+                self.progress_bar.update(size)
+
+
+def _run_path(action: Callable, path: str, stats: _ProgressStats, arguments: tuple, entries: list) -> BatchResult:
+    start = time()
+    options = {'stats': stats} if entries is None else {'stats': stats, 'entries': entries}
+
+    try:
+        result = action(path, *arguments, **options)
+    except (utils.CrycriptError, OSError) as error:
+        return BatchResult(path, False, f'Aborted: {error}', round(time() - start, 4), stats.size)
+    except Exception as error:
+        # A bug in one path must not lose the results of the others
+        return BatchResult(path, False, f'Aborted: {type(error).__name__}: {error}', round(time() - start, 4),
+                           stats.size)
+    finally:
+        # Paths that fail, or read less than their size (compressed, headers only...), still complete the bar
+        stats.advance(stats.size)
+
+    # Corrupted files are reported by verify(), not raised
+    succeeded = not isinstance(result, VerifyResult) or not result.corrupted_frames
+
+    return BatchResult(path, succeeded, str(result), round(time() - start, 4), stats.size, result.stats)
+
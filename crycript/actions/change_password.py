@@ -1,84 +1,152 @@
+from io import BytesIO
 from os import rename
-from os.path import basename, dirname, join as os_join
+from os.path import basename, dirname, getsize, join as os_join
+from shutil import copyfileobj
 from time import sleep, time
 
 from cryptography.fernet import Fernet
 from cryptography.fernet import InvalidToken
 
 from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.errors import InvalidKey, InvalidPassword, TamperedBlock, UnsupportedCipher
+from crycript.utils.stats import Stats
+from .results import ActionResult
 
 
-def change_password(path: str, old_key: bytes = None, new_key: bytes = None) -> str:
-    """Changes the password_to_key() key, marked with >>> <<< in Encrypted file structure:
+def change_password(path: str, old_key=None, new_key=None, stats: Stats = None) -> ActionResult:
+    """Changes the password_to_key() key, marked with >>> <<< in Encrypted file structure,
+    raise a CrycriptError (or OSError) if it can not be done:
 
     path: str -> absolute path to encrypted crycript file
-    old_key: bytes -> valid cryptography.fernet.Fernet key
-    new_key: bytes -> valid cryptography.fernet.Fernet key
+    old_key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    new_key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (header, key, write), a new one if None
 
-    Encrypted file structure: [] represents a file line
+    Encrypted file structure: [] represents a binary field (see encrypt() for the complete structure)
+
+    [Encryption version (YYYY.MM.DD)][\\n]
+    [File key,>>> encrypted using the key generated with password_to_key() <<< (fixed size)]
+    [Public fields length (uint32)][Public fields (>>> random password salt <<<)]
+    [Metadata length (uint32)][Encrypted original filename, >>> authenticates the salt <<<]
+    ...
+
+    Legacy (2021.05.06) encrypted file structure: [] represents a file line
 
     [Encryption version (YYYY.MM.DD)]
     [Fernet keys used for decryption,>>> encrypted using the key generated with password_to_key() <<<]
     [Encrypted original filename]
     [Encrypted contents 1]
-    [Encrypted contents 2]
-    [Encrypted contents 3]
     ...
-    [Encrypted contents n-2]
-    [Encrypted contents n-1]
     [Encrypted contents n]
 
-    Where n is file size (in bytes) divided by crycript.constants.ENCRYPTION_BUFFER_SIZE, rounded up with math.ceil"""
-    if type(old_key) != bytes:
-        old_cipher = Fernet(utils.password_to_key(
-            confirm_password=False,
-            password_message='Old Password: ',
-            generate_token=False)
-        )
-    else:
-        try:
-            old_cipher = Fernet(old_key)
-        except (ValueError, Exception):
-            utils.kill('Aborted: key is invalid')
-
-    if type(new_key) != bytes:
-        new_cipher = Fernet(utils.password_to_key(
-            confirm_password=True,
-            password_message='New Password: ')
-        )
-    else:
-        try:
-            new_cipher = Fernet(new_key)
-        except (ValueError, Exception):
-            utils.kill('Aborted: key is invalid')
+    The header is rewritten in place when its size does not change (always, unless a password replaces a raw key or
+    the other way around), so the time needed does not depend on the file size. See container.rewrite_header()."""
+    old_options = {'confirm_password': False, 'password_message': 'Old Password: '}
+    new_options = {'confirm_password': True, 'password_message': 'New Password: ', 'use_agent': False}
+
+    stats = Stats() if stats is None else stats
 
-    start = time()
+    # Undo a previous password change that was interrupted
+    with stats.measure('header'):
+        container.recover_header(path)
 
     with open(path, 'rb') as old_file:
         version = old_file.readline()
 
-        try:
-            encrypted_keys = new_cipher.encrypt(
-                old_cipher.decrypt(
-                    old_file.readline()[:-1]
+        if version[:-1] == constants.LEGACY_BYTES_VERSION:
+            with stats.measure('key'):
+                old_cipher = _key_cipher(utils.file_key(old_key, None, **old_options))
+                new_cipher = _key_cipher(utils.new_file_key(new_key, token=True, **new_options)[1])
+
+            start = time()
+
+            encrypted_keys = old_file.readline()
+            header_size = len(version) + len(encrypted_keys)
+
+            try:
+                encrypted_keys = new_cipher.encrypt(
+                    old_cipher.decrypt(
+                        encrypted_keys[:-1]
+                    )
+                )
+            except InvalidToken:
+                sleep(constants.INVALID_PASSWORD_DELAY)
+                raise InvalidPassword('invalid password')
+
+            new_header = version + encrypted_keys + b'\n'
+        else:
+            old_file.seek(0)
+            with stats.measure('header'):
+                header = container.read_header(old_file, basename(path))
+            header_size = header.size
+
+            try:
+                engine = utils.cipher_from_identifier(header.cipher)
+            except ValueError as error:
+                raise UnsupportedCipher(f'{basename(path)}: {error}')
+
+            with stats.measure('key'):
+                old_cipher = _key_cipher(
+                    utils.file_key(old_key, header.fields.get(container.FIELD_SALT), **old_options)
                 )
-            )
-        except InvalidToken:
-            sleep(constants.INVALID_PASSWORD_DELAY)
-            utils.kill('Aborted: invalid password')
+                new_salt, new_key = utils.new_file_key(new_key, **new_options)
+                new_cipher = _key_cipher(new_key)
+
+            start = time()
+
+            try:
+                file_key = old_cipher.decrypt(header.wrapped_key)
+            except InvalidToken:
+                sleep(constants.INVALID_PASSWORD_DELAY)
+                raise InvalidPassword('invalid password')
+
+            # The salt is authenticated by the metadata, which must be encrypted again
+            fields = dict(header.fields)
+            fields.pop(container.FIELD_SALT, None)
+            if new_salt is not None:
+                fields[container.FIELD_SALT] = new_salt
+            raw_fields = container.encode_fields(fields)
+
+            file_cipher = engine.file_cipher(file_key)
+
+            try:
+                metadata = container.seal_metadata(
+                    file_cipher, header.version, raw_fields,
+                    container.open_metadata(file_cipher, header.version, header.raw_fields, header.metadata)
+                )
+            except InvalidToken:
+                raise TamperedBlock('header was modified')
+
+            new_header = BytesIO()
+            container.write_header(new_header, new_cipher.encrypt(file_key), raw_fields, metadata)
+            new_header = new_header.getvalue()
 
-        with open(path + constants.TEMPORAL_FILE_EXTENSION, 'wb') as new_file:
-            new_file.write(version)
+        in_place = len(new_header) == header_size and not constants.PRESERVE_ORIGINAL_FILES
 
-            new_file.write(encrypted_keys)
-            new_file.write(b'\n')
+        if not in_place:
+            with stats.measure('write', getsize(path)):
+                with open(path + constants.TEMPORAL_FILE_EXTENSION, 'wb') as new_file:
+                    new_file.write(new_header)
 
-            for line in old_file:
-                new_file.write(line)
+                    copyfileobj(old_file, new_file, constants.ENCRYPTION_BUFFER_SIZE)
 
-    if not constants.PRESERVE_ORIGINAL_FILES:
+    if in_place:
+        with stats.measure('write', len(new_header)):
+            container.rewrite_header(path, new_header)
+        new_path = path
+    elif not constants.PRESERVE_ORIGINAL_FILES:
         rename(path + constants.TEMPORAL_FILE_EXTENSION, path)
-        return f'Password updated in {round((time() - start), 4)} seconds'
+        new_path = path
     else:
-        rename(path + constants.TEMPORAL_FILE_EXTENSION, os_join(dirname(path), 'new-' + basename(path)))
-        return f'{basename(path)} -> {"new-" + basename(path)} in {round((time() - start), 4)} seconds'
+        new_path = os_join(dirname(path), 'new-' + basename(path))
+        rename(path + constants.TEMPORAL_FILE_EXTENSION, new_path)
+
+    return ActionResult('change_password', path, new_path, time() - start, stats)
+
+
+def _key_cipher(key: bytes) -> Fernet:
+    try:
+        return Fernet(key)
+    except (ValueError, Exception):
+        raise InvalidKey('key is invalid')
@@ -1,22 +1,40 @@
-from os import remove, listdir
-from os.path import dirname, join as os_join, basename
+from functools import partial
+from io import BufferedReader
+from os import remove, rename
+from os.path import dirname, exists, join as os_join, basename, getsize, lexists
 from random import choice
+from tarfile import TarError
+from tempfile import mkdtemp
 from time import sleep, time
+from typing import Callable, Iterator
 
 from cryptography.fernet import Fernet
 from cryptography.fernet import InvalidToken
 from tqdm import tqdm
 
 from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.ciphers import FrameCipher
+from crycript.utils.errors import CorruptedFile, CrycriptError, InvalidPassword, TamperedBlock
+from crycript.utils.stats import Stats
+from .headers import key_cipher, open_header
+from .reading import EncryptedFileReader
+from .results import ActionResult
 
 
-def decrypt(path: str, key: bytes = None) -> str:
-    """Decrypts an encrypted crycript file:
+def decrypt(path: str, key=None, stats: Stats = None) -> ActionResult:
+    """Decrypts an encrypted crycript file, raise a CrycriptError (or OSError) if it can not be done:
 
     path: str -> absolute path to encrypted crycript file
-    key: bytes -> valid cryptography.fernet.Fernet key
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (header, key, read, decrypt, decompress, write and commit or extract, delete),
+    a new one if None
 
-    Encrypted file structure: [] represents a file line
+    Directories (and packs, see utils.pack_chunks()) are extracted in the same directory, if they do not exist there.
+
+    Files are read using the structure of their version, see encrypt() for the current one.
+
+    Legacy (2021.05.06) encrypted file structure: [] represents a file line
 
     [Encryption version (YYYY.MM.DD)]
     [Fernet keys used for decryption, encrypted using the key generated with password_to_key()]
@@ -31,68 +49,223 @@ def decrypt(path: str, key: bytes = None) -> str:
 
     Where n is file size (in bytes) divided by crycript.constants.ENCRYPTION_BUFFER_SIZE, rounded up with math.ceil"""
 
-    if type(key) != bytes:
-        key_cipher = Fernet(utils.password_to_key(confirm_password=False, generate_token=False))
-    else:
-        try:
-            key_cipher = Fernet(key)
-        except (ValueError, Exception):
-            utils.kill('Aborted: key is invalid')
-
+    stats = Stats() if stats is None else stats
     start = time()
 
     filename = basename(path)
     parent_dir = dirname(path)
 
+    # Undo a password change that was interrupted
+    with stats.measure('header'):
+        container.recover_header(path)
+
     with open(path, 'rb') as original_file:
-        original_file.readline()
+        version = original_file.readline()[:-1]
+        original_file.seek(0)
+
+        if version == constants.LEGACY_BYTES_VERSION:
+            with stats.measure('key'):
+                wrapping_cipher = key_cipher(key, None)
+
+            new_filename = _decrypt_lines(original_file, wrapping_cipher, filename, parent_dir, stats)
+        else:
+            new_filename = _decrypt_frames(original_file, key, filename, parent_dir, getsize(path), stats)
+
+    if not constants.PRESERVE_ORIGINAL_FILES:
+        with stats.measure('delete'):
+            remove(path)
+
+    if new_filename.endswith(constants.TAR_GZ_FILE_EXTENSION):
+        # Legacy files contain the tar gz itself
+        with stats.measure('extract'):
+            utils.tar_gz_to_directory(os_join(parent_dir, new_filename), parent_dir)
+        new_filename = new_filename[:-1 * len(constants.TAR_GZ_FILE_EXTENSION)]
+
+    return ActionResult('decrypt', path, os_join(parent_dir, new_filename), time() - start, stats)
+
+
+def _available_filename(new_filename: str, parent_dir: str) -> str:
+    # The file is created, so another decryption can not choose the same filename
+    return utils.reserve_filename(parent_dir, _prefixed_filenames(new_filename))
+
+
+def _prefixed_filenames(new_filename: str) -> Iterator[str]:
+    while True:
+        yield new_filename
+        new_filename = choice(constants.ENCRYPTED_FILENAME_CHARSET) + new_filename
+
+
+def _decrypt_frames(original_file, key, filename: str, parent_dir: str, size: int, stats: Stats) -> str:
+    header, file_cipher, new_filename, codec = open_header(original_file, key, filename, stats)
+
+    # Packs are extracted member by member, after reading their index
+    if new_filename.endswith(constants.PACK_FILE_EXTENSION):
+        new_filename = new_filename[:-1 * len(constants.PACK_FILE_EXTENSION)]
+        contents = EncryptedFileReader.from_header(original_file, header, file_cipher, codec)
+
+        with stats.measure('extract', size - header.size):
+            with BufferedReader(contents) as pack_file:
+                pack = utils.PackReader(pack_file)
+                _extract_directory(partial(pack.extract, pack.entries()), new_filename, parent_dir, filename)
+
+        return new_filename
+    directory = new_filename.endswith(constants.TAR_GZ_FILE_EXTENSION)
+
+    # Directories are extracted while decrypting, without writing the archive to disk
+    if directory:
+        new_filename = new_filename[:-1 * len(constants.TAR_GZ_FILE_EXTENSION)]
+        new_path = None
+    else:
+        new_filename = _available_filename(new_filename, parent_dir)
+        new_path = os_join(parent_dir, new_filename)
 
-        try:
-            file_keys = tuple(key_cipher.decrypt(original_file.readline()[:-1]).split(b' '))
-        except InvalidToken:
-            sleep(constants.INVALID_PASSWORD_DELAY)
-            utils.kill('Aborted: invalid password')
+    index = 0
 
-        try:
-            file_ciphers = tuple(Fernet(key) for key in file_keys)
-        except (ValueError, Exception):
-            utils.kill('Aborted: key block was replaced')
+    def decrypted_chunks():
+        nonlocal index
 
-        del file_keys
-        del key_cipher
+        with tqdm(
+                total=size - header.size,
+                desc=filename,
+                leave=False,
+                dynamic_ncols=True,
+                unit='B',
+                unit_scale=True,
+                disable=constants.QUIET
+        ) as progress_bar:
+            for data, frame_size in utils.ordered_map(
+                    partial(_open_payload, file_cipher, stats),
+                    stats.iterate('read', container.iter_frames(
+                        original_file, header.maximum_payload, utils.chunks_in_flight() + 2
+                    ), _payload_size)
+            ):
+                yield data
+                progress_bar.update(frame_size)
+                index += 1
 
-        try:
-            new_filename = file_ciphers[0].decrypt(original_file.readline()[:-1]).decode()
-        except InvalidToken:
-            utils.kill('Aborted: filename block was replaced')
+        if original_file.read(1):
+            raise EOFError('has unexpected data after the final frame')
 
-        while new_filename in listdir(parent_dir):
-            new_filename = choice(constants.ENCRYPTED_FILENAME_CHARSET) + new_filename
+    try:
+        chunks = utils.decompress_chunks(decrypted_chunks(), codec, header.chunk_size)
+        if codec.name != 'none':
+            chunks = stats.iterate('decompress', chunks)
 
-        with open(os_join(parent_dir, new_filename), 'wb') as decrypted_file:
-            for line, cipher in enumerate(tqdm(
-                    file_ciphers[1:],
+        if new_path is None:
+            with stats.measure('extract'):
+                _extract_directory(partial(utils.tar_stream_to_directory, chunks), new_filename, parent_dir, filename)
+        else:
+            # Contents go to a temporal file, the reserved filename only ever holds complete contents
+            with open(new_path + constants.TEMPORAL_FILE_EXTENSION, 'wb') as decrypted_file:
+                for data in chunks:
+                    with stats.measure('write', len(data)):
+                        decrypted_file.write(data)
+
+            with stats.measure('commit'):
+                utils.commit_file(new_path + constants.TEMPORAL_FILE_EXTENSION, new_path)
+    except (EOFError, InvalidToken, TarError, ValueError, OSError) as error:
+        if new_path is not None:
+            _discard_output(new_path)
+
+        if isinstance(error, OSError):
+            raise
+        elif isinstance(error, container.MalformedFrame):
+            raise CorruptedFile(f'encrypted frame {index + 1} is malformed: {error}') from error
+        elif isinstance(error, InvalidToken):
+            raise TamperedBlock(f'encrypted frame {index + 1} was modified', index) from error
+        elif isinstance(error, EOFError):
+            raise CorruptedFile(f'encrypted file {str(error) or "is truncated"}') from error
+        else:
+            raise CorruptedFile(f'decrypted contents are corrupted: {error}') from error
+
+    return new_filename
+
+
+def _extract_directory(extract: Callable, new_filename: str, parent_dir: str, filename: str):
+    # Runs extract(directory) in a temporal sibling directory, its new_filename is moved into place once complete:
+    # an existing directory is never merged into, and a failed extraction leaves nothing behind
+    new_path = os_join(parent_dir, new_filename)
+    if lexists(new_path):
+        raise CrycriptError(f'{filename}: {new_filename} already exists, move it to decrypt')
+
+    temporal_path = mkdtemp(suffix=constants.TEMPORAL_FILE_EXTENSION, dir=parent_dir)
+
+    try:
+        extract(temporal_path)
+        rename(os_join(temporal_path, new_filename), new_path)
+    finally:
+        utils.delete_directory(temporal_path)
+
+
+def _payload_size(frame: tuple) -> int:
+    return len(frame[2])
+
+
+def _open_payload(file_cipher: FrameCipher, stats: Stats, index: int, flags: int, payload: bytes) -> tuple:
+    with stats.measure('decrypt', len(payload)):
+        return container.open_frame(file_cipher, index, flags, payload), len(payload)
+
+
+def _decrypt_lines(original_file, key_cipher: Fernet, filename: str, parent_dir: str, stats: Stats) -> str:
+    original_file.readline()
+
+    try:
+        file_keys = tuple(key_cipher.decrypt(original_file.readline()[:-1]).split(b' '))
+    except InvalidToken:
+        sleep(constants.INVALID_PASSWORD_DELAY)
+        raise InvalidPassword('invalid password')
+
+    del key_cipher
+
+    # Ciphers are created one line at a time, the key block holds one key per line of the file
+    try:
+        new_filename = _line_cipher(file_keys[0]).decrypt(original_file.readline()[:-1]).decode()
+    except InvalidToken:
+        raise TamperedBlock('filename block was replaced')
+
+    new_filename = _available_filename(new_filename, parent_dir)
+    new_path = os_join(parent_dir, new_filename)
+
+    try:
+        with open(new_path + constants.TEMPORAL_FILE_EXTENSION, 'wb') as decrypted_file:
+            for line, line_key in enumerate(tqdm(
+                    file_keys[1:],
                     desc=filename,
                     leave=False,
-                    dynamic_ncols=True
+                    dynamic_ncols=True,
+                    disable=constants.QUIET
             )):
                 try:
-                    decrypted_file.write(
-                        cipher.decrypt(
+                    with stats.measure('decrypt'):
+                        data = _line_cipher(line_key).decrypt(
                             original_file.readline()[:-1]
                         )
-                    )
+
+                    with stats.measure('write', len(data)):
+                        decrypted_file.write(data)
                 except InvalidToken:
-                    remove(os_join(parent_dir, new_filename))
-                    utils.kill(f'Aborted: encrypted block line {line + 4} was modified')
+                    raise TamperedBlock(f'encrypted block line {line + 4} was modified', line)
 
-    if not constants.PRESERVE_ORIGINAL_FILES:
-        remove(path)
+        with stats.measure('commit'):
+            utils.commit_file(new_path + constants.TEMPORAL_FILE_EXTENSION, new_path)
+    except (TamperedBlock, OSError):
+        _discard_output(new_path)
+        raise
+
+    return new_filename
+
+
+def _line_cipher(key: bytes) -> Fernet:
+    try:
+        return Fernet(key)
+    except (ValueError, Exception):
+        raise TamperedBlock('key block was replaced')
 
-    if new_filename.endswith(constants.TAR_GZ_FILE_EXTENSION):
-        utils.tar_gz_to_directory(os_join(parent_dir, new_filename), parent_dir)
-        new_filename = new_filename[:-1 * len(constants.TAR_GZ_FILE_EXTENSION)]
 
-    end = time()
+def _discard_output(new_path: str):
+    # Removes the temporal file and the (still empty) reserved filename
+    if exists(new_path + constants.TEMPORAL_FILE_EXTENSION):
+        remove(new_path + constants.TEMPORAL_FILE_EXTENSION)
 
-    return f'{filename} -> {new_filename} in {round((end - start), 4)} seconds'
+    if exists(new_path):
+        remove(new_path)
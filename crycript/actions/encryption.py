@@ -1,117 +1,352 @@
-from math import ceil
-from os import remove, listdir
-from os.path import isdir, dirname, join as os_join, getsize, basename
+from functools import partial
+from io import BufferedReader
+import json
+from os import fsync, remove, stat
+from os.path import isdir, dirname, exists, join as os_join, getsize, basename
 from random import choice
+from tarfile import TarError
 from time import time
+from typing import Iterator
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from tqdm import tqdm
 
 from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.ciphers import CIPHERS, FrameCipher
+from crycript.utils.errors import CorruptedFile, CrycriptError, InvalidKey, UnsupportedCipher, UnsupportedCodec
+from crycript.utils.stats import Stats
+from .headers import open_header
+from .results import ActionResult
 
 
-def encrypt(path: str, key: bytes = None) -> str:
-    """Encrypts a file or directory:
+def encrypt(path: str, key=None, stats: Stats = None, entries: list = None) -> ActionResult:
+    """Encrypts a file or directory, raise a CrycriptError (or OSError) if it can not be done:
 
     path: str -> absolute path to file or directory to encrypt
-    key: bytes -> valid cryptography.fernet.Fernet key
-
-    Encrypted file structure: [] represents a file line
-
-    [Encryption version (YYYY.MM.DD)]
-    [Fernet keys used for encryption, encrypted using the key generated with password_to_key()]
-    [Encrypted original filename]
-    [Encrypted contents 1]
-    [Encrypted contents 2]
-    [Encrypted contents 3]
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (key, scan, read or tar or pack, compress, encrypt, write, checkpoint,
+    commit, delete), a new one if None
+    entries: list -> scan_tree() result of a directory, from utils.path_validator(trees), it is scanned if None
+
+    Directories are archived as a tar, or as a pack with crycript.constants.PACK_DIRECTORIES (see
+    utils.pack_chunks()): single files of a pack can be listed and extracted without decrypting the others.
+    The tree is scanned once, the scan also gives the total of the progress bar
+
+    Contents are written to a temporal file, then synced and renamed to the reserved .cry filename, so a crash
+    never leaves a partial .cry file behind. Every encryption is recorded in a progress journal (original path +
+    crycript.constants.PROGRESS_FILE_EXTENSION), the next encryption of the same path removes the output of one that
+    was interrupted. Uncompressed files update it every crycript.constants.PROGRESS_JOURNAL_INTERVAL bytes: with
+    crycript.constants.RESUME_ENCRYPTION an interrupted encryption continues after its last complete chunk
+    (aes-256-gcm and chacha20-poly1305 always start over, their nonces must never seal different chunks)
+
+    Encrypted file structure: [] represents a binary field
+
+    [Encryption version (YYYY.MM.DD)][\\n]
+    [File key, encrypted using the key generated with password_to_key() (fixed size)]
+    [Public fields length (uint32)][Public fields (compression codec, random password salt, chunk size, cipher)]
+    [Metadata length (uint32)][Encrypted original filename, authenticates version and public fields]
+    [Frame 1 length (uint32)][Frame 1 flags (uint8)][Encrypted contents 1]
+    [Frame 2 length (uint32)][Frame 2 flags (uint8)][Encrypted contents 2]
     ...
-    [Encrypted contents n-2]
-    [Encrypted contents n-1]
-    [Encrypted contents n]
+    [Frame n length (uint32)][Frame n flags (uint8)][Encrypted contents n]
 
-    Where n is file size (in bytes) divided by crycript.constants.ENCRYPTION_BUFFER_SIZE, rounded up with math.ceil"""
+    The key of every chunk is derived from the file key and the frame index (HKDF-SHA256) when it is needed, so
+    the header has the same size for any file and no chunk key is stored. The cipher engine (crycript.constants.
+    CIPHER) is recorded in the public fields: with fernet-wrapped (files of older versions) every frame starts with
+    a random chunk key encrypted using the file key, with aes-256-gcm or chacha20-poly1305 contents are encrypted
+    using the file key and a nonce made from the frame index.
 
-    if type(key) != bytes:
-        key_cipher = Fernet(utils.password_to_key())
-    else:
-        try:
-            key_cipher = Fernet(key)
-        except (ValueError, Exception):
-            utils.kill('Aborted: key is invalid')
+    Where n is the (compressed) size in bytes divided by the chunk size, rounded up with math.ceil (at least 1).
+    The chunk size is crycript.constants.ENCRYPTION_BUFFER_SIZE, or an automatic one (see utils.chunk_size()),
+    and is recorded in the public fields. The last frame is flagged as final. Every frame is authenticated together
+    with its index and flags, so frames can not be reordered, dropped or truncated"""
 
-    start = time()
+    stats = Stats() if stats is None else stats
 
     filename = basename(path)
     parent_dir = dirname(path)
 
-    compressed_filename = None
-    compressed_path = None
-
-    while True:
-        if len(filename) >= constants.ENCRYPTED_FILENAME_ORIGINAL_CHARS:
-            new_filename = filename[:constants.ENCRYPTED_FILENAME_ORIGINAL_CHARS]
-        else:
-            new_filename = filename
-
-        new_filename += '-'
-
-        for _ in range(constants.ENCRYPTED_FILENAME_RANDOM_CHARS):
-            new_filename += choice(constants.ENCRYPTED_FILENAME_CHARSET)
-
-        new_filename += constants.ENCRYPTED_FILE_EXTENSION
+    try:
+        codec, level = utils.parse_compression(
+            constants.DIRECTORY_COMPRESSION if isdir(path) else constants.FILE_COMPRESSION
+        )
+    except ValueError as error:
+        raise UnsupportedCodec(str(error))
+
+    try:
+        engine = utils.parse_cipher(constants.CIPHER)
+    except ValueError as error:
+        raise UnsupportedCipher(str(error))
+
+    # Packs compress every member on its own, so each one can be read without the others
+    pack = isdir(path) and constants.PACK_DIRECTORIES
+    if pack:
+        member_codec, member_level = codec, level
+        codec, level = utils.parse_compression('none')
+
+    # Uncompressed files can be resumed: their frames map to fixed positions of the original file
+    resumable = not isdir(path) and codec.name == 'none' and engine.resumable
+    progress_path = path + constants.PROGRESS_FILE_EXTENSION
+    progress = _load_progress(path, progress_path, resumable)
+
+    if progress is None:
+        with stats.measure('key'):
+            salt, key = utils.new_file_key(key)
 
-        if new_filename not in listdir(parent_dir):
-            break
-
-    if isdir(path):
-        compressed_filename = filename + constants.TAR_GZ_FILE_EXTENSION
-        compressed_path = path + constants.TAR_GZ_FILE_EXTENSION
-
-        utils.path_to_tar_gz(path, compressed_path)
-
-    working_path = compressed_path if compressed_path else path
-    working_filename = compressed_filename if compressed_filename else filename
-
-    rounds = ceil(getsize(working_path) / constants.ENCRYPTION_BUFFER_SIZE)
+        try:
+            key_cipher = Fernet(key)
+        except (ValueError, Exception):
+            raise InvalidKey('key is invalid')
+    else:
+        new_filename = progress['output']
+        temporal_path = os_join(parent_dir, new_filename + constants.TEMPORAL_FILE_EXTENSION)
+        file_cipher, chunk_size = _resume_progress(temporal_path, progress, key, filename, stats)
 
-    file_keys = tuple(Fernet.generate_key() for _ in range(rounds + 1))
+    start = time()
 
-    file_ciphers = tuple(Fernet(key) for key in file_keys)
+    # Entries of a directory as they were archived, only those are deleted afterwards
+    archived = []
+
+    if isdir(path) and entries is None:
+        with stats.measure('scan'):
+            entries = utils.scan_tree(path)
+
+    if pack:
+        working_filename = filename + constants.PACK_FILE_EXTENSION
+        original_source = BufferedReader(utils.IteratorReader(
+            utils.pack_chunks(path, member_codec, member_level, archived, entries)
+        ))
+        original_size = None
+        read_phase = 'pack'
+    elif isdir(path):
+        working_filename = filename + constants.TAR_GZ_FILE_EXTENSION
+        original_source = utils.path_to_tar_stream(path, archived, entries)
+        original_size = None
+        read_phase = 'tar'
+    else:
+        working_filename = filename
+        original_source = open(path, 'rb')
+        original_size = getsize(path)
+        read_phase = 'read'
+
+    if progress is None:
+        file_key = FrameCipher.generate_key()
+        file_cipher = engine.file_cipher(file_key)
+
+        wrapped_key = key_cipher.encrypt(file_key)
+        del file_key
+        del key_cipher
+
+        chunk_size = constants.PACK_CHUNK_SIZE if pack else utils.chunk_size(original_size)
+
+        fields = {
+            container.FIELD_CODEC: bytes((codec.identifier,)),
+            container.FIELD_CHUNK_SIZE: container.CHUNK_SIZE.pack(chunk_size),
+            container.FIELD_CIPHER: bytes((engine.identifier,))
+        }
+        if salt is not None:
+            fields[container.FIELD_SALT] = salt
+
+        raw_fields = container.encode_fields(fields)
+        metadata = container.seal_metadata(file_cipher, constants.BYTES_VERSION, raw_fields, working_filename.encode())
+
+        # The final filename is reserved, contents go to a temporal file until they are complete
+        new_filename = utils.reserve_filename(parent_dir, _encrypted_filenames(filename))
+        temporal_path = os_join(parent_dir, new_filename + constants.TEMPORAL_FILE_EXTENSION)
+
+    new_path = os_join(parent_dir, new_filename)
+    frames = 0 if progress is None else progress['frames']
+    cipher = engine.name if progress is None else progress['cipher']
+
+    try:
+        with original_source as original_file:
+            with open(temporal_path, 'wb' if progress is None else 'r+b', buffering=0) as encrypted_file:
+                if progress is None:
+                    container.write_header(encrypted_file, wrapped_key, raw_fields, metadata)
+                else:
+                    encrypted_file.truncate(progress['offset'])
+                    encrypted_file.seek(progress['offset'])
+                    original_file.seek(frames * chunk_size)
+
+                # Every encryption is recorded, so the output of a crash is found and removed by the next one
+                checkpoint = encrypted_file.tell()
+                _save_progress(encrypted_file, progress_path, path, new_filename, cipher, resumable, frames)
+
+                with tqdm(
+                        total=original_size if entries is None else utils.tree_size(path, entries),
+                        initial=frames * chunk_size,
+                        desc=filename,
+                        leave=False,
+                        dynamic_ncols=True,
+                        unit='B',
+                        unit_scale=True,
+                        disable=constants.QUIET
+                ) as progress_bar:
+                    if codec.name == 'none':
+                        # Chunks go straight from the file to the cipher, through reusable buffers
+                        chunks = _tracked_chunks(stats.iterate(read_phase, container.iter_chunks_into(
+                            original_file, chunk_size, utils.chunks_in_flight() + 2, frames
+                        ), _chunk_size), progress_bar)
+                    else:
+                        chunks = container.iter_chunks(BufferedReader(utils.IteratorReader(stats.iterate(
+                            'compress', utils.compress_chunks(stats.iterate(
+                                read_phase, _read_chunks(original_file, chunk_size, progress_bar)
+                            ), codec, level)
+                        ))), chunk_size)
+
+                    for payload, flags in utils.ordered_map(partial(_seal_chunk, file_cipher, stats), chunks):
+                        with stats.measure('write', container.FRAME_HEADER.size + len(payload)):
+                            container.write_frame(encrypted_file, payload, flags)
+                        frames += 1
+
+                        if resumable and not flags & container.FLAG_FINAL and (
+                                encrypted_file.tell() - checkpoint >= constants.PROGRESS_JOURNAL_INTERVAL):
+                            checkpoint = encrypted_file.tell()
+
+                            with stats.measure('checkpoint'):
+                                _save_progress(
+                                    encrypted_file, progress_path, path, new_filename, cipher, resumable, frames
+                                )
+
+        with stats.measure('commit'):
+            utils.commit_file(temporal_path, new_path)
+    except (OSError, TarError) as error:
+        # Resumable files keep their progress, see RESUME_ENCRYPTION
+        if not resumable:
+            _discard_output(temporal_path, new_path)
+
+            if exists(progress_path):
+                remove(progress_path)
+
+        if isinstance(error, TarError):
+            raise CrycriptError(f'{filename}: {error}') from error
+        raise
+
+    remove(progress_path)
+
+    if not constants.PRESERVE_ORIGINAL_FILES:
+        with stats.measure('delete'):
+            if isdir(path):
+                utils.delete_archived(archived)
+            else:
+                remove(path)
+
+    return ActionResult('encrypt', path, new_path, time() - start, stats)
+
+
+def _load_progress(path: str, progress_path: str, resumable: bool) -> dict:
+    # Progress of an interrupted encryption of path, None (after removing its leftovers) if it can not be resumed
+    if not exists(progress_path):
+        return None
+
+    try:
+        with open(progress_path, 'rb') as progress_file:
+            progress = json.load(progress_file)
+
+        status = stat(path)
+        current = (
+            progress['size'] == status.st_size and progress['mtime_ns'] == status.st_mtime_ns
+            and isinstance(progress['frames'], int) and isinstance(progress['offset'], int)
+            and basename(progress['output']) == progress['output'] and progress['output']
+            and progress.get('resumable') is True
+            and progress.get('cipher') in CIPHERS and CIPHERS[progress['cipher']].resumable
+        )
+    except (OSError, ValueError, TypeError, KeyError):
+        progress, current = None, False
+
+    if current and resumable and constants.RESUME_ENCRYPTION and exists(
+            os_join(dirname(path), progress['output'] + constants.TEMPORAL_FILE_EXTENSION)):
+        return progress
+
+    # Only files next to path are removed, whatever the journal says
+    output = progress.get('output') if isinstance(progress, dict) else None
+    if isinstance(output, str) and output and basename(output) == output:
+        _discard_output(
+            os_join(dirname(path), output + constants.TEMPORAL_FILE_EXTENSION),
+            os_join(dirname(path), output)
+        )
+    remove(progress_path)
+
+    return None
+
+
+def _resume_progress(temporal_path: str, progress: dict, key, filename: str, stats: Stats) -> tuple:
+    # Checks the frames written before the last checkpoint, returns the (file cipher, chunk size) tuple to continue
+    with open(temporal_path, 'rb') as encrypted_file:
+        header, file_cipher, _, _ = open_header(encrypted_file, key, filename, stats)
+
+        frames = progress['frames']
+        if header.chunk_size is None or progress['offset'] != header.frame_offset(frames):
+            raise CorruptedFile(f'{filename}: encryption progress does not match its partial output')
+
+        # The last frame of the checkpoint proves the key and the position are right
+        if frames:
+            encrypted_file.seek(header.frame_offset(frames - 1))
+
+            try:
+                payload, flags = container.read_frame(encrypted_file, header.maximum_payload)
+                container.open_frame(file_cipher, frames - 1, flags, payload)
+            except (EOFError, TypeError, InvalidToken, ValueError) as error:
+                raise CorruptedFile(f'{filename}: partial output can not be resumed, frame {frames} is not valid') \
+                    from error
+
+    # Frames after the checkpoint are sealed again, only engines with random IVs are resumed (see _load_progress())
+    return file_cipher, header.chunk_size
+
+
+def _save_progress(encrypted_file, progress_path: str, path: str, new_filename: str, cipher: str, resumable: bool,
+                   frames: int):
+    # Frames are made durable before the progress pointing to them
+    fsync(encrypted_file.fileno())
+
+    status = stat(path)
+    utils.write_atomically(progress_path, json.dumps({
+        'output': new_filename,
+        'cipher': cipher,
+        'resumable': resumable,
+        'size': status.st_size,
+        'mtime_ns': status.st_mtime_ns,
+        'frames': frames,
+        'offset': encrypted_file.tell()
+    }).encode())
+
+
+def _discard_output(temporal_path: str, new_path: str):
+    if exists(temporal_path):
+        remove(temporal_path)
 
-    encrypted_file_keys = key_cipher.encrypt(b' '.join(file_keys))
-    del file_keys
-    del key_cipher
+    # The reserved filename is only removed while it is still empty
+    if exists(new_path) and getsize(new_path) == 0:
+        remove(new_path)
+
+
+def _encrypted_filenames(filename: str) -> Iterator[str]:
+    while True:
+        yield (
+            filename[:constants.ENCRYPTED_FILENAME_ORIGINAL_CHARS] + '-'
+            + ''.join(choice(constants.ENCRYPTED_FILENAME_CHARSET)
+                      for _ in range(constants.ENCRYPTED_FILENAME_RANDOM_CHARS))
+            + constants.ENCRYPTED_FILE_EXTENSION
+        )
 
-    with open(working_path, 'rb') as original_file:
-        with open(os_join(parent_dir, new_filename), 'ab') as encrypted_file:
-            encrypted_file.write(constants.BYTES_VERSION)
-            encrypted_file.write(b'\n')
 
-            encrypted_file.write(encrypted_file_keys)
-            encrypted_file.write(b'\n')
+def _read_chunks(original_file, size: int, progress_bar: tqdm) -> Iterator[bytes]:
+    for chunk in iter(partial(original_file.read, size), b''):
+        yield chunk
+        progress_bar.update(len(chunk))
 
-            encrypted_file.write(file_ciphers[0].encrypt(working_filename.encode()))
-            encrypted_file.write(b'\n')
 
-            for cipher in tqdm(
-                    file_ciphers[1:],
-                    desc=filename,
-                    leave=False,
-                    dynamic_ncols=True
-            ):
-                encrypted_file.write(
-                    cipher.encrypt(
-                        original_file.read(constants.ENCRYPTION_BUFFER_SIZE)
-                    )
-                )
+def _tracked_chunks(chunks: Iterator[tuple], progress_bar: tqdm) -> Iterator[tuple]:
+    for index, flags, chunk in chunks:
+        yield index, flags, chunk
+        progress_bar.update(len(chunk))
 
-                encrypted_file.write(b'\n')
 
-    if compressed_path:
-        remove(compressed_path)
-    elif not constants.PRESERVE_ORIGINAL_FILES:
-        remove(path)
+def _chunk_size(chunk: tuple) -> int:
+    return len(chunk[2])
 
-    end = time()
 
-    return f'{filename} -> {new_filename} in {round(end - start, 4)} seconds'
+def _seal_chunk(file_cipher: FrameCipher, stats: Stats, index: int, flags: int, chunk: bytes) -> tuple:
+    with stats.measure('encrypt', len(chunk)):
+        return container.seal_frame(file_cipher, index, flags, chunk), flags
@@ -0,0 +1,70 @@
+from time import sleep
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.errors import CorruptedFile, InvalidKey, InvalidPassword, TamperedBlock, UnsupportedCipher
+from crycript.utils.errors import UnsupportedCodec
+from crycript.utils.stats import Stats
+
+
+def key_cipher(key, salt: bytes) -> Fernet:
+    """Returns the cipher of the key that wraps file keys, raise InvalidKey if it is not valid.
+
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    salt: bytes -> password salt of the file, None for files without one"""
+    key = utils.file_key(key, salt, confirm_password=False)
+
+    try:
+        return Fernet(key)
+    except (ValueError, Exception):
+        raise InvalidKey('key is invalid')
+
+
+def open_header(original_file, key, filename: str, stats: Stats = None) -> tuple:
+    """Returns the (header, file cipher, original filename, codec) tuple of an encrypted crycript file.
+    The file cipher is a FrameCipher or an AeadCipher, depending on the cipher engine of the file.
+
+    The header is authenticated, and the file is left at its first frame.
+
+    original_file: BinaryIO -> encrypted file opened for binary reading at position 0
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    filename: str -> filename used in error messages
+    stats: Stats -> records the header and key phases"""
+    stats = Stats() if stats is None else stats
+
+    with stats.measure('header'):
+        header = container.read_header(original_file, filename)
+
+    try:
+        engine = utils.cipher_from_identifier(header.cipher)
+    except ValueError as error:
+        raise UnsupportedCipher(f'{filename}: {error}')
+
+    with stats.measure('key'):
+        wrapping_cipher = key_cipher(key, header.fields.get(container.FIELD_SALT))
+
+    try:
+        file_cipher = engine.file_cipher(wrapping_cipher.decrypt(header.wrapped_key))
+    except (InvalidToken, ValueError):
+        sleep(constants.INVALID_PASSWORD_DELAY)
+        raise InvalidPassword('invalid password')
+
+    del wrapping_cipher
+
+    try:
+        original_filename = container.open_metadata(
+            file_cipher, header.version, header.raw_fields, header.metadata
+        ).decode()
+    except InvalidToken:
+        raise TamperedBlock('header was modified')
+
+    try:
+        codec = utils.codec_from_identifier(header.fields[container.FIELD_CODEC][0])
+    except (KeyError, IndexError):
+        raise CorruptedFile(f'{filename}: header is corrupted')
+    except ValueError as error:
+        raise UnsupportedCodec(f'{filename}: {error}')
+
+    return header, file_cipher, original_filename, codec
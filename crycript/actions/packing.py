@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from functools import partial
+from io import BufferedReader
+from os.path import basename, dirname, isdir, islink, join as os_join, lexists
+from time import time
+from tarfile import TarError
+from typing import Iterator
+
+from crycript import constants, utils
+from crycript.utils.errors import CorruptedFile, CrycriptError, VersionMismatch
+from crycript.utils.packs import PackReader
+from crycript.utils.stats import Stats
+from .headers import open_header
+from .reading import EncryptedFileReader
+from .results import ActionResult
+
+
+def list_pack(path: str, key=None) -> list:
+    """Returns the PackEntry of every member of an encrypted pack, sorted by name.
+    Raise a CrycriptError (or OSError) if it can not be done.
+
+    Only the index is decrypted, see utils.pack_chunks().
+
+    path: str -> absolute path to encrypted pack (a directory encrypted with crycript.constants.PACK_DIRECTORIES)
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)"""
+    with _open_pack(path, key) as pack:
+        return list(pack.entries())
+
+
+def extract(path: str, names: list = None, destination: str = None, key=None, stats: Stats = None) -> ActionResult:
+    """Decrypts members of an encrypted directory, raise a CrycriptError (or OSError) if it can not be done.
+
+    In a pack, every member is found with a binary search in the index, only the frames holding it are decrypted,
+    and nothing is extracted if one of them already exists. A directory encrypted without a pack has no index:
+    it is decrypted as a stream and only the matching members are written (existing files are overwritten).
+    Files are written in a thread pool (crycript.constants.EXTRACTION_JOBS). The encrypted file is never deleted.
+
+    path: str -> absolute path to encrypted directory
+    names: list -> member names (as returned by list_pack()), directories bring everything inside, all if None
+    destination: str -> directory to extract the members into (with their parent directories), the pack's if None
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    stats: Stats -> records the phases (header, key, index, extract), a new one if None"""
+
+    stats = Stats() if stats is None else stats
+    start = time()
+
+    filename = basename(path)
+    destination = dirname(path) if destination is None else destination
+
+    with _open_contents(path, key, stats) as (contents, original_filename):
+        if original_filename.endswith(constants.TAR_GZ_FILE_EXTENSION):
+            with stats.measure('extract'):
+                try:
+                    found = utils.tar_stream_to_directory(
+                        iter(partial(contents.read, constants.PACK_CHUNK_SIZE), b''), destination, names
+                    )
+                except TarError as error:
+                    raise CorruptedFile(f'{filename}: decrypted contents are corrupted: {error}') from error
+
+            for name in names or ():
+                if name.strip('/') not in found:
+                    raise CrycriptError(f'{filename}: {name} is not in the encrypted directory')
+
+            output_path = os_join(destination, original_filename[:-1 * len(constants.TAR_GZ_FILE_EXTENSION)])
+            if names:
+                output_path = os_join(destination, *names[0].strip('/').split('/'))
+
+            return ActionResult('extract', path, output_path, time() - start, stats)
+
+        pack = _pack_reader(contents, original_filename, filename)
+
+        with stats.measure('index'):
+            if names is None:
+                entries = list(pack.entries())
+            else:
+                entries = set()
+
+                for name in names:
+                    found = pack.find(name)
+                    if not found:
+                        raise CrycriptError(f'{filename}: {name} is not in the pack')
+
+                    entries.update(found)
+
+                entries = sorted(entries)
+
+            # Existing files are never overwritten, nothing is written if one of them is there
+            for entry in entries:
+                target = os_join(destination, *entry.name.split('/'))
+                if lexists(target) and not (entry.kind == 'directory' and isdir(target) and not islink(target)):
+                    raise CrycriptError(f'{filename}: {entry.name} already exists in {destination}')
+
+        with stats.measure('extract', sum(entry.size for entry in entries), len(entries)):
+            pack.extract(entries, destination)
+
+    return ActionResult('extract', path, os_join(destination, *entries[0].name.split('/')), time() - start, stats)
+
+
+@contextmanager
+def _open_pack(path: str, key, stats: Stats = None) -> Iterator[PackReader]:
+    with _open_contents(path, key, stats) as (contents, original_filename):
+        yield _pack_reader(contents, original_filename, basename(path))
+
+
+def _pack_reader(contents, original_filename: str, filename: str) -> PackReader:
+    if not original_filename.endswith(constants.PACK_FILE_EXTENSION):
+        raise CrycriptError(f'{filename}: not a pack, encrypt directories with --pack to list or extract files')
+
+    return PackReader(contents)
+
+
+@contextmanager
+def _open_contents(path: str, key, stats: Stats = None) -> Iterator[tuple]:
+    # Yields the decrypted contents (a file object) and the original filename
+    filename = basename(path)
+    encrypted_file = open(path, 'rb')
+
+    try:
+        if encrypted_file.readline()[:-1] == constants.LEGACY_BYTES_VERSION:
+            raise VersionMismatch(f'{filename}: legacy files can only be decrypted as a whole')
+        encrypted_file.seek(0)
+
+        header, file_cipher, original_filename, codec = open_header(encrypted_file, key, filename, stats)
+        contents = BufferedReader(EncryptedFileReader.from_header(encrypted_file, header, file_cipher, codec))
+    except BaseException:
+        encrypted_file.close()
+        raise
+
+    with contents:
+        yield contents, original_filename
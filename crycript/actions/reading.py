@@ -0,0 +1,323 @@
+from collections import OrderedDict
+from functools import partial
+from io import BufferedReader, RawIOBase, UnsupportedOperation, SEEK_CUR, SEEK_END, SEEK_SET
+from os.path import basename, getsize
+
+from cryptography.fernet import InvalidToken
+
+from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.ciphers import FrameCipher
+from crycript.utils.compression import Codec
+from crycript.utils.errors import CorruptedFile, TamperedBlock, VersionMismatch
+from .headers import open_header
+
+
+def read_range(path: str, offset: int, length: int = None, key=None) -> bytes:
+    """Returns part of the decrypted contents of an encrypted crycript file, nothing is written to disk.
+    Raise a CrycriptError if it can not be done.
+
+    Every frame but the last one holds exactly one chunk (its size is authenticated in the header),
+    so uncompressed files seek straight to the frames that contain the range and decrypt only those.
+    Compressed files are decrypted and decompressed from the start, until the range is complete.
+
+    path: str -> absolute path to encrypted crycript file
+    offset: int -> position of the first byte to return, negative values count from the end
+    length: int -> number of bytes to return, up to the end if None
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)"""
+    filename = basename(path)
+
+    with open(path, 'rb') as encrypted_file:
+        if encrypted_file.readline()[:-1] == constants.LEGACY_BYTES_VERSION:
+            raise VersionMismatch(f'{filename}: legacy files can only be decrypted as a whole')
+        encrypted_file.seek(0)
+
+        header, file_cipher, _, codec = open_header(encrypted_file, key, filename)
+
+        try:
+            if codec.name == 'none' and header.chunk_size is not None:
+                return _read_frames(encrypted_file, header, file_cipher, getsize(path), offset, length)
+            else:
+                return _read_stream(encrypted_file, header, file_cipher, codec, offset, length)
+        except InvalidToken as error:
+            raise TamperedBlock(f'{filename}: an encrypted frame was modified') from error
+        except EOFError as error:
+            raise CorruptedFile(f'{filename}: encrypted file is truncated') from error
+        except ValueError as error:
+            raise CorruptedFile(f'{filename}: {error}') from error
+
+
+def _bounds(offset: int, length: int, total_size: int) -> tuple:
+    start = offset + total_size if offset < 0 else offset
+    start = min(max(start, 0), total_size)
+
+    end = total_size if length is None else min(start + max(length, 0), total_size)
+
+    return start, end
+
+
+def _read_payload(encrypted_file, header: container.Header, frame_count: int, file_size: int, index: int) -> tuple:
+    encrypted_file.seek(header.frame_offset(index))
+
+    frame = container.read_frame(encrypted_file, header.maximum_payload)
+    if frame is None:
+        raise EOFError
+
+    payload, flags = frame
+    final = bool(flags & container.FLAG_FINAL)
+
+    # Only the last frame of the file can be (and must be) the final one
+    if final != (index == frame_count - 1) or (final and encrypted_file.tell() != file_size):
+        raise EOFError
+
+    return index, flags, payload
+
+
+def _open_payload(file_cipher: FrameCipher, header: container.Header, index: int, flags: int, payload: bytes) -> bytes:
+    data = container.open_frame(file_cipher, index, flags, payload)
+
+    if not flags & container.FLAG_FINAL and len(data) != header.chunk_size:
+        raise ValueError(f'encrypted frame {index + 1} does not hold a whole chunk')
+
+    return data
+
+
+def _read_frames(encrypted_file, header: container.Header, file_cipher: FrameCipher, file_size: int,
+                 offset: int, length: int) -> bytes:
+    frame_count = header.frame_count(file_size)
+    read_payload = partial(_read_payload, encrypted_file, header, frame_count, file_size)
+    open_payload = partial(_open_payload, file_cipher, header)
+
+    # The last frame gives the total size
+    last_frame = open_payload(*read_payload(frame_count - 1))
+    start, end = _bounds(offset, length, (frame_count - 1) * header.chunk_size + len(last_frame))
+
+    if start >= end:
+        return b''
+
+    first_index = start // header.chunk_size
+    last_index = (end - 1) // header.chunk_size
+
+    data = b''.join(utils.ordered_map(
+        open_payload,
+        (read_payload(index) for index in range(first_index, min(last_index + 1, frame_count - 1)))
+    ))
+
+    if last_index == frame_count - 1:
+        data += last_frame
+
+    first_position = first_index * header.chunk_size
+    return data[start - first_position:end - first_position]
+
+
+def _read_stream(encrypted_file, header: container.Header, file_cipher: FrameCipher, codec: Codec,
+                 offset: int, length: int) -> bytes:
+    chunks = utils.decompress_chunks(
+        utils.ordered_map(
+            partial(container.open_frame, file_cipher),
+            container.iter_frames(encrypted_file, header.maximum_payload)
+        ),
+        codec,
+        header.chunk_size
+    )
+
+    # Counting from the end, keep only the tail
+    if offset < 0:
+        tail = bytearray()
+
+        for chunk in chunks:
+            tail += chunk
+            del tail[:max(len(tail) + offset, 0)]
+
+        return bytes(tail[:length] if length is not None else tail)
+
+    data = bytearray()
+    position = 0
+
+    for chunk in chunks:
+        if position + len(chunk) > offset:
+            data += chunk[max(offset - position, 0):]
+
+        position += len(chunk)
+
+        # Stop decrypting as soon as the range is complete
+        if length is not None and len(data) >= length:
+            return bytes(data[:length])
+
+    return bytes(data)
+
+
+class EncryptedFileReader(RawIOBase):
+    """Read-only binary file object over the decrypted contents of an encrypted crycript file.
+
+    Frames are decrypted lazily, only when they are read, and the most recently used ones are
+    kept in memory, so memory stays bounded by cache_size chunks. Uncompressed files are seekable,
+    compressed files can only be read sequentially. Nothing is written to disk.
+
+    Reading a modified frame raises TamperedBlock, other damage raises CorruptedFile."""
+
+    def __init__(self, path: str, key=None, cache_size: int = None):
+        """path: str -> absolute path to encrypted crycript file
+        key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+        cache_size: int -> decrypted frames kept in memory, crycript.constants.READER_CACHE_FRAMES if None"""
+        encrypted_file = self._file = open(path, 'rb')
+        self._cache = OrderedDict()
+
+        try:
+            if encrypted_file.readline()[:-1] == constants.LEGACY_BYTES_VERSION:
+                raise VersionMismatch(f'{basename(path)}: legacy files can only be decrypted as a whole')
+            encrypted_file.seek(0)
+
+            header, file_cipher, _, codec = open_header(encrypted_file, key, basename(path))
+            self._open(encrypted_file, header, file_cipher, codec, cache_size)
+        except BaseException:
+            encrypted_file.close()
+            raise
+
+    @classmethod
+    def from_header(cls, encrypted_file, header: container.Header, file_cipher: FrameCipher, codec: Codec,
+                    cache_size: int = None) -> 'EncryptedFileReader':
+        """Returns a reader over a file whose header was already opened with open_header(), so the key is not
+        asked again. The reader closes encrypted_file.
+
+        encrypted_file: BinaryIO -> encrypted file opened for binary reading, at its first frame
+        header, file_cipher, codec -> returned by open_header()
+        cache_size: int -> decrypted frames kept in memory, crycript.constants.READER_CACHE_FRAMES if None"""
+        reader = cls.__new__(cls)
+        RawIOBase.__init__(reader)
+        reader._open(encrypted_file, header, file_cipher, codec, cache_size)
+
+        return reader
+
+    def _open(self, encrypted_file, header: container.Header, file_cipher: FrameCipher, codec: Codec,
+              cache_size: int):
+        self.name = encrypted_file.name
+        self._filename = basename(encrypted_file.name)
+        self._file = encrypted_file
+        self._header, self._file_cipher = header, file_cipher
+        self._cache = OrderedDict()
+        self._cache_size = max(constants.READER_CACHE_FRAMES if cache_size is None else cache_size, 1)
+        self._position = 0
+        self._stream = None
+
+        if codec.name == 'none' and header.chunk_size is not None:
+            self._file_size = getsize(encrypted_file.name)
+            self._frame_count = header.frame_count(self._file_size)
+            last_frame = self._frame(self._frame_count - 1)
+            self._size = (self._frame_count - 1) * header.chunk_size + len(last_frame)
+        else:
+            self._stream = utils.IteratorReader(utils.decompress_chunks(
+                (
+                    container.open_frame(file_cipher, *frame)
+                    for frame in container.iter_frames(encrypted_file, header.maximum_payload)
+                ),
+                codec,
+                header.chunk_size
+            ))
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._stream is None
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        if self._stream is not None:
+            raise UnsupportedOperation('compressed files can only be read sequentially')
+
+        if whence == SEEK_SET:
+            position = offset
+        elif whence == SEEK_CUR:
+            position = self._position + offset
+        elif whence == SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        if self._stream is not None:
+            try:
+                size = self._stream.readinto(buffer)
+            except (EOFError, InvalidToken, ValueError) as error:
+                raise self._error(error)
+
+            self._position += size
+            return size
+
+        if self._position >= self._size:
+            return 0
+
+        index = self._position // self._header.chunk_size
+        start = self._position - index * self._header.chunk_size
+        frame = self._frame(index)
+
+        size = min(len(buffer), len(frame) - start)
+        memoryview(buffer)[:size] = memoryview(frame)[start:start + size]
+
+        self._position += size
+        return size
+
+    def readall(self) -> bytes:
+        chunk_size = self._header.chunk_size or constants.ENCRYPTION_BUFFER_SIZE
+        return b''.join(iter(partial(self.read, chunk_size), b''))
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._cache.clear()
+
+        super().close()
+
+    def _frame(self, index: int) -> bytes:
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        try:
+            frame = _open_payload(
+                self._file_cipher, self._header,
+                *_read_payload(self._file, self._header, self._frame_count, self._file_size, index)
+            )
+        except (EOFError, InvalidToken, ValueError) as error:
+            raise self._error(error, index)
+
+        self._cache[index] = frame
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+        return frame
+
+    def _error(self, error: Exception, index: int = None) -> CorruptedFile:
+        if isinstance(error, InvalidToken):
+            frame = 'an encrypted frame' if index is None else f'encrypted frame {index + 1}'
+            return TamperedBlock(f'{self._filename}: {frame} was modified', index)
+
+        if isinstance(error, EOFError):
+            return CorruptedFile(f'{self._filename}: encrypted file is truncated')
+
+        return CorruptedFile(f'{self._filename}: {error}')
+
+
+def open_encrypted(path: str, key=None, cache_size: int = None) -> BufferedReader:
+    """Returns a read-only binary file object (like open(path, 'rb')) over the decrypted contents of an encrypted
+    crycript file, see EncryptedFileReader. Available as crycript.open().
+
+    path: str -> absolute path to encrypted crycript file
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    cache_size: int -> decrypted frames kept in memory, crycript.constants.READER_CACHE_FRAMES if None"""
+    return BufferedReader(EncryptedFileReader(path, key, cache_size))
@@ -0,0 +1,52 @@
+from os.path import basename
+from typing import NamedTuple
+
+from crycript.utils.stats import Stats
+
+# Frame numbers listed by VerifyResult, the rest are counted
+MAXIMUM_REPORTED_FRAMES: int = 20
+
+
+class ActionResult(NamedTuple):
+    """Outcome of encrypt(), decrypt() or change_password(), str() gives the message shown by the command line.
+
+    stats has the time, bytes and chunks of every phase of the action."""
+    action: str
+    path: str
+    output_path: str
+    seconds: float
+    stats: Stats = None
+
+    def __str__(self) -> str:
+        if self.output_path == self.path:
+            return f'Password updated in {round(self.seconds, 4)} seconds'
+
+        return f'{basename(self.path)} -> {basename(self.output_path)} in {round(self.seconds, 4)} seconds'
+
+
+class VerifyResult(NamedTuple):
+    """Outcome of verify(), str() gives the message shown by the command line.
+
+    corrupted_frames has the index (starting at 0) of every frame (or legacy block line) that failed to authenticate,
+    it is empty if the file is intact."""
+    path: str
+    frames: int
+    corrupted_frames: tuple
+    header_only: bool
+    seconds: float
+    stats: Stats = None
+
+    def __str__(self) -> str:
+        if self.corrupted_frames:
+            numbers = ', '.join(str(index + 1) for index in self.corrupted_frames[:MAXIMUM_REPORTED_FRAMES])
+            if len(self.corrupted_frames) > MAXIMUM_REPORTED_FRAMES:
+                numbers += ', ...'
+
+            return f'{basename(self.path)}: {len(self.corrupted_frames)} of {self.frames} encrypted frames ' \
+                   f'are corrupted ({numbers})'
+
+        if self.header_only:
+            return f'{basename(self.path)}: header authenticated, {self.frames} frames in place, ' \
+                   f'in {round(self.seconds, 4)} seconds'
+
+        return f'{basename(self.path)}: {self.frames} frames authenticated in {round(self.seconds, 4)} seconds'
@@ -0,0 +1,203 @@
+from functools import partial
+from os.path import basename, getsize
+from time import sleep, time
+
+from cryptography.fernet import Fernet, InvalidToken
+from tqdm import tqdm
+
+from crycript import constants, utils
+from crycript.utils import container
+from crycript.utils.ciphers import FrameCipher
+from crycript.utils.errors import CorruptedFile, InvalidPassword, TamperedBlock
+from crycript.utils.stats import Stats
+from .headers import key_cipher, open_header
+from .results import VerifyResult
+
+
+def verify(path: str, key=None, header_only: bool = False, stats: Stats = None) -> VerifyResult:
+    """Authenticates an encrypted crycript file without writing its contents anywhere, returns the corrupted frames.
+    Raise a CrycriptError (or OSError) if it can not be checked at all (invalid password, corrupted header...).
+
+    Every frame but the last one holds a whole chunk, so frames are read at their position and a malformed
+    one does not hide the frames after it. Frames are authenticated in parallel (crycript.constants.PARALLEL_JOBS)
+    and their plaintext is discarded. Nothing is modified: an interrupted password change is only recovered
+    by decrypt() or change_password().
+
+    path: str -> absolute path to encrypted crycript file
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    header_only: bool -> only authenticate the header and check that the final frame is where the file ends,
+    without reading the other frames (for quick audits of many files)
+    stats: Stats -> records the phases (header, key, read, authenticate), a new one if None"""
+
+    stats = Stats() if stats is None else stats
+    start = time()
+
+    filename = basename(path)
+    size = getsize(path)
+
+    with open(path, 'rb') as encrypted_file:
+        version = encrypted_file.readline()[:-1]
+        encrypted_file.seek(0)
+
+        if version == constants.LEGACY_BYTES_VERSION:
+            frames, corrupted_frames = _verify_lines(encrypted_file, key, filename, header_only, stats)
+        else:
+            header, file_cipher, _, _ = open_header(encrypted_file, key, filename, stats)
+
+            if header.chunk_size is None:
+                frames, corrupted_frames = _verify_stream(encrypted_file, file_cipher, header_only, stats)
+            else:
+                frames, corrupted_frames = _verify_frames(encrypted_file, header, file_cipher, filename, size,
+                                                          header_only, stats)
+
+    return VerifyResult(path, frames, tuple(corrupted_frames), header_only, time() - start, stats)
+
+
+def _verify_frames(encrypted_file, header: container.Header, file_cipher: FrameCipher, filename: str, size: int,
+                   header_only: bool, stats: Stats) -> tuple:
+    frame_count = header.frame_count(size)
+    read_payload = partial(_read_payload, encrypted_file, header, frame_count, size, stats)
+
+    if header_only:
+        return frame_count, [] if read_payload(frame_count - 1)[2] is not None else [frame_count - 1]
+
+    corrupted_frames = []
+
+    with tqdm(
+            total=size - header.size,
+            desc=filename,
+            leave=False,
+            dynamic_ncols=True,
+            unit='B',
+            unit_scale=True,
+            disable=constants.QUIET
+    ) as progress_bar:
+        for index, intact in utils.ordered_map(
+                partial(_authenticate, file_cipher, stats),
+                (read_payload(index) for index in range(frame_count))
+        ):
+            if not intact:
+                corrupted_frames.append(index)
+            progress_bar.update(header.frame_stride)
+
+    return frame_count, corrupted_frames
+
+
+def _verify_stream(encrypted_file, file_cipher: FrameCipher, header_only: bool, stats: Stats) -> tuple:
+    # Without a recorded chunk size frames can only be found one after the other, up to the first malformed one
+    frames, corrupted_frames = 0, []
+
+    if header_only:
+        return frames, corrupted_frames
+
+    frame_iterator = stats.iterate('read', container.iter_frames(encrypted_file), _payload_size)
+
+    try:
+        for index, intact in utils.ordered_map(partial(_authenticate, file_cipher, stats), frame_iterator):
+            frames += 1
+            if not intact:
+                corrupted_frames.append(index)
+
+        if encrypted_file.read(1):
+            raise EOFError
+    except (EOFError, container.MalformedFrame):
+        corrupted_frames.append(frames)
+        frames += 1
+
+    return frames, corrupted_frames
+
+
+def _verify_lines(encrypted_file, key, filename: str, header_only: bool, stats: Stats) -> tuple:
+    encrypted_file.readline()
+
+    with stats.measure('key'):
+        wrapping_cipher = key_cipher(key, None)
+
+    try:
+        file_keys = wrapping_cipher.decrypt(encrypted_file.readline()[:-1]).split(b' ')
+    except InvalidToken:
+        sleep(constants.INVALID_PASSWORD_DELAY)
+        raise InvalidPassword('invalid password')
+
+    try:
+        file_ciphers = tuple(Fernet(key) for key in file_keys)
+    except (ValueError, Exception):
+        raise TamperedBlock('key block was replaced')
+
+    del file_keys
+    del wrapping_cipher
+
+    try:
+        file_ciphers[0].decrypt(encrypted_file.readline()[:-1])
+    except InvalidToken:
+        raise TamperedBlock('filename block was replaced')
+
+    if header_only:
+        return len(file_ciphers) - 1, []
+
+    corrupted_lines = []
+
+    for line, cipher in enumerate(tqdm(
+            file_ciphers[1:],
+            desc=filename,
+            leave=False,
+            dynamic_ncols=True,
+            disable=constants.QUIET
+    )):
+        token = encrypted_file.readline()[:-1]
+
+        try:
+            with stats.measure('authenticate', len(token)):
+                cipher.decrypt(token)
+        except InvalidToken:
+            corrupted_lines.append(line)
+
+    if encrypted_file.read(1):
+        raise CorruptedFile(f'{filename}: encrypted file has unexpected data after the last block')
+
+    return len(file_ciphers) - 1, corrupted_lines
+
+
+def _read_payload(encrypted_file, header: container.Header, frame_count: int, size: int, stats: Stats,
+                  index: int) -> tuple:
+    # Returns the (index, flags, payload) tuple of a frame, payload is None if the frame is malformed
+    with stats.measure('read'):
+        encrypted_file.seek(header.frame_offset(index))
+
+        try:
+            frame = container.read_frame(encrypted_file, header.maximum_payload)
+        except (EOFError, container.MalformedFrame):
+            return index, 0, None
+
+    if frame is None:
+        return index, 0, None
+
+    payload, flags = frame
+    final = bool(flags & container.FLAG_FINAL)
+
+    # Only the last frame of the file can be (and must be) the final one, every other frame holds a whole chunk
+    if final != (index == frame_count - 1) or (final and encrypted_file.tell() != size) or (
+            not final and len(payload) != header.maximum_payload):
+        return index, flags, None
+
+    stats.record('read', 0, len(payload))
+
+    return index, flags, payload
+
+
+def _authenticate(file_cipher: FrameCipher, stats: Stats, index: int, flags: int, payload: bytes) -> tuple:
+    # Returns the (index, intact) tuple of a frame, its plaintext is dropped
+    if payload is None:
+        return index, False
+
+    with stats.measure('authenticate', len(payload)):
+        try:
+            container.open_frame(file_cipher, index, flags, payload)
+        except (InvalidToken, ValueError):
+            return index, False
+
+    return index, True
+
+
+def _payload_size(frame: tuple) -> int:
+    return len(frame[2])
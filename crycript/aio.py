@@ -0,0 +1,270 @@
+from asyncio import CancelledError, IncompleteReadError, LimitOverrunError, StreamReader, StreamWriter
+from asyncio import get_running_loop, run_coroutine_threadsafe, wrap_future
+from collections import deque
+from concurrent.futures import Executor, Future
+from functools import partial
+from io import BytesIO
+from threading import Thread
+from time import time
+from typing import Callable, NamedTuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from crycript import constants, utils
+from crycript.actions.headers import open_header
+from crycript.utils import container
+from crycript.utils.ciphers import FrameCipher
+from crycript.utils.errors import CorruptedFile, InvalidKey, TamperedBlock, UnsupportedCipher, UnsupportedCodec
+from crycript.utils.errors import VersionMismatch
+
+# Public fields and metadata are small, never trust a larger length read from a stream
+MAXIMUM_HEADER_PART: int = 1_000_000
+
+
+class StreamResult(NamedTuple):
+    """Outcome of encrypt_stream() or decrypt_stream()."""
+    name: str
+    size: int
+    seconds: float
+
+
+async def encrypt_stream(reader: StreamReader, writer: StreamWriter, key=None, name: str = '',
+                         compression: str = None, executor: Executor = None, cipher: str = None) -> StreamResult:
+    """Encrypts everything read from reader until EOF, writing an encrypted crycript file to writer.
+
+    The output is the same as encrypt() of a file (see its docstring), and can be decrypted by decrypt() once saved.
+    Key derivation, compression and frame encryption run in executor, so the event loop is never blocked, and
+    up to crycript.constants.PARALLEL_JOBS frames are encrypted at once. Chunks are only read after writer.drain()
+    returns, so a slow writer slows the reader down. The writer is not closed.
+
+    reader: StreamReader -> plaintext source
+    writer: StreamWriter -> encrypted destination (write() and async drain())
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    name: str -> filename stored in the encrypted metadata
+    compression: str -> codec[:level], crycript.constants.FILE_COMPRESSION if None
+    executor: Executor -> executor for CPU bound work, the loop default executor if None
+    cipher: str -> cipher engine (see utils.ciphers.CIPHERS), crycript.constants.CIPHER if None"""
+    loop = get_running_loop()
+    run = partial(loop.run_in_executor, executor)
+
+    salt, key = await run(utils.new_file_key, key)
+
+    try:
+        key_cipher = Fernet(key)
+    except (ValueError, Exception):
+        raise InvalidKey('key is invalid')
+
+    try:
+        codec, level = utils.parse_compression(
+            constants.FILE_COMPRESSION if compression is None else compression
+        )
+    except ValueError as error:
+        raise UnsupportedCodec(str(error))
+
+    try:
+        engine = utils.parse_cipher(constants.CIPHER if cipher is None else cipher)
+    except ValueError as error:
+        raise UnsupportedCipher(str(error))
+
+    start = time()
+
+    file_key = FrameCipher.generate_key()
+    file_cipher = engine.file_cipher(file_key)
+    chunk_size = utils.chunk_size(None)
+
+    fields = {
+        container.FIELD_CODEC: bytes((codec.identifier,)),
+        container.FIELD_CHUNK_SIZE: container.CHUNK_SIZE.pack(chunk_size),
+        container.FIELD_CIPHER: bytes((engine.identifier,))
+    }
+    if salt is not None:
+        fields[container.FIELD_SALT] = salt
+
+    raw_fields = container.encode_fields(fields)
+    metadata = container.seal_metadata(file_cipher, constants.BYTES_VERSION, raw_fields, name.encode())
+
+    container.write_header(writer, key_cipher.encrypt(file_key), raw_fields, metadata)
+    del file_key
+    del key_cipher
+
+    compressor = codec.compressor(level)
+    pending = deque()
+    compressed = bytearray()
+    size = 0
+    index = 0
+
+    async def write_ready(limit: int):
+        # Frames are written in order, as soon as the oldest one is sealed
+        while len(pending) > limit:
+            payload, flags = await pending.popleft()
+            container.write_frame(writer, payload, flags)
+            await writer.drain()
+
+    def seal(flags: int, chunk: bytes):
+        nonlocal index
+        pending.append(run(_seal_chunk, file_cipher, index, flags, chunk))
+        index += 1
+
+    while True:
+        chunk = await _read_exactly(reader, chunk_size)
+        size += len(chunk)
+
+        if chunk:
+            compressed += await run(compressor.compress, chunk)
+        else:
+            compressed += await run(compressor.flush)
+
+        # Every frame but the final one holds a whole chunk
+        while len(compressed) > chunk_size:
+            seal(0, bytes(compressed[:chunk_size]))
+            del compressed[:chunk_size]
+            await write_ready(max(constants.PARALLEL_JOBS, 1) * constants.PARALLEL_WINDOW)
+
+        if not chunk:
+            break
+
+    seal(container.FLAG_FINAL, bytes(compressed))
+    await write_ready(0)
+
+    return StreamResult(name, size, time() - start)
+
+
+async def decrypt_stream(reader: StreamReader, writer: StreamWriter, key=None,
+                         executor: Executor = None) -> StreamResult:
+    """Decrypts an encrypted crycript file read from reader, writing its contents to writer.
+
+    Reading stops after the final frame, so more data can follow it in the stream. Key derivation and
+    frame decryption run in executor, and up to crycript.constants.PARALLEL_JOBS frames are decrypted at
+    once. Decompression runs in a thread of its own, one chunk at a time whatever the compression ratio.
+    Raise a CrycriptError if the stream is not valid, contents already written to writer must be discarded then.
+    The writer is not closed.
+
+    reader: StreamReader -> encrypted source
+    writer: StreamWriter -> plaintext destination (write() and async drain())
+    key: bytes | KeyProvider -> valid cryptography.fernet.Fernet key, or keys of a password (asked if None)
+    executor: Executor -> executor for CPU bound work, the loop default executor if None"""
+    loop = get_running_loop()
+    run = partial(loop.run_in_executor, executor)
+
+    raw_header = await _read_header(reader)
+    header, file_cipher, name, codec = await run(open_header, BytesIO(raw_header), key, 'stream')
+
+    start = time()
+
+    pending = deque()
+    index = 0
+    final = False
+    stopped = False
+
+    async def next_payload() -> bytes:
+        # Decrypted payloads in order (None after the final frame), later frames are read and decrypted meanwhile
+        nonlocal index, final
+
+        if stopped:
+            raise CancelledError()
+
+        while not final and len(pending) <= max(constants.PARALLEL_JOBS, 1) * constants.PARALLEL_WINDOW:
+            try:
+                length, flags = container.FRAME_HEADER.unpack(await reader.readexactly(container.FRAME_HEADER.size))
+
+                if header.maximum_payload is not None and length > header.maximum_payload:
+                    raise CorruptedFile(
+                        f'encrypted frame {index + 1} is malformed: frame is larger than the chunk size'
+                    )
+
+                payload = await reader.readexactly(length)
+            except IncompleteReadError as error:
+                raise CorruptedFile('encrypted stream is truncated') from error
+
+            pending.append((index, run(container.open_frame, file_cipher, index, flags, payload)))
+            final = bool(flags & container.FLAG_FINAL)
+            index += 1
+
+        if not pending:
+            return None
+
+        frame_index, future = pending.popleft()
+
+        try:
+            return await future
+        except InvalidToken as error:
+            raise TamperedBlock(f'encrypted frame {frame_index + 1} was modified', frame_index) from error
+        except Exception as error:
+            raise CorruptedFile(f'decrypted contents are corrupted: {error}') from error
+
+    async def write(data: bytes):
+        if stopped:
+            raise CancelledError()
+
+        writer.write(data)
+        await writer.drain()
+
+    def decompress() -> int:
+        # Pulls payloads from the loop, so the output is decompressed a chunk at a time (see utils.decompress_chunks())
+        payloads = iter(lambda: run_coroutine_threadsafe(next_payload(), loop).result(), None)
+        written = 0
+
+        try:
+            for data in utils.decompress_chunks(payloads, codec, header.chunk_size):
+                run_coroutine_threadsafe(write(data), loop).result()
+                written += len(data)
+        except ValueError as error:
+            raise CorruptedFile(f'decrypted contents are corrupted: {error}') from error
+
+        return written
+
+    try:
+        size = await _in_thread(decompress)
+    finally:
+        stopped = True
+
+    return StreamResult(name, size, time() - start)
+
+
+async def _in_thread(function: Callable):
+    # Result of function run in its own daemon thread, for work that waits on the event loop (never on executor)
+    future = Future()
+
+    def target():
+        try:
+            future.set_result(function())
+        except BaseException as error:
+            future.set_exception(error)
+
+    Thread(target=target, daemon=True).start()
+    return await wrap_future(future)
+
+
+def _seal_chunk(file_cipher: FrameCipher, index: int, flags: int, chunk: bytes) -> tuple:
+    return container.seal_frame(file_cipher, index, flags, chunk), flags
+
+
+async def _read_exactly(reader: StreamReader, size: int) -> bytes:
+    # Returns less than size bytes only at EOF
+    try:
+        return await reader.readexactly(size)
+    except IncompleteReadError as error:
+        return error.partial
+
+
+async def _read_header(reader: StreamReader) -> bytes:
+    try:
+        version = await reader.readuntil(b'\n')
+    except (IncompleteReadError, LimitOverrunError) as error:
+        raise VersionMismatch('stream: invalid version') from error
+
+    try:
+        parts = [version, await reader.readexactly(container.KEY_SLOT_SIZE)]
+
+        for length_struct in (container.FIELDS_LENGTH, container.METADATA_LENGTH):
+            raw_length = await reader.readexactly(length_struct.size)
+            length, = length_struct.unpack(raw_length)
+
+            if length > MAXIMUM_HEADER_PART:
+                raise CorruptedFile('stream: header is corrupted')
+
+            parts += [raw_length, await reader.readexactly(length)]
+    except IncompleteReadError as error:
+        raise CorruptedFile('stream: header is corrupted') from error
+
+    return b''.join(parts)
@@ -1,18 +1,49 @@
-BYTES_VERSION:                          bytes = b'2021.05.06'                   # Do not modify
+BYTES_VERSION:                          bytes = b'2026.10.17'                   # Do not modify
 STRING_VERSION:                         str = BYTES_VERSION.decode()            # Do not modify
+LEGACY_BYTES_VERSION:                   bytes = b'2021.05.06'                   # Do not modify
+SUPPORTED_BYTES_VERSIONS:               tuple = (BYTES_VERSION, LEGACY_BYTES_VERSION)  # Do not modify
 
 MINIMUM_PASSWORD_LENGTH:                int = 8                                 # >= 8
 MAXIMUM_PASSWORD_LENGTH:                int = 1024                              # > MINIMUM_PASSWORD_LENGTH, <= 4000
 INVALID_PASSWORD_DELAY:                 float = 2.0                             # >= 0.0
 
 PBKDF2_ITERATIONS:                      int = 150_000                           # >= 100_000
+SALT_SIZE:                              int = 32                                # >= 16, 1 equals 1 byte
+
+KEY_AGENT_TTL:                          float = 900.0                           # > 0.0, seconds
+KEY_AGENT_TIMEOUT:                      float = 30.0                            # > 0.0, seconds
+USE_KEY_AGENT:                          bool = False                            # Library callers opt in, cli.py does
 
 PRESERVE_ORIGINAL_FILES:                bool = False                            # Do not modify
+RESUME_ENCRYPTION:                      bool = False                            # Continue interrupted encryptions
+PACK_DIRECTORIES:                       bool = False                            # Encrypt directories as packs, not tars
 ENCRYPTED_FILENAME_ORIGINAL_CHARS:      int = 2                                 # >= 2
 ENCRYPTED_FILENAME_RANDOM_CHARS:        int = 6                                 # >= 2
 ENCRYPTED_FILENAME_CHARSET:             str = 'abcdefghijklmnopqrstuvwxyz'      # Only a-z, A-Z, 0-9
 ENCRYPTED_FILE_EXTENSION:               str = '.cry'                            # Do not modify
 TEMPORAL_FILE_EXTENSION:                str = '.cry_t'                          # Do not modify
 TAR_GZ_FILE_EXTENSION:                  str = '.cry_c'                          # Do not modify
+JOURNAL_FILE_EXTENSION:                 str = '.cry_j'                          # Do not modify
+PROGRESS_FILE_EXTENSION:                str = '.cry_p'                          # Do not modify
+PACK_FILE_EXTENSION:                    str = '.cry_a'                          # Do not modify
+
+FILE_COMPRESSION:                       str = 'none'                            # codec[:level], see utils.compression
+DIRECTORY_COMPRESSION:                  str = 'gzip'                            # codec[:level], see utils.compression
+CIPHER:                                 str = 'fernet'                          # Frame cipher engine, see utils.ciphers
+
+ENCRYPTION_BUFFER_SIZE:                 int = 30_000_000                        # > 0, <= 2 ** 31, 1 equals 1 byte
+AUTOMATIC_BUFFER_SIZE:                  bool = False                            # Choose from file size and free memory
+MINIMUM_AUTOMATIC_BUFFER_SIZE:          int = 1_000_000                         # > 0, 1 equals 1 byte
+MAXIMUM_AUTOMATIC_BUFFER_SIZE:          int = 64_000_000                        # >= MINIMUM_AUTOMATIC_BUFFER_SIZE
+PROGRESS_JOURNAL_INTERVAL:              int = 256_000_000                       # > 0, bytes between resume points
+READER_CACHE_FRAMES:                    int = 4                                 # >= 1, decrypted chunks kept by open()
+BACKUP_CHUNK_SIZE:                      int = 4_000_000                         # > 0, changing it stops deduplication
+PACK_CHUNK_SIZE:                        int = 1_000_000                         # > 0, smaller reads less per file
+
+PARALLEL_JOBS:                          int = 1                                 # >= 1
+PARALLEL_WINDOW:                        int = 2                                 # >= 1, chunks in memory per job
+BATCH_WORKERS:                          int = 1                                 # >= 1, paths processed at once
+PATH_VALIDATION_JOBS:                   int = 1                                 # >= 1, directories scanned at once
+EXTRACTION_JOBS:                        int = 1                                 # >= 1, files written at once
 
-ENCRYPTION_BUFFER_SIZE:                 int = 30_000_000                        # > 0, 1 equals 1 byte
+QUIET:                                  bool = False                            # No per-path progress bars or messages
@@ -1,4 +1,13 @@
-from .compression import path_to_tar_gz, tar_gz_to_directory, delete_directory
-from .errors import kill
-from .passwords import password_to_key
-from .path_validation import path_validator
+from . import agent
+from .ciphers import parse_cipher, cipher_from_identifier, CipherEngine
+from .compression import path_to_tar_gz, tar_gz_to_directory, delete_directory, delete_archived
+from .compression import path_to_tar_stream, tar_stream_to_directory, IteratorReader
+from .compression import parse_compression, codec_from_identifier, compress_chunks, decompress_chunks
+from .engine import ordered_map, chunks_in_flight, parse_size, chunk_size, peak_memory
+from .errors import kill, Aborted, CrycriptError
+from .files import reserve_filename, commit_file, write_atomically, fsync_directory, FileWriter
+from .packs import pack_chunks, PackReader, PackEntry
+from .passwords import password_to_key, ask_password, check_password, KeyProvider, PasswordKeys
+from .passwords import file_key, new_file_key, new_salt
+from .path_validation import path_validator, scan_tree, tree_size, TreeEntry
+from .stats import Stats, Phase, profiling
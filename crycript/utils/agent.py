@@ -0,0 +1,247 @@
+from hashlib import sha3_512
+from json import dumps, loads
+from os import chmod, getuid, lstat, makedirs, remove, environ
+from os.path import dirname, exists, join as os_join
+from socket import socket, AF_UNIX, SOCK_STREAM
+from stat import S_IMODE, S_ISDIR, S_ISSOCK
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Lock
+from time import monotonic
+
+from .kdf import derive_key
+from .. import constants
+
+
+def socket_path() -> str:
+    """Returns the path of the key agent socket.
+
+    $CRYCRIPT_AGENT_SOCK if set, else $XDG_RUNTIME_DIR/crycript/agent.sock or /tmp/crycript-UID/agent.sock"""
+    if environ.get('CRYCRIPT_AGENT_SOCK'):
+        return environ['CRYCRIPT_AGENT_SOCK']
+
+    if environ.get('XDG_RUNTIME_DIR'):
+        return os_join(environ['XDG_RUNTIME_DIR'], 'crycript', 'agent.sock')
+
+    return os_join('/tmp', f'crycript-{getuid()}', 'agent.sock')
+
+
+def check_socket_path(path: str, socket_exists: bool = True):
+    """Raise PermissionError unless the socket and its directory belong to the current user and nobody else can
+    use them, so keys and password hashes are never exchanged with another user's listener.
+
+    path: str -> socket path
+    socket_exists: bool -> also check the socket itself (not before serve() creates it)"""
+    _check_private(dirname(path) or '.', S_ISDIR, 0o700)
+
+    if socket_exists:
+        _check_private(path, S_ISSOCK, 0o600)
+
+
+def _check_private(path: str, is_kind, mode: int):
+    # lstat() does not follow symbolic links, so a link is never trusted
+    status = lstat(path)
+
+    if not is_kind(status.st_mode) or status.st_uid != getuid() or S_IMODE(status.st_mode) & ~mode:
+        raise PermissionError(f'{path} is not private to the current user (owner and mode {oct(mode)})')
+
+
+def password_hash(password: str) -> str:
+    """Returns the identifier of a password inside the key agent cache.
+
+    password: str -> validated password"""
+    return sha3_512(password.encode()).hexdigest()
+
+
+class KeyAgent:
+    """In-memory cache of derived keys, indexed by (password hash, salt).
+
+    While unlocked, the agent also holds one password and derives keys for it on request.
+    Every entry expires ttl seconds after it was stored, lock() forgets everything."""
+
+    def __init__(self, ttl: float):
+        """ttl: float -> seconds an unlocked password or a cached key is kept"""
+        self.ttl = ttl
+        self._lock = Lock()
+        self._password = None
+        self._password_expires = 0.0
+        self._keys = {}
+
+    def _expire(self):
+        now = monotonic()
+
+        if self._password is not None and self._password_expires <= now:
+            self._password = None
+
+        for entry in [entry for entry, (key, expires) in self._keys.items() if expires <= now]:
+            del self._keys[entry]
+
+    def unlock(self, password: str, ttl: float = None):
+        with self._lock:
+            self._password = password
+            self._password_expires = monotonic() + (ttl or self.ttl)
+
+    def lock(self):
+        with self._lock:
+            self._password = None
+            self._keys.clear()
+
+    def unlocked(self) -> bool:
+        with self._lock:
+            self._expire()
+            return self._password is not None
+
+    def key(self, salt: bytes, hashed_password: str = None) -> bytes:
+        """Returns the cached key, or None. Without hashed_password, use (and derive for) the unlocked password."""
+        with self._lock:
+            self._expire()
+
+            if hashed_password is None:
+                if self._password is None:
+                    return None
+                password = self._password
+                hashed_password = password_hash(password)
+            else:
+                password = None
+
+            entry = self._keys.get((hashed_password, salt))
+            if entry is not None:
+                return entry[0]
+
+        if password is None:
+            return None
+
+        # Derive outside of the lock, other clients keep being served meanwhile
+        key = derive_key(password, salt)
+        self.store(salt, hashed_password, key)
+
+        return key
+
+    def store(self, salt: bytes, hashed_password: str, key: bytes):
+        with self._lock:
+            self._keys[(hashed_password, salt)] = (key, monotonic() + self.ttl)
+
+    def handle(self, request: dict) -> dict:
+        """Returns the response to a client request."""
+        command = request.get('command')
+
+        if command == 'status':
+            return {'unlocked': self.unlocked(), 'ttl': self.ttl}
+
+        if command == 'unlock':
+            self.unlock(request['password'], request.get('ttl'))
+            return {'unlocked': True}
+
+        if command == 'lock':
+            self.lock()
+            return {'unlocked': False}
+
+        if command == 'key':
+            key = self.key(bytes.fromhex(request['salt']), request.get('password_hash'))
+            return {'key': key.decode() if key is not None else None}
+
+        if command == 'store':
+            self.store(bytes.fromhex(request['salt']), request['password_hash'], request['key'].encode())
+            return {}
+
+        return {'error': f'unknown command {command!r}'}
+
+
+class _AgentRequestHandler(StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.handle(loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                response = {'error': f'invalid request ({error})'}
+
+            self.wfile.write(dumps(response).encode() + b'\n')
+
+
+def serve(path: str = None, ttl: float = None):
+    """Run a key agent listening on the given Unix socket until interrupted. Nothing is written to disk.
+
+    path: str -> socket path, socket_path() if None
+    ttl: float -> seconds keys are kept, crycript.constants.KEY_AGENT_TTL if None"""
+    path = path or socket_path()
+
+    makedirs(dirname(path), mode=0o700, exist_ok=True)
+    check_socket_path(path, socket_exists=False)
+
+    # Replace stale sockets, but never steal the socket of a running agent
+    if exists(path):
+        check_socket_path(path)
+        if request({'command': 'status'}, path) is not None:
+            raise OSError(f'a key agent is already listening on {path}')
+        remove(path)
+
+    server = ThreadingUnixStreamServer(path, _AgentRequestHandler)
+    server.daemon_threads = True
+    server.agent = KeyAgent(constants.KEY_AGENT_TTL if ttl is None else ttl)
+    chmod(path, 0o600)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.agent.lock()
+        remove(path)
+
+
+def request(message: dict, path: str = None) -> dict:
+    """Returns the response of the key agent, or None if no agent is reachable
+    (or its socket is not private to the current user, see check_socket_path()).
+
+    message: dict -> request with a 'command' key
+    path: str -> socket path, socket_path() if None"""
+    path = path or socket_path()
+
+    try:
+        check_socket_path(path)
+
+        with socket(AF_UNIX, SOCK_STREAM) as client:
+            client.settimeout(constants.KEY_AGENT_TIMEOUT)
+            client.connect(path)
+            client.sendall(dumps(message).encode() + b'\n')
+
+            with client.makefile('rb') as response:
+                line = response.readline()
+    except OSError:
+        return None
+
+    try:
+        response = loads(line)
+    except ValueError:
+        return None
+
+    return None if 'error' in response else response
+
+
+def unlocked() -> bool:
+    """Returns True if a key agent is running and holds an unlocked password."""
+    response = request({'command': 'status'})
+    return bool(response and response.get('unlocked'))
+
+
+def cached_key(salt: bytes, password: str = None) -> bytes:
+    """Returns the key for the given password and salt from the key agent, or None.
+
+    salt: bytes -> key derivation salt
+    password: str -> validated password, the unlocked agent password if None"""
+    message = {'command': 'key', 'salt': salt.hex()}
+    if password is not None:
+        message['password_hash'] = password_hash(password)
+
+    response = request(message)
+    if not response or not response.get('key'):
+        return None
+
+    return response['key'].encode()
+
+
+def store_key(salt: bytes, password: str, key: bytes):
+    """Give a derived key to the key agent, if one is running.
+
+    salt: bytes -> key derivation salt
+    password: str -> validated password
+    key: bytes -> key derived from password and salt"""
+    request({'command': 'store', 'salt': salt.hex(), 'password_hash': password_hash(password), 'key': key.decode()})
@@ -0,0 +1,249 @@
+from hmac import compare_digest
+from os import urandom
+from struct import pack
+from typing import Callable, NamedTuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.ciphers.algorithms import AES
+from cryptography.hazmat.primitives.ciphers.modes import CBC
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.hazmat.primitives.hmac import HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+FRAME_KEY_SIZE: int = 32
+FRAME_IV_SIZE: int = 16
+FRAME_TAG_SIZE: int = 32
+AEAD_NONCE_SIZE: int = 12
+AEAD_TAG_SIZE: int = 16
+
+
+class FrameCipher:
+    """Authenticated encryption of raw bytes using the Fernet construction (AES-128-CBC + HMAC-SHA256).
+
+    Unlike cryptography.fernet.Fernet, tokens are not base64 encoded and the tag also covers
+    associated data, so a frame can be bound to its position in the file.
+
+    Token structure: [iv (16 bytes)][ciphertext][tag (32 bytes)]"""
+
+    def __init__(self, key: bytes):
+        """key: bytes -> 32 random bytes, the first half signs, the second half encrypts"""
+        if len(key) != FRAME_KEY_SIZE:
+            raise ValueError(f'Frame keys must be {FRAME_KEY_SIZE} bytes long')
+
+        self._signing_key = key[:16]
+        self._encryption_key = key[16:]
+
+    @staticmethod
+    def generate_key() -> bytes:
+        """Returns a new random frame key."""
+        return urandom(FRAME_KEY_SIZE)
+
+    @staticmethod
+    def token_size(data_size: int) -> int:
+        """Returns the size of the token produced for data_size bytes of plaintext.
+
+        data_size: int -> plaintext size in bytes"""
+        return FRAME_IV_SIZE + (data_size // 16 + 1) * 16 + FRAME_TAG_SIZE
+
+    def _tag(self, associated_data: bytes, iv: bytes, ciphertext: bytes) -> bytes:
+        h = HMAC(self._signing_key, SHA256(), backend=default_backend())
+        h.update(pack('>Q', len(associated_data)))
+        h.update(associated_data)
+        h.update(iv)
+        h.update(ciphertext)
+        return h.finalize()
+
+    def encrypt(self, data: bytes, associated_data: bytes = b'', prefix: int = 0) -> bytearray:
+        """Returns the token for the given data, built in a single buffer without copying data.
+
+        data: bytes -> plaintext to encrypt (any bytes-like object, e.g. a memoryview)
+        associated_data: bytes -> authenticated but not encrypted data, required again to decrypt
+        prefix: int -> free bytes left before the token, so the caller can fill them without copying the token"""
+        data = memoryview(data).cast('B')
+        whole_blocks = len(data) - len(data) % 16
+
+        # update_into() needs one block minus one byte of spare room
+        token = bytearray(prefix + self.token_size(len(data)) + 15)
+        view = memoryview(token)
+
+        iv = urandom(FRAME_IV_SIZE)
+        view[prefix:prefix + FRAME_IV_SIZE] = iv
+        position = prefix + FRAME_IV_SIZE
+
+        encryptor = Cipher(AES(self._encryption_key), CBC(iv), backend=default_backend()).encryptor()
+
+        if whole_blocks:
+            position += encryptor.update_into(data[:whole_blocks], view[position:])
+
+        # PKCS7 padding, only the last (partial) block is copied
+        padding = 16 - len(data) % 16
+        position += encryptor.update_into(bytes(data[whole_blocks:]) + bytes((padding,)) * padding, view[position:])
+        encryptor.finalize()
+
+        view[position:position + FRAME_TAG_SIZE] = self._tag(
+            associated_data, iv, view[prefix + FRAME_IV_SIZE:position]
+        )
+
+        view.release()
+        del token[position + FRAME_TAG_SIZE:]
+
+        return token
+
+    def decrypt(self, token: bytes, associated_data: bytes = b'') -> bytearray:
+        """Returns the plaintext of the given token, raise InvalidToken if it was modified.
+
+        token: bytes -> token created with encrypt() (any bytes-like object, e.g. a memoryview)
+        associated_data: bytes -> same associated data used to encrypt"""
+        token = memoryview(token).cast('B')
+
+        if len(token) < FRAME_IV_SIZE + 16 + FRAME_TAG_SIZE or (len(token) - FRAME_IV_SIZE - FRAME_TAG_SIZE) % 16:
+            raise InvalidToken
+
+        iv = token[:FRAME_IV_SIZE]
+        ciphertext = token[FRAME_IV_SIZE:-FRAME_TAG_SIZE]
+
+        if not compare_digest(self._tag(associated_data, iv, ciphertext), token[-FRAME_TAG_SIZE:]):
+            raise InvalidToken
+
+        # update_into() needs one block minus one byte of spare room
+        plaintext = bytearray(len(ciphertext) + 15)
+
+        decryptor = Cipher(AES(self._encryption_key), CBC(bytes(iv)), backend=default_backend()).decryptor()
+        size = decryptor.update_into(ciphertext, plaintext)
+        decryptor.finalize()
+
+        # The tag is valid, so the padding can be checked without caring about timing
+        padding = plaintext[size - 1]
+        if not 1 <= padding <= 16 or plaintext[size - padding:size] != bytes((padding,)) * padding:
+            raise InvalidToken
+
+        del plaintext[size - padding:]
+
+        return plaintext
+
+
+class DerivedFrameCipher:
+    """Fernet construction (see FrameCipher) with one key per chunk, derived when it is needed with HKDF-SHA256
+    from the file key and the chunk index, so chunk keys are never stored nor kept in memory.
+
+    encrypt() and decrypt() use a metadata key, derived the same way with its own label."""
+
+    def __init__(self, key: bytes):
+        """key: bytes -> 32 random bytes, the file key"""
+        if len(key) != FRAME_KEY_SIZE:
+            raise ValueError(f'Frame keys must be {FRAME_KEY_SIZE} bytes long')
+
+        self._key = key
+        self._metadata_cipher = FrameCipher(self._derive(b'metadata'))
+
+    def chunk_cipher(self, index: int) -> FrameCipher:
+        """Returns the cipher of a chunk.
+
+        index: int -> chunk (frame) number, starting at 0"""
+        return FrameCipher(self._derive(b'chunk' + pack('>Q', index)))
+
+    def encrypt(self, data: bytes, associated_data: bytes = b'', prefix: int = 0) -> bytearray:
+        """Returns the token for the given data, encrypted with the metadata key (see FrameCipher.encrypt())."""
+        return self._metadata_cipher.encrypt(data, associated_data, prefix)
+
+    def decrypt(self, token: bytes, associated_data: bytes = b'') -> bytearray:
+        """Returns the plaintext of a token created with encrypt() (see FrameCipher.decrypt())."""
+        return self._metadata_cipher.decrypt(token, associated_data)
+
+    def _derive(self, label: bytes) -> bytes:
+        return HKDF(
+            SHA256(), FRAME_KEY_SIZE, salt=None, info=b'crycript ' + label, backend=default_backend()
+        ).derive(self._key)
+
+
+class AeadCipher:
+    """Authenticated encryption of raw bytes with an AEAD algorithm (AES-256-GCM or ChaCha20-Poly1305).
+
+    Data is encrypted and authenticated in one pass, using AES-NI and carry-less multiplication (or SIMD for
+    ChaCha20) when the CPU has them. Nonces are given by the caller, who must never repeat one under a key.
+
+    Token structure: [ciphertext][tag (16 bytes)]"""
+
+    def __init__(self, key: bytes, algorithm: Callable):
+        """key: bytes -> 32 random bytes
+        algorithm: Callable -> AESGCM or ChaCha20Poly1305 (cryptography.hazmat.primitives.ciphers.aead)"""
+        if len(key) != FRAME_KEY_SIZE:
+            raise ValueError(f'Frame keys must be {FRAME_KEY_SIZE} bytes long')
+
+        self._aead = algorithm(key)
+
+    @staticmethod
+    def token_size(data_size: int) -> int:
+        """Returns the size of the token produced for data_size bytes of plaintext.
+
+        data_size: int -> plaintext size in bytes"""
+        return data_size + AEAD_TAG_SIZE
+
+    def encrypt(self, data: bytes, associated_data: bytes, nonce: bytes) -> bytes:
+        """Returns the token for the given data.
+
+        data: bytes -> plaintext to encrypt (any bytes-like object, e.g. a memoryview)
+        associated_data: bytes -> authenticated but not encrypted data, required again to decrypt
+        nonce: bytes -> AEAD_NONCE_SIZE bytes, never used before with this key"""
+        return self._aead.encrypt(nonce, _as_bytes(data), associated_data)
+
+    def decrypt(self, token: bytes, associated_data: bytes, nonce: bytes) -> bytes:
+        """Returns the plaintext of the given token, raise InvalidToken if it was modified.
+
+        token: bytes -> token created with encrypt() (any bytes-like object, e.g. a memoryview)
+        associated_data: bytes -> same associated data used to encrypt
+        nonce: bytes -> same nonce used to encrypt"""
+        try:
+            return self._aead.decrypt(_as_bytes(nonce), _as_bytes(token), associated_data)
+        except InvalidTag:
+            raise InvalidToken
+
+
+def _as_bytes(data) -> bytes:
+    # The AEAD classes of cryptography 3.x only take bytes, other bytes-like objects are copied
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+class CipherEngine(NamedTuple):
+    """Authenticated encryption of frames and metadata, identified in encrypted headers by its identifier.
+    Only resumable engines can seal a frame index again after an interruption (Fernet tokens have a random IV,
+    AEAD nonces are made from the frame index and must never seal different data)."""
+    identifier: int
+    name: str
+    file_cipher: Callable
+    resumable: bool
+
+
+CIPHERS = {engine.name: engine for engine in (
+    CipherEngine(3, 'fernet', DerivedFrameCipher, True),
+    CipherEngine(0, 'fernet-wrapped', FrameCipher, True),
+    CipherEngine(1, 'aes-256-gcm', lambda key: AeadCipher(key, AESGCM), False),
+    CipherEngine(2, 'chacha20-poly1305', lambda key: AeadCipher(key, ChaCha20Poly1305), False)
+)}
+
+
+def parse_cipher(name: str) -> CipherEngine:
+    """Returns the cipher engine with the given name, raise ValueError if it is unknown.
+
+    name: str -> fernet, fernet-wrapped, aes-256-gcm or chacha20-poly1305"""
+    name = name.strip().lower()
+
+    if name not in CIPHERS:
+        raise ValueError(f'unknown cipher {name!r} (choose from {", ".join(CIPHERS)})')
+
+    return CIPHERS[name]
+
+
+def cipher_from_identifier(identifier: int) -> CipherEngine:
+    """Returns the cipher engine with the given header identifier, raise ValueError if it is unknown.
+
+    identifier: int -> cipher engine identifier"""
+    for engine in CIPHERS.values():
+        if engine.identifier == identifier:
+            return engine
+
+    raise ValueError(f'unknown cipher {identifier}')
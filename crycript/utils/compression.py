@@ -1,9 +1,32 @@
-from os import walk, remove, rmdir
-from os.path import join as os_join, basename
-from tarfile import open as tar_open
+import lzma
+import zlib
+from contextlib import contextmanager
+from errno import ENOENT, ENOTEMPTY
+from functools import partial
+from io import BufferedReader, RawIOBase
+from grp import getgrgid
+from os import walk, remove, rmdir, pipe, readlink, makedirs, geteuid, fstat, stat, stat_result
+from os.path import join as os_join, basename, dirname, isabs, islink
+from pwd import getpwuid
+from stat import S_IMODE, S_ISDIR, S_ISLNK, S_ISREG
+from tarfile import open as tar_open, DIRTYPE, REGTYPE, SYMTYPE, TarError, TarFile, TarInfo
+from threading import Thread
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple
 
+from .files import FileWriter
+from .path_validation import TreeEntry, scan_tree
 from .. import constants
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 
 def delete_directory(dir_to_delete: str):
     """Remove all the contents of a given directory, then remove it.
@@ -19,13 +42,43 @@ def delete_directory(dir_to_delete: str):
 
         # Loop on directories
         for name in dirs:
-            # Remove (empty) directory
-            rmdir(os_join(root, name))
+            # Symbolic links to directories are listed with them, but never walked into
+            if islink(os_join(root, name)):
+                remove(os_join(root, name))
+            else:
+                # Remove (empty) directory
+                rmdir(os_join(root, name))
 
     # Remove (now empty) directory
     rmdir(dir_to_delete)
 
 
+def delete_archived(entries: list):
+    """Remove the entries archived by path_to_tar_stream() or pack_chunks(), contents before their directories.
+
+    Only what was archived is removed: an entry changed since it was read is kept, and so is a directory
+    that is not empty (something was added to it meanwhile). Entries removed meanwhile are ignored.
+
+    entries: list -> TreeEntry of every archived entry, parents before their contents"""
+    for entry in reversed(entries):
+        if S_ISDIR(entry.status.st_mode):
+            try:
+                rmdir(entry.path)
+            except OSError as error:
+                if error.errno not in (ENOENT, ENOTEMPTY):
+                    raise
+            continue
+
+        try:
+            status = stat(entry.path, follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+
+        if (status.st_ino, status.st_size, status.st_mtime_ns) == (
+                entry.status.st_ino, entry.status.st_size, entry.status.st_mtime_ns):
+            remove(entry.path)
+
+
 def path_to_tar_gz(input_path: str, output_path: str):
     """Create a tar gz file based on the given directory, then remove the original directory.
 
@@ -46,10 +99,502 @@ def tar_gz_to_directory(input_tar_gz: str, output_directory: str):
 
     input_tar_gz: str -> path to tar gz file to decompress
     output_directory: str -> path to parent directory for the extracted contents"""
-    # Open the tar gz file
-    with tar_open(input_tar_gz, 'r:gz') as tar:
+    # Open the tar gz file as a stream, members are extracted one after the other
+    with tar_open(input_tar_gz, 'r|gz') as tar:
         # Extract all its contents
-        tar.extractall(members=tar.getmembers(), path=output_directory)
+        _extract_members(tar, output_directory)
 
     # Remove tar gz file
     remove(input_tar_gz)
+
+
+class IteratorReader(RawIOBase):
+    """Read-only file object over an iterable of bytes chunks, consumed lazily."""
+
+    def __init__(self, chunks: Iterable):
+        """chunks: Iterable -> bytes objects to read, in order"""
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+
+            if chunk is None:
+                return 0
+
+            self._chunk = memoryview(chunk)
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+
+        return size
+
+
+@contextmanager
+def path_to_tar_stream(input_path: str, archived: list = None, entries: list = None) -> Iterator[BinaryIO]:
+    """Yields a file object from which a tar of the given directory can be read, without writing it to disk.
+
+    The archive is created in a separate thread, errors are raised when the context exits.
+    Every file is stat again once opened and archived as it was then, entries removed since the tree was
+    scanned are skipped.
+
+    input_path: str -> path to compress
+    archived: list -> if given, the TreeEntry of every archived entry is appended, see delete_archived()
+    entries: list -> scan_tree() result of input_path (e.g. from path_validator()), it is scanned if None"""
+    read_fd, write_fd = pipe()
+    errors = []
+
+    def produce():
+        try:
+            with open(write_fd, 'wb') as pipe_writer:
+                owners = {}
+
+                with tar_open(fileobj=pipe_writer, mode='w|') as tar:
+                    for entry in scan_tree(input_path) if entries is None else entries:
+                        entry = _add_to_tar(tar, entry, basename(input_path), owners)
+
+                        if entry is not None and archived is not None:
+                            archived.append(entry)
+        except BaseException as error:
+            errors.append(error)
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        with open(read_fd, 'rb') as pipe_reader:
+            yield pipe_reader
+    finally:
+        producer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _add_to_tar(tar: TarFile, entry: TreeEntry, root_name: str, owners: dict) -> TreeEntry:
+    # Adds entry to tar, returns it with the status it was archived with (None if it was skipped)
+    status = entry.status
+    arcname = f'{root_name}/{entry.relative_path}' if entry.relative_path else root_name
+
+    if S_ISREG(status.st_mode):
+        try:
+            member = open(entry.path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        with member:
+            # The file may have changed since the tree was scanned, exactly what is stat now is archived
+            status = fstat(member.fileno())
+            entry = entry._replace(status=status)
+
+            # Hard links are rare, tarfile knows how to describe them
+            if status.st_nlink == 1:
+                info = _tar_info(arcname, status, owners)
+            else:
+                info = tar.gettarinfo(arcname=arcname, fileobj=member)
+
+            if info.isreg():
+                tar.addfile(info, member)
+            else:
+                tar.addfile(info)
+
+        return entry
+
+    # Devices and pipes are rare too
+    if S_ISDIR(status.st_mode) or S_ISLNK(status.st_mode):
+        info = _tar_info(arcname, status, owners)
+        info.size = 0
+
+        if S_ISDIR(status.st_mode):
+            info.type = DIRTYPE
+        else:
+            info.type = SYMTYPE
+
+            try:
+                info.linkname = readlink(entry.path)
+            except FileNotFoundError:
+                return None
+    else:
+        try:
+            info = tar.gettarinfo(entry.path, arcname)
+        except FileNotFoundError:
+            return None
+
+        # Sockets can not be archived
+        if info is None:
+            return None
+
+    tar.addfile(info)
+    return entry
+
+
+def _tar_info(arcname: str, status: stat_result, owners: dict) -> TarInfo:
+    # Regular file member described by status, callers change the type of directories and symbolic links
+    info = TarInfo(arcname)
+    info.mode = S_IMODE(status.st_mode)
+    info.uid, info.gid = status.st_uid, status.st_gid
+    info.uname, info.gname = _owner_names(status.st_uid, status.st_gid, owners)
+    info.mtime = status.st_mtime
+    info.type = REGTYPE
+    info.size = status.st_size
+
+    return info
+
+
+def _owner_names(uid: int, gid: int, owners: dict) -> tuple:
+    if (uid, gid) not in owners:
+        try:
+            user = getpwuid(uid).pw_name
+        except KeyError:
+            user = ''
+
+        try:
+            group = getgrgid(gid).gr_name
+        except KeyError:
+            group = ''
+
+        owners[uid, gid] = (user, group)
+
+    return owners[uid, gid]
+
+
+def tar_stream_to_directory(chunks: Iterable, output_directory: str, names: Iterable = None, jobs: int = None) -> set:
+    """Extract a tar, given as an iterable of bytes chunks, in the given parent directory.
+    Returns the given names that matched at least one member.
+
+    Members are extracted as they arrive, the archive is never written to disk and its member list is never
+    kept in memory. Files are written in a thread pool (see FileWriter), while the next ones are decrypted.
+
+    chunks: Iterable -> tar contents, in order
+    output_directory: str -> path to parent directory for the extracted contents
+    names: Iterable -> member names (/ separated), directories bring everything inside, all if None
+    jobs: int -> files written at once, constants.EXTRACTION_JOBS if None"""
+    with tar_open(fileobj=BufferedReader(IteratorReader(chunks)), mode='r|') as tar:
+        return _extract_members(tar, output_directory, names, jobs)
+
+
+def _extract_members(tar: TarFile, output_directory: str, names: Iterable = None, jobs: int = None) -> set:
+    # Extract the members of a tar opened as a stream, returns the names that matched at least one of them
+    names = None if names is None else {name.strip('/') for name in names}
+    found = set()
+    directories = []
+    symlinks = set()
+
+    with FileWriter(jobs) as writer:
+        for member in tar:
+            name = member.name.rstrip('/')
+
+            if names is not None:
+                matched = {selected for selected in names if name == selected or name.startswith(selected + '/')}
+                if not matched:
+                    continue
+                found.update(matched)
+
+            # Names (and targets of hard links) come from the archive, they must stay inside the extraction directory
+            parts = name.split('/')
+            link_parts = member.linkname.rstrip('/').split('/') if member.islnk() else []
+            if isabs(member.name) or '..' in parts or member.islnk() and (isabs(member.linkname) or '..' in link_parts):
+                raise TarError(f'{member.name}: outside the extraction directory')
+
+            # Members can not be written (or hard linked) through a symbolic link extracted before
+            if any('/'.join(path[:depth]) in symlinks
+                   for path in (parts, link_parts) for depth in range(1, len(path) + 1)):
+                raise TarError(f'{member.name}: archived inside a symbolic link')
+
+            if member.issym():
+                symlinks.add(name)
+
+            target = os_join(output_directory, *parts)
+            makedirs(dirname(target), exist_ok=True)
+
+            if member.isdir():
+                makedirs(target, exist_ok=True)
+                directories.append((member, target))
+            elif member.isreg():
+                contents = tar.extractfile(member)
+                writer.write(target, iter(lambda: contents.read(constants.PACK_CHUNK_SIZE), b''), member.size,
+                             partial(_set_attributes, tar, member))
+            else:
+                # The target of a hard link could still be queued
+                if member.islnk():
+                    writer.wait()
+                tar.extract(member, path=output_directory)
+
+    # Writing inside a directory changes its modification time, and its mode could forbid it
+    for member, target in reversed(directories):
+        _set_attributes(tar, member, target)
+
+    return found
+
+
+def _set_attributes(tar: TarFile, member: TarInfo, target: str):
+    # Owner (only root can change it), mode and modification time of an extracted member, like TarFile.extract()
+    if geteuid() == 0:
+        tar.chown(member, target, False)
+    tar.chmod(member, target)
+    tar.utime(member, target)
+
+
+class Codec(NamedTuple):
+    """Streaming compression algorithm, identified in encrypted headers by its identifier.
+    compressor(level) returns a compressobj-like object, decompressor(chunks, size) is decompress_chunks()."""
+    identifier: int
+    name: str
+    default_level: int
+    minimum_level: int
+    maximum_level: int
+    module: str
+    available: bool
+    compressor: Callable
+    decompressor: Callable
+
+
+class _Uncompressed:
+    def __init__(self):
+        self._pending = b''
+
+    @property
+    def eof(self) -> bool:
+        return not self._pending
+
+    needs_input = eof
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        data = self._pending or data
+
+        if 0 <= max_length < len(data):
+            data, self._pending = data[:max_length], data[max_length:]
+        else:
+            self._pending = b''
+
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class _GzipDecompressor:
+    # zlib decompressor with the max_length and needs_input behaviour of lzma.LZMADecompressor
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(31)
+        self.needs_input = True
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        decompressed = self._decompressor.decompress(data or self._decompressor.unconsumed_tail, max_length)
+        self.needs_input = not self._decompressor.unconsumed_tail and len(decompressed) < max_length
+
+        return decompressed
+
+
+class _Lz4Compressor:
+    def __init__(self, level: int):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._header + self._compressor.flush()
+
+
+def _decompress_bounded(decompressor: Callable, chunks: Iterable, size: int) -> Iterator[bytes]:
+    # Decompressors with max_length, needs_input and eof (see lzma.LZMADecompressor), size bytes at a time
+    decompressor = decompressor()
+
+    for chunk in chunks:
+        while True:
+            try:
+                decompressed = decompressor.decompress(chunk, size)
+            except Exception as error:
+                raise ValueError(f'compressed data is corrupted ({error})') from error
+
+            if decompressed:
+                yield decompressed
+
+            if decompressor.needs_input or decompressor.eof:
+                break
+
+            # More output is ready without more input
+            chunk = b''
+
+    if not decompressor.eof:
+        raise ValueError('compressed data is truncated')
+
+
+def _decompress_zstd(chunks: Iterable, size: int) -> Iterator[bytes]:
+    # zstd decompressobj() has no max_length, its stream reader is read size bytes at a time instead
+    ended = [False]
+    reader = zstandard.ZstdDecompressor().stream_reader(IteratorReader(_zstd_frame(chunks, ended)))
+
+    while True:
+        try:
+            decompressed = reader.read(size)
+        except zstandard.ZstdError as error:
+            raise ValueError(f'compressed data is corrupted ({error})') from error
+
+        if not decompressed:
+            break
+
+        yield decompressed
+
+    # The stream reader stops quietly when its input runs out
+    if not ended[0]:
+        raise ValueError('compressed data is truncated')
+
+
+def _zstd_frame(chunks: Iterable, ended: list) -> Iterator[bytes]:
+    # Yields chunks, ended[0] becomes True once the last block (and checksum) of the zstd frame they hold went by.
+    # Only block headers are read: [magic (4)][descriptor (1)][...][block header (3)][contents]...[checksum (0/4)]
+    pending = bytearray()
+    skip = 0
+    header_size, checksum_size = 0, 0
+    last = False
+
+    for chunk in chunks:
+        yield chunk
+
+        if ended[0]:
+            continue
+
+        skipped = min(skip, len(chunk))
+        pending += memoryview(chunk)[skipped:]
+        skip -= skipped
+
+        while not skip and not ended[0]:
+            if last:
+                ended[0] = True
+            elif not header_size:
+                if len(pending) < 5:
+                    break
+
+                descriptor = pending[4]
+                single_segment = descriptor >> 5 & 1
+                header_size = 6 - single_segment + (0, 1, 2, 4)[descriptor & 3]
+                header_size += (single_segment, 2, 4, 8)[descriptor >> 6]
+                checksum_size = 4 if descriptor & 4 else 0
+
+                skip = header_size
+            elif len(pending) >= 3:
+                block = int.from_bytes(pending[:3], 'little')
+                del pending[:3]
+
+                # RLE blocks hold a single byte
+                last = bool(block & 1)
+                skip = (1 if block >> 1 & 3 == 1 else block >> 3) + (checksum_size if last else 0)
+            else:
+                break
+
+            skipped = min(skip, len(pending))
+            del pending[:skipped]
+            skip -= skipped
+
+
+CODECS = {codec.name: codec for codec in (
+    Codec(0, 'none', 0, 0, 0, '', True, lambda level: _Uncompressed(), partial(_decompress_bounded, _Uncompressed)),
+    Codec(
+        1, 'gzip', 6, 0, 9, 'zlib', True,
+        lambda level: zlib.compressobj(level, zlib.DEFLATED, 31),
+        partial(_decompress_bounded, _GzipDecompressor)
+    ),
+    Codec(
+        2, 'xz', 6, 0, 9, 'lzma', True,
+        lambda level: lzma.LZMACompressor(preset=level),
+        partial(_decompress_bounded, lzma.LZMADecompressor)
+    ),
+    Codec(
+        3, 'zstd', 3, 1, 22, 'zstandard', zstandard is not None,
+        lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+        _decompress_zstd
+    ),
+    Codec(
+        4, 'lz4', 0, 0, 16, 'lz4', lz4 is not None,
+        _Lz4Compressor,
+        partial(_decompress_bounded, lambda: lz4.frame.LZ4FrameDecompressor())
+    )
+)}
+
+
+def parse_compression(compression: str) -> tuple:
+    """Returns the (codec, level) tuple of a compression setting, raise ValueError if it is not valid.
+
+    compression: str -> codec name, optionally followed by :level (gzip, gzip:9, zstd:19, none, ...)"""
+    name, _, level = compression.strip().lower().partition(':')
+
+    if name not in CODECS:
+        raise ValueError(f'unknown compression codec {name!r} (choose from {", ".join(CODECS)})')
+
+    codec = CODECS[name]
+
+    if not codec.available:
+        raise ValueError(f'{name} compression requires the {codec.module} package')
+
+    if not level:
+        return codec, codec.default_level
+
+    try:
+        level = int(level)
+    except ValueError:
+        raise ValueError(f'invalid compression level {level!r}')
+
+    if not codec.minimum_level <= level <= codec.maximum_level:
+        raise ValueError(f'{name} compression level must be between {codec.minimum_level} and {codec.maximum_level}')
+
+    return codec, level
+
+
+def codec_from_identifier(identifier: int) -> Codec:
+    """Returns the codec with the given header identifier, raise ValueError if it is unknown or unavailable.
+
+    identifier: int -> codec identifier"""
+    for codec in CODECS.values():
+        if codec.identifier == identifier:
+            if not codec.available:
+                raise ValueError(f'{codec.name} compression requires the {codec.module} package')
+
+            return codec
+
+    raise ValueError(f'unknown compression codec {identifier}')
+
+
+def compress_chunks(chunks: Iterable, codec: Codec, level: int) -> Iterator[bytes]:
+    """Yields the compressed contents of the given chunks.
+
+    chunks: Iterable -> bytes objects to compress, in order
+    codec: Codec -> compression algorithm
+    level: int -> compression level"""
+    compressor = codec.compressor(level)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    compressed = compressor.flush()
+    if compressed:
+        yield compressed
+
+
+def decompress_chunks(chunks: Iterable, codec: Codec, size: int = None) -> Iterator[bytes]:
+    """Yields the decompressed contents of the given chunks, raise ValueError if they are corrupted.
+
+    At most size bytes are decompressed at a time, whatever the compression ratio, so a small input that
+    decompresses to gigabytes never fills the memory.
+
+    chunks: Iterable -> bytes objects compressed with compress_chunks(), in order
+    codec: Codec -> compression algorithm
+    size: int -> largest decompressed chunk yielded, crycript.constants.ENCRYPTION_BUFFER_SIZE if None"""
+    return codec.decompressor(chunks, constants.ENCRYPTION_BUFFER_SIZE if size is None else size)
@@ -0,0 +1,572 @@
+from hashlib import sha256
+from io import FileIO
+from os import O_RDWR, O_WRONLY, close, fsync, open as os_open, pread, pwrite, remove, urandom, writev
+from os.path import exists
+from struct import Struct
+from typing import BinaryIO, Iterator, NamedTuple
+
+from cryptography.fernet import InvalidToken
+
+from .ciphers import AeadCipher, DerivedFrameCipher, FrameCipher, AEAD_NONCE_SIZE, CIPHERS, FRAME_KEY_SIZE
+from .errors import CorruptedFile, VersionMismatch
+from .files import fsync_directory
+from .. import constants
+
+# Fernet token wrapping the 32 bytes file key, its size never changes
+KEY_SLOT_SIZE: int = 140
+
+FIELDS_LENGTH = Struct('>I')
+FIELD_HEADER = Struct('>BH')
+METADATA_LENGTH = Struct('>I')
+FRAME_HEADER = Struct('>IB')
+FRAME_INDEX = Struct('>QB')
+
+# AEAD nonces: frames use their index, metadata a random number (stored in front of it), so none repeats
+AEAD_NONCE = Struct('>IQ')
+NONCE_FRAME: int = 0
+NONCE_METADATA: int = 1
+
+FLAG_FINAL: int = 1
+
+# Public header fields
+FIELD_CODEC: int = 1
+FIELD_SALT: int = 2
+FIELD_CHUNK_SIZE: int = 3
+FIELD_CIPHER: int = 4
+
+CHUNK_SIZE = Struct('>I')
+
+# Journals start with the SHA-256 digest of the header they hold
+JOURNAL_DIGEST_SIZE: int = 32
+
+# Size of a chunk key encrypted with the file key (fernet-wrapped frames)
+WRAPPED_CHUNK_KEY_SIZE: int = FrameCipher.token_size(FRAME_KEY_SIZE)
+
+
+class MalformedFrame(ValueError):
+    """Raised when a frame header is not valid."""
+
+
+class Header(NamedTuple):
+    """Decoded header of an encrypted crycript file."""
+    version: bytes
+    wrapped_key: bytes
+    fields: dict
+    raw_fields: bytes
+    metadata: bytes
+    size: int
+
+    @property
+    def chunk_size(self) -> int:
+        """Size of the plaintext chunks of every frame, None if it was not recorded."""
+        if FIELD_CHUNK_SIZE not in self.fields or len(self.fields[FIELD_CHUNK_SIZE]) != CHUNK_SIZE.size:
+            return None
+
+        return CHUNK_SIZE.unpack(self.fields[FIELD_CHUNK_SIZE])[0]
+
+    @property
+    def cipher(self) -> int:
+        """Identifier of the cipher engine (see ciphers.CIPHERS), fernet-wrapped for files without one."""
+        if len(self.fields.get(FIELD_CIPHER, b'')) != 1:
+            return CIPHERS['fernet-wrapped'].identifier
+
+        return self.fields[FIELD_CIPHER][0]
+
+    @property
+    def maximum_payload(self) -> int:
+        """Largest valid frame payload, None if there is no limit."""
+        if self.chunk_size is None:
+            return None
+        elif self.cipher == CIPHERS['fernet-wrapped'].identifier:
+            return WRAPPED_CHUNK_KEY_SIZE + FrameCipher.token_size(self.chunk_size)
+        elif self.cipher == CIPHERS['fernet'].identifier:
+            return FrameCipher.token_size(self.chunk_size)
+
+        return AeadCipher.token_size(self.chunk_size)
+
+    @property
+    def frame_stride(self) -> int:
+        """Size of every frame but the last one (they all hold a whole chunk), None if it is unknown."""
+        if self.chunk_size is None:
+            return None
+
+        return FRAME_HEADER.size + self.maximum_payload
+
+    def frame_offset(self, index: int) -> int:
+        """Returns the position of a frame in the file, without reading the frames before it.
+        Raise CorruptedFile if the chunk size was not recorded (frames can only be read in order).
+
+        index: int -> frame number, starting at 0"""
+        return self.size + index * self._known_stride()
+
+    def frame_count(self, file_size: int) -> int:
+        """Returns the number of frames of a file.
+        Raise CorruptedFile if the chunk size was not recorded (frames can only be read in order).
+
+        file_size: int -> size of the encrypted file (in bytes)"""
+        return max(-(-(file_size - self.size) // self._known_stride()), 1)
+
+    def _known_stride(self) -> int:
+        # frame_stride, frames can not be located without it
+        if self.frame_stride is None:
+            raise CorruptedFile('encrypted file does not record its chunk size, its frames can not be located')
+
+        return self.frame_stride
+
+
+def encode_fields(fields: dict) -> bytes:
+    """Returns the binary representation of the public header fields.
+
+    fields: dict -> {tag (int): value (bytes)}"""
+    return b''.join(FIELD_HEADER.pack(tag, len(value)) + value for tag, value in sorted(fields.items()))
+
+
+def decode_fields(raw_fields: bytes) -> dict:
+    """Returns the public header fields encoded with encode_fields().
+
+    raw_fields: bytes -> binary fields"""
+    fields = {}
+    position = 0
+
+    while position < len(raw_fields):
+        if position + FIELD_HEADER.size > len(raw_fields):
+            raise ValueError('truncated header field')
+
+        tag, length = FIELD_HEADER.unpack_from(raw_fields, position)
+        position += FIELD_HEADER.size
+
+        if position + length > len(raw_fields):
+            raise ValueError('truncated header field')
+
+        fields[tag] = raw_fields[position:position + length]
+        position += length
+
+    return fields
+
+
+def metadata_associated_data(version: bytes, raw_fields: bytes) -> bytes:
+    """Returns the associated data that authenticates the public part of the header.
+
+    version: bytes -> file version
+    raw_fields: bytes -> binary fields"""
+    return version + b'\n' + raw_fields
+
+
+def frame_associated_data(index: int, flags: int) -> bytes:
+    """Returns the associated data that binds a frame to its position in the file.
+
+    index: int -> frame number, starting at 0
+    flags: int -> frame flags"""
+    return FRAME_INDEX.pack(index, flags)
+
+
+def seal_metadata(file_cipher, version: bytes, raw_fields: bytes, metadata: bytes) -> bytes:
+    """Returns the encrypted metadata of a header, authenticating its public part too.
+
+    file_cipher: FrameCipher | DerivedFrameCipher | AeadCipher -> cipher of the file key
+    version: bytes -> file version
+    raw_fields: bytes -> binary fields
+    metadata: bytes -> plaintext metadata (the original filename)"""
+    associated_data = metadata_associated_data(version, raw_fields)
+
+    if isinstance(file_cipher, AeadCipher):
+        # A new nonce every time, the metadata is encrypted again when the password (salt) changes
+        nonce = AEAD_NONCE.pack(NONCE_METADATA, int.from_bytes(urandom(8), 'big'))
+        return nonce + file_cipher.encrypt(metadata, associated_data, nonce)
+
+    return bytes(file_cipher.encrypt(metadata, associated_data))
+
+
+def open_metadata(file_cipher, version: bytes, raw_fields: bytes, metadata: bytes) -> bytes:
+    """Returns the plaintext of metadata encrypted with seal_metadata(), raise InvalidToken if it was modified.
+
+    file_cipher: FrameCipher | DerivedFrameCipher | AeadCipher -> cipher of the file key
+    version: bytes -> file version
+    raw_fields: bytes -> binary fields
+    metadata: bytes -> encrypted metadata"""
+    associated_data = metadata_associated_data(version, raw_fields)
+
+    if isinstance(file_cipher, AeadCipher):
+        if len(metadata) < AEAD_NONCE_SIZE:
+            raise InvalidToken
+        return file_cipher.decrypt(metadata[AEAD_NONCE_SIZE:], associated_data, metadata[:AEAD_NONCE_SIZE])
+
+    return bytes(file_cipher.decrypt(metadata, associated_data))
+
+
+def seal_frame(file_cipher, index: int, flags: int, data: bytes) -> bytes:
+    """Returns the payload of a frame. With fernet it is encrypted with a chunk key derived from the file key and
+    the frame index, with fernet-wrapped with a new chunk key wrapped by the file key (stored in front of it),
+    and with an AEAD engine with the file key and the frame index as nonce.
+
+    file_cipher: FrameCipher | DerivedFrameCipher | AeadCipher -> cipher of the file key
+    index: int -> frame number, starting at 0
+    flags: int -> frame flags
+    data: bytes -> plaintext chunk (any bytes-like object, it is not copied)"""
+    associated_data = frame_associated_data(index, flags)
+
+    if isinstance(file_cipher, AeadCipher):
+        return file_cipher.encrypt(data, associated_data, AEAD_NONCE.pack(NONCE_FRAME, index))
+    elif isinstance(file_cipher, DerivedFrameCipher):
+        return file_cipher.chunk_cipher(index).encrypt(data, associated_data)
+
+    chunk_key = FrameCipher.generate_key()
+
+    # The wrapped chunk key goes in front of the token, in the same buffer
+    payload = FrameCipher(chunk_key).encrypt(data, associated_data, prefix=WRAPPED_CHUNK_KEY_SIZE)
+    payload[:WRAPPED_CHUNK_KEY_SIZE] = file_cipher.encrypt(chunk_key, associated_data)
+
+    return payload
+
+
+def open_frame(file_cipher, index: int, flags: int, payload: bytes) -> bytes:
+    """Returns the plaintext of a frame created with seal_frame(), raise InvalidToken if it was modified.
+
+    file_cipher: FrameCipher | DerivedFrameCipher | AeadCipher -> cipher of the file key
+    index: int -> frame number, starting at 0
+    flags: int -> frame flags
+    payload: bytes -> encrypted frame contents (any bytes-like object, it is not copied)"""
+    associated_data = frame_associated_data(index, flags)
+
+    if isinstance(file_cipher, AeadCipher):
+        return file_cipher.decrypt(payload, associated_data, AEAD_NONCE.pack(NONCE_FRAME, index))
+    elif isinstance(file_cipher, DerivedFrameCipher):
+        return file_cipher.chunk_cipher(index).decrypt(payload, associated_data)
+
+    payload = memoryview(payload)
+    chunk_key = file_cipher.decrypt(payload[:WRAPPED_CHUNK_KEY_SIZE], associated_data)
+
+    return FrameCipher(chunk_key).decrypt(payload[WRAPPED_CHUNK_KEY_SIZE:], associated_data)
+
+
+def write_header(file: BinaryIO, wrapped_key: bytes, raw_fields: bytes, metadata: bytes) -> int:
+    """Write the header of an encrypted crycript file, returns its size.
+
+    file: BinaryIO -> file opened for binary writing at position 0
+    wrapped_key: bytes -> file key encrypted using the key generated with password_to_key()
+    raw_fields: bytes -> binary fields created with encode_fields()
+    metadata: bytes -> encrypted metadata (original filename)"""
+    if len(wrapped_key) != KEY_SLOT_SIZE:
+        raise ValueError(f'Wrapped keys must be {KEY_SLOT_SIZE} bytes long')
+
+    header = b''.join((
+        constants.BYTES_VERSION, b'\n',
+        wrapped_key,
+        FIELDS_LENGTH.pack(len(raw_fields)), raw_fields,
+        METADATA_LENGTH.pack(len(metadata)), metadata
+    ))
+    _write(file, header)
+
+    return len(header)
+
+
+def read_header(file: BinaryIO, filename: str) -> Header:
+    """Returns the header of an encrypted crycript file, leaving the file at the first frame.
+
+    file: BinaryIO -> file opened for binary reading at position 0
+    filename: str -> filename used in error messages
+
+    Raise VersionMismatch or CorruptedFile if the header can not be read."""
+    version = file.readline()[:-1]
+    if version != constants.BYTES_VERSION:
+        raise VersionMismatch(f'{filename}: invalid version')
+
+    wrapped_key = file.read(KEY_SLOT_SIZE)
+
+    try:
+        raw_fields = _read_sized(file, FIELDS_LENGTH)
+        fields = decode_fields(raw_fields)
+        metadata = _read_sized(file, METADATA_LENGTH)
+    except (EOFError, ValueError):
+        raise CorruptedFile(f'{filename}: header is corrupted')
+
+    if len(wrapped_key) != KEY_SLOT_SIZE:
+        raise CorruptedFile(f'{filename}: header is corrupted')
+
+    return Header(version, wrapped_key, fields, raw_fields, metadata, file.tell())
+
+
+def rewrite_header(path: str, new_header: bytes):
+    """Replace the header of an encrypted crycript file in place, the encrypted contents are not touched.
+
+    The old header is saved to a journal (path + crycript.constants.JOURNAL_FILE_EXTENSION) before writing,
+    so an interrupted rewrite can be undone with recover_header().
+
+    path: str -> path to encrypted crycript file
+    new_header: bytes -> header replacing the current one, must be exactly as long"""
+    journal_path = path + constants.JOURNAL_FILE_EXTENSION
+    file_descriptor = os_open(path, O_RDWR)
+
+    try:
+        old_header = pread(file_descriptor, len(new_header), 0)
+
+        with open(journal_path, 'wb') as journal:
+            journal.write(sha256(old_header).digest() + old_header)
+            journal.flush()
+            fsync(journal.fileno())
+        fsync_directory(journal_path)
+
+        written = 0
+        while written < len(new_header):
+            written += pwrite(file_descriptor, new_header[written:], written)
+        fsync(file_descriptor)
+    finally:
+        close(file_descriptor)
+
+    remove(journal_path)
+    fsync_directory(journal_path)
+
+
+def recover_header(path: str) -> bool:
+    """Restore the header saved by an interrupted rewrite_header(), returns True if it was restored.
+
+    Incomplete journals are discarded, the header was not modified before the journal was complete.
+
+    path: str -> path to encrypted crycript file"""
+    journal_path = path + constants.JOURNAL_FILE_EXTENSION
+
+    if not exists(journal_path):
+        return False
+
+    with open(journal_path, 'rb') as journal:
+        digest = journal.read(JOURNAL_DIGEST_SIZE)
+        old_header = journal.read()
+
+    restore = bool(old_header) and sha256(old_header).digest() == digest
+
+    if restore:
+        file_descriptor = os_open(path, O_WRONLY)
+
+        try:
+            written = 0
+            while written < len(old_header):
+                written += pwrite(file_descriptor, old_header[written:], written)
+            fsync(file_descriptor)
+        finally:
+            close(file_descriptor)
+
+    remove(journal_path)
+    fsync_directory(journal_path)
+
+    return restore
+
+
+def write_frame(file: BinaryIO, payload: bytes, flags: int = 0):
+    """Write a length-prefixed frame.
+
+    Unbuffered files (open(..., buffering=0)) get the frame header and payload in one
+    system call, without joining them.
+
+    file: BinaryIO -> file opened for binary writing
+    payload: bytes -> encrypted frame contents
+    flags: int -> frame flags"""
+    _write(file, FRAME_HEADER.pack(len(payload), flags), payload)
+
+
+def read_frame(file: BinaryIO, maximum_payload: int = None, buffer: memoryview = None) -> tuple:
+    """Returns the next (payload, flags) tuple, or None at the end of the file.
+
+    Raise EOFError if the file ends in the middle of a frame, and MalformedFrame if it is too large.
+
+    file: BinaryIO -> file opened for binary reading at the start of a frame
+    maximum_payload: int -> largest valid payload (in bytes), no limit if None
+    buffer: memoryview -> read the payload into it (a memoryview of buffer is returned) if it fits"""
+    frame_header = _read_frame_header(file, maximum_payload)
+
+    if frame_header is None:
+        return None
+
+    length, flags = frame_header
+    return _read_payload(file, length, buffer), flags
+
+
+def read_into(file: BinaryIO, buffer: memoryview) -> int:
+    """Fill buffer from file using readinto, returns the number of bytes read (less than its size only at EOF).
+
+    file: BinaryIO -> file opened for binary reading
+    buffer: memoryview -> writable buffer"""
+    size = 0
+
+    while size < len(buffer):
+        read = file.readinto(buffer[size:])
+
+        if not read:
+            break
+
+        size += read
+
+    return size
+
+
+def iter_chunks(file: BinaryIO, chunk_size: int) -> Iterator[tuple]:
+    """Yields (index, flags, chunk) tuples covering the whole file, the last one flagged as final.
+
+    An empty file yields a single empty final chunk.
+
+    file: BinaryIO -> file opened for binary reading
+    chunk_size: int -> size in bytes of every chunk but the last one"""
+    index = 0
+    chunk = file.read(chunk_size)
+
+    while True:
+        next_chunk = file.read(chunk_size)
+
+        if not next_chunk:
+            yield index, FLAG_FINAL, chunk
+            return
+
+        yield index, 0, chunk
+
+        index += 1
+        chunk = next_chunk
+
+
+def iter_chunks_into(file: BinaryIO, chunk_size: int, buffers: int, first_index: int = 0) -> Iterator[tuple]:
+    """Same as iter_chunks(), but chunks are memoryviews of a few reusable buffers, read with readinto.
+
+    A buffer is read again buffers - 1 chunks later: chunks must not be used after that. The first chunk
+    is read as it is, buffers are only allocated for files larger than one chunk, so small files do not pay
+    for them.
+
+    file: BinaryIO -> file opened for binary reading
+    chunk_size: int -> size in bytes of every chunk but the last one
+    buffers: int -> number of buffers, at least 2 (utils.chunks_in_flight() + 2 with ordered_map())
+    first_index: int -> index of the first chunk, when the file is not read from the start"""
+    ring = _BufferRing(max(buffers, 2))
+    index = first_index
+
+    chunk = file.read(chunk_size)
+
+    while True:
+        # A short chunk is the last one
+        if len(chunk) < chunk_size:
+            yield index, FLAG_FINAL, chunk
+            return
+
+        buffer = ring.next(chunk_size)
+        next_chunk = buffer[:read_into(file, buffer)]
+
+        if not next_chunk:
+            yield index, FLAG_FINAL, chunk
+            return
+
+        yield index, 0, chunk
+
+        index += 1
+        chunk = next_chunk
+
+
+def iter_frames(file: BinaryIO, maximum_payload: int = None, buffers: int = 0) -> Iterator[tuple]:
+    """Yields (index, flags, payload) tuples up to the final frame.
+
+    Raise EOFError if the file ends before the final frame, and MalformedFrame if a frame is too large.
+
+    file: BinaryIO -> file opened for binary reading at the first frame
+    maximum_payload: int -> largest valid payload (in bytes), no limit if None
+    buffers: int -> read payloads into this many reusable buffers (see iter_chunks_into()), 0 to allocate each one"""
+    ring = _BufferRing(buffers) if buffers else None
+    index = 0
+
+    while True:
+        frame_header = _read_frame_header(file, maximum_payload)
+
+        if frame_header is None:
+            raise EOFError
+
+        # Buffers are as large as the payloads read, not as the chunk size
+        length, flags = frame_header
+        payload = _read_payload(file, length, None if ring is None else ring.next(length))
+
+        yield index, flags, payload
+
+        if flags & FLAG_FINAL:
+            return
+
+        index += 1
+
+
+class _BufferRing:
+    def __init__(self, count: int):
+        self._count = count
+        self._buffers = []
+        self._position = -1
+
+    def next(self, size: int) -> memoryview:
+        # Next buffer of the ring, replaced by a new one if it is smaller than size
+        self._position = (self._position + 1) % self._count
+
+        if self._position == len(self._buffers):
+            self._buffers.append(None)
+
+        if self._buffers[self._position] is None or len(self._buffers[self._position]) < size:
+            self._buffers[self._position] = memoryview(bytearray(size))
+
+        return self._buffers[self._position]
+
+
+def _read_frame_header(file: BinaryIO, maximum_payload: int) -> tuple:
+    # (length, flags) of the next frame, None at the end of the file
+    frame_header = file.read(FRAME_HEADER.size)
+
+    if not frame_header:
+        return None
+
+    if len(frame_header) != FRAME_HEADER.size:
+        raise EOFError
+
+    length, flags = FRAME_HEADER.unpack(frame_header)
+
+    # Never allocate more than the chunk size allows
+    if maximum_payload is not None and length > maximum_payload:
+        raise MalformedFrame(f'frame is larger than the chunk size ({length} > {maximum_payload} bytes)')
+
+    return length, flags
+
+
+def _read_payload(file: BinaryIO, length: int, buffer: memoryview) -> bytes:
+    # Payload of length bytes, read into buffer if it fits
+    if buffer is not None and length <= len(buffer):
+        payload = memoryview(buffer)[:length]
+        if read_into(file, payload) != length:
+            raise EOFError
+    else:
+        payload = file.read(length)
+        if len(payload) != length:
+            raise EOFError
+
+    return payload
+
+
+def _write(file: BinaryIO, *buffers):
+    if not isinstance(file, FileIO):
+        for buffer in buffers:
+            file.write(buffer)
+        return
+
+    # Raw files may write less than asked
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+
+    while views:
+        written = writev(file.fileno(), views)
+
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+
+        if views:
+            views[0] = views[0][written:]
+
+
+def _read_sized(file: BinaryIO, length_struct: Struct) -> bytes:
+    raw_length = file.read(length_struct.size)
+    if len(raw_length) != length_struct.size:
+        raise EOFError
+
+    length, = length_struct.unpack(raw_length)
+
+    data = file.read(length)
+    if len(data) != length:
+        raise EOFError
+
+    return data
+
@@ -0,0 +1,138 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import sysconf
+from resource import getrusage, RUSAGE_SELF
+from sys import platform
+from typing import Callable, Iterable, Iterator
+
+from .. import constants
+
+SIZE_SUFFIXES = {'': 1, 'K': 1_000, 'M': 1_000_000, 'G': 1_000_000_000}
+
+# Frames store their length as uint32, leave room for the chunk key and the cipher overhead
+MAXIMUM_CHUNK_SIZE: int = 2 ** 31
+
+
+def ordered_map(function: Callable, arguments: Iterable, jobs: int = None) -> Iterator:
+    """Yields function(*argument) for every argument, in the same order, running up to jobs calls at once.
+
+    Calls run in a thread pool (the cipher releases the GIL while encrypting), and at most
+    jobs * crycript.constants.PARALLEL_WINDOW results are kept in memory while waiting to be consumed.
+
+    function: Callable -> function to call
+    arguments: Iterable -> tuples of positional arguments, consumed lazily
+    jobs: int -> number of concurrent calls, crycript.constants.PARALLEL_JOBS if None"""
+    jobs = constants.PARALLEL_JOBS if jobs is None else jobs
+
+    if jobs <= 1:
+        for argument in arguments:
+            yield function(*argument)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+
+        try:
+            for argument in arguments:
+                pending.append(executor.submit(function, *argument))
+
+                if len(pending) >= jobs * constants.PARALLEL_WINDOW:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Do not wait for work nobody is going to consume
+            for future in pending:
+                future.cancel()
+
+
+def chunks_in_flight(jobs: int = None) -> int:
+    """Returns how many arguments ordered_map() can hold at once (submitted, but not consumed yet).
+
+    Reusable chunk buffers need this many, plus the one being read (see container.iter_chunks_into()).
+
+    jobs: int -> number of concurrent calls, crycript.constants.PARALLEL_JOBS if None"""
+    jobs = constants.PARALLEL_JOBS if jobs is None else jobs
+
+    return jobs * constants.PARALLEL_WINDOW if jobs > 1 else 1
+
+
+def parse_size(size: str) -> int:
+    """Returns the number of bytes of a size, raise ValueError if it is not valid.
+
+    size: str -> positive integer, optionally followed by K, M or G (powers of 1000), e.g. 64M"""
+    size = size.strip().upper()
+    suffix = size[-1:] if size[-1:] in SIZE_SUFFIXES else ''
+
+    try:
+        number = int(size[:len(size) - len(suffix)].replace('_', ''))
+    except ValueError:
+        raise ValueError(f'invalid size {size!r}')
+
+    number *= SIZE_SUFFIXES[suffix]
+
+    if not 0 < number <= MAXIMUM_CHUNK_SIZE:
+        raise ValueError(f'size must be between 1 and {MAXIMUM_CHUNK_SIZE} bytes')
+
+    return number
+
+
+def available_memory() -> int:
+    """Returns the memory available to new processes (in bytes), or None if it is unknown."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return sysconf('SC_AVPHYS_PAGES') * sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_memory() -> int:
+    """Returns the peak resident memory of this process (in bytes)."""
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    return peak if platform == 'darwin' else peak * 1024
+
+
+def chunks_in_memory(jobs: int = None) -> int:
+    """Returns how many chunk sized buffers can be alive at once while encrypting or decrypting.
+
+    Every chunk in flight holds its plaintext, padded copy and ciphertext, plus the chunk being read and written.
+
+    jobs: int -> number of concurrent calls, crycript.constants.PARALLEL_JOBS if None"""
+    jobs = constants.PARALLEL_JOBS if jobs is None else jobs
+
+    return 3 * (max(jobs, 1) * constants.PARALLEL_WINDOW + 2)
+
+
+def chunk_size(total_size: int = None) -> int:
+    """Returns the chunk size to use, crycript.constants.ENCRYPTION_BUFFER_SIZE unless it is automatic.
+
+    Automatic chunks give every job a few chunks of the file, between the automatic limits,
+    and keep the memory used by chunks under a quarter of the available memory.
+
+    total_size: int -> size of the data to encrypt (in bytes), None if it is unknown (streams)"""
+    if not constants.AUTOMATIC_BUFFER_SIZE:
+        return constants.ENCRYPTION_BUFFER_SIZE
+
+    if total_size is None:
+        size = constants.MAXIMUM_AUTOMATIC_BUFFER_SIZE
+    else:
+        size = -(-total_size // (max(constants.PARALLEL_JOBS, 1) * 4))
+
+    memory = available_memory()
+    if memory is not None:
+        size = min(size, memory // 4 // chunks_in_memory())
+
+    size = max(constants.MINIMUM_AUTOMATIC_BUFFER_SIZE, min(size, constants.MAXIMUM_AUTOMATIC_BUFFER_SIZE))
+
+    # Whole 64 KiB blocks
+    return max(size // 65_536, 1) * 65_536
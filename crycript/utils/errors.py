@@ -1,11 +1,66 @@
+from .. import constants
+
+
+class CrycriptError(Exception):
+    """Base class of the errors raised by crycript, str() gives a message for users."""
+
+
+class InvalidKey(CrycriptError):
+    """The given key is not a valid cryptography.fernet.Fernet key."""
+
+
+class InvalidPassword(CrycriptError):
+    """The password (key or token) does not open the file."""
+
+
+class PasswordPolicyError(CrycriptError):
+    """A password or token does not follow the policy, or its confirmation does not match."""
+
+
+class VersionMismatch(CrycriptError):
+    """The file was not encrypted by crycript, or its version does not support the operation."""
+
+
+class UnsupportedCodec(CrycriptError):
+    """The compression codec is unknown, invalid or its package is not installed."""
+
+
+class UnsupportedCipher(CrycriptError):
+    """The cipher engine is unknown."""
+
+
+class CorruptedFile(CrycriptError):
+    """The encrypted file is malformed, truncated, or its decrypted contents are corrupted."""
+
+
+class TamperedBlock(CorruptedFile):
+    """An encrypted block did not authenticate, it was modified or replaced."""
+
+    def __init__(self, message: str, index: int = None):
+        """message: str -> message for users
+        index: int -> index of the modified frame (or line), None for the header"""
+        super().__init__(message)
+        self.index = index
+
+
+class Aborted(SystemExit):
+    """Raised by kill(), message holds the reason (the exit status is the same as a bare SystemExit)."""
+
+    def __init__(self, message: str):
+        """message: str -> reason printed by kill()"""
+        super().__init__()
+        self.message = message
+
+
 def kill(message: str, end: bool = True):
-    """Print given message and then raise SystemExit.
+    """Print given message and then raise SystemExit (Aborted).
 
     message: str -> message to print
     end: bool -> raise SystemExit if set to True"""
     # Print message
-    print('\n', message, '\n', sep='')
+    if not constants.QUIET:
+        print('\n', message, '\n', sep='')
 
     # Raise SystemExit (exit program)
     if end:
-        raise SystemExit
+        raise Aborted(message)
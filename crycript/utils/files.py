@@ -0,0 +1,132 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import O_CREAT, O_EXCL, O_RDONLY, O_WRONLY, close, fsync, open as os_open, rename
+from os.path import dirname, join as os_join
+from typing import Callable, Iterable
+
+from .. import constants
+
+# Larger files are written by the caller while they are read, so queued writes hold a bounded amount of memory
+MAXIMUM_QUEUED_SIZE: int = 1_000_000
+
+
+def reserve_filename(parent_dir: str, filenames: Iterable) -> str:
+    """Creates an empty file with the first available filename, returns that filename.
+
+    Every try is one atomic exclusive creation (O_CREAT | O_EXCL), so the time needed does not depend on
+    the number of files in parent_dir, and two processes can never choose the same filename.
+
+    parent_dir: str -> directory where the file is created
+    filenames: Iterable -> filenames to try, in order (e.g. an endless generator of random ones)"""
+    for filename in filenames:
+        try:
+            close(os_open(os_join(parent_dir, filename), O_CREAT | O_EXCL | O_WRONLY, 0o666))
+        except FileExistsError:
+            continue
+
+        return filename
+
+    raise FileExistsError(f'no available filename in {parent_dir}')
+
+
+def commit_file(temporal_path: str, path: str):
+    """Makes a completely written file durable, then moves it to path (replacing it) in one atomic step.
+
+    After a crash, path is either missing, its previous version, or complete, never partly written.
+
+    temporal_path: str -> written file, in the same directory (filesystem) as path
+    path: str -> final path"""
+    file_descriptor = os_open(temporal_path, O_RDONLY)
+
+    try:
+        fsync(file_descriptor)
+    finally:
+        close(file_descriptor)
+
+    rename(temporal_path, path)
+    fsync_directory(path)
+
+
+def write_atomically(path: str, data: bytes):
+    """Replaces the contents of a small file atomically (see commit_file()).
+
+    path: str -> file to write
+    data: bytes -> new contents"""
+    temporal_path = path + constants.TEMPORAL_FILE_EXTENSION
+
+    with open(temporal_path, 'wb') as temporal_file:
+        temporal_file.write(data)
+
+    commit_file(temporal_path, path)
+
+
+def fsync_directory(path: str):
+    """Makes the creation, rename or removal of path durable.
+
+    path: str -> file whose parent directory is flushed"""
+    file_descriptor = os_open(dirname(path) or '.', O_RDONLY)
+
+    try:
+        fsync(file_descriptor)
+    finally:
+        close(file_descriptor)
+
+
+class FileWriter:
+    """Writes files in a thread pool, so the latency of creating, writing and closing many small files overlaps.
+
+    At most jobs * crycript.constants.PARALLEL_WINDOW writes are queued, files bigger than MAXIMUM_QUEUED_SIZE
+    are written right away. The first error of a queued write is raised by a later write() or by wait().
+    Use it as a context manager: leaving the with block waits for every queued write."""
+
+    def __init__(self, jobs: int = None, exclusive: bool = False):
+        """jobs: int -> files written at once, crycript.constants.EXTRACTION_JOBS if None (1 writes in the caller)
+        exclusive: bool -> do not overwrite existing files (FileExistsError)"""
+        self._jobs = constants.EXTRACTION_JOBS if jobs is None else jobs
+        self._mode = 'xb' if exclusive else 'wb'
+        self._executor = ThreadPoolExecutor(max_workers=self._jobs) if self._jobs > 1 else None
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        try:
+            if exception_type is None:
+                self.wait()
+        finally:
+            # Do not write files nobody is going to use
+            for future in self._pending:
+                future.cancel()
+
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    def write(self, path: str, chunks: Iterable, size: int, finish: Callable = None):
+        """Writes a file, then calls finish(path) (e.g. to set its mode and modification time).
+
+        path: str -> file to write, its parent directory must exist
+        chunks: Iterable -> contents, consumed before returning (they usually come from a stream)
+        size: int -> expected size of the contents, decides if the write is queued
+        finish: Callable -> called with the path once written, nothing if None"""
+        if self._executor is None or size > MAXIMUM_QUEUED_SIZE:
+            self._write(path, chunks, finish)
+            return
+
+        self._pending.append(self._executor.submit(self._write, path, (b''.join(chunks),), finish))
+
+        if len(self._pending) >= self._jobs * constants.PARALLEL_WINDOW:
+            self._pending.popleft().result()
+
+    def wait(self):
+        """Waits for every queued write, raise the first error of any of them."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def _write(self, path: str, chunks: Iterable, finish: Callable):
+        with open(path, self._mode) as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
+
+        if finish is not None:
+            finish(path)
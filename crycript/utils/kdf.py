@@ -0,0 +1,29 @@
+from base64 import urlsafe_b64encode
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.hashes import SHA3_512
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from .. import constants
+
+
+def derive_key(password: str, salt: bytes) -> bytes:
+    """Returns a valid cryptography.fernet.Fernet key using PBKDF2 and SHA3-512.
+
+    password: str -> validated password
+    salt: bytes -> key derivation salt"""
+    # Set the key derivation function
+    kdf = PBKDF2HMAC(
+        algorithm=SHA3_512(),
+        length=32,
+        salt=salt,
+        iterations=constants.PBKDF2_ITERATIONS,
+        backend=default_backend()
+    )
+
+    # Return a valid key
+    return urlsafe_b64encode(
+        kdf.derive(
+            password.encode()
+        )
+    )
@@ -0,0 +1,290 @@
+import json
+import zlib
+from bisect import bisect_left, bisect_right
+from functools import partial
+from io import SEEK_END
+from os import chmod, fsdecode, fsencode, fstat, makedirs, readlink, symlink, utime
+from os.path import basename, dirname, join as os_join
+from stat import S_IMODE, S_ISDIR, S_ISLNK, S_ISREG
+from struct import Struct, error as StructError
+from typing import BinaryIO, Iterable, Iterator, NamedTuple
+
+from .compression import Codec, codec_from_identifier, compress_chunks, decompress_chunks
+from .errors import CorruptedFile
+from .files import FileWriter
+from .path_validation import scan_tree
+from .. import constants
+
+# Entries of every index page, a lookup only decompresses one page
+INDEX_PAGE_ENTRIES: int = 1024
+
+# Member codec identifier, position and size of the fence
+TRAILER = Struct('>BQQ')
+
+KINDS: tuple = ('file', 'directory', 'symlink')
+
+
+class PackEntry(NamedTuple):
+    """Member of a pack, name is its path inside the pack (/ separated), starting with the packed directory."""
+    name: str
+    kind: str
+    mode: int
+    mtime_ns: int
+    size: int
+    offset: int
+    stored_size: int
+
+
+def pack_chunks(input_path: str, codec: Codec, level: int, archived: list = None,
+                entries: list = None) -> Iterator[bytes]:
+    """Yields the contents of a pack of the given directory, to be encrypted as one stream.
+
+    Pack structure: [] represents a binary field
+
+    [Member 1 contents, compressed on its own]...[Member n contents, compressed on its own]
+    [Index page 1]...[Index page m] -> zlib compressed JSON of INDEX_PAGE_ENTRIES entries, sorted by name
+    [Fence] -> zlib compressed JSON of the first name, position and size of every index page
+    [Member codec (uint8)][Fence position (uint64)][Fence size (uint64)]
+
+    A member is found with a binary search in the fence and then in one index page, so only the trailer,
+    the fence, one page and the member itself are read. Every file is stat again once opened, entries removed
+    since the tree was scanned are skipped, and so are sockets, pipes and devices.
+
+    input_path: str -> path to pack
+    codec: Codec -> compression algorithm of every member
+    level: int -> compression level
+    archived: list -> if given, the TreeEntry of every packed entry is appended, see delete_archived()
+    entries: list -> scan_tree() result of input_path (e.g. from path_validator()), it is scanned if None"""
+    root_name = basename(input_path)
+    index = []
+    offset = 0
+
+    for entry in scan_tree(input_path) if entries is None else entries:
+        status = entry.status
+        opened = [status]
+        name = f'{root_name}/{entry.relative_path}' if entry.relative_path else root_name
+
+        try:
+            if S_ISDIR(status.st_mode):
+                kind, contents = 'directory', None
+            elif S_ISLNK(status.st_mode):
+                kind, contents = 'symlink', (fsencode(readlink(entry.path)),)
+            elif S_ISREG(status.st_mode):
+                kind, contents = 'file', _read_file(open(entry.path, 'rb'), opened)
+            else:
+                continue
+        except FileNotFoundError:
+            continue
+
+        # Sizes of the contents read, and of their compressed form
+        size, stored_size = [0], 0
+
+        if contents is not None:
+            for chunk in compress_chunks(_counted(contents, size), codec, level):
+                stored_size += len(chunk)
+                yield chunk
+
+        # The file may have changed since the tree was scanned, its status when opened is kept
+        status = opened[0]
+        entry = entry._replace(status=status)
+
+        if archived is not None:
+            archived.append(entry)
+
+        index.append(PackEntry(name, kind, S_IMODE(status.st_mode), status.st_mtime_ns, size[0], offset, stored_size))
+        offset += stored_size
+
+    index.sort()
+    fence = []
+
+    for start in range(0, len(index), INDEX_PAGE_ENTRIES):
+        page = zlib.compress(json.dumps([list(entry) for entry in index[start:start + INDEX_PAGE_ENTRIES]]).encode())
+        fence.append([index[start].name, offset, len(page)])
+
+        yield page
+        offset += len(page)
+
+    fence = zlib.compress(json.dumps(fence).encode())
+
+    yield fence
+    yield TRAILER.pack(codec.identifier, offset, len(fence))
+
+
+class PackReader:
+    """Finds and reads the members of a pack (see pack_chunks()), given as a seekable file object.
+
+    Raise CorruptedFile if the pack structure is not valid."""
+
+    def __init__(self, pack_file: BinaryIO):
+        """pack_file: BinaryIO -> pack contents opened for binary reading, e.g. the decrypted contents of a pack"""
+        self._file = pack_file
+        self._page_cache = (None, None)
+
+        try:
+            pack_file.seek(-TRAILER.size, SEEK_END)
+            identifier, fence_offset, fence_size = TRAILER.unpack(pack_file.read(TRAILER.size))
+            self._codec = codec_from_identifier(identifier)
+        except (StructError, ValueError) as error:
+            raise CorruptedFile(f'pack trailer is corrupted: {error}') from error
+
+        self._fence = self._read_index(fence_offset, fence_size)
+
+        if not self._fence or not all(
+                len(page) == 3 and isinstance(page[0], str) and isinstance(page[1], int) and isinstance(page[2], int)
+                for page in self._fence
+        ):
+            raise CorruptedFile('pack index is corrupted')
+
+        self._first_names = [page[0] for page in self._fence]
+
+    def entries(self) -> Iterator[PackEntry]:
+        """Yields every member, sorted by name."""
+        for page in range(len(self._fence)):
+            yield from self._page(page)
+
+    def find(self, name: str) -> list:
+        """Returns the member with the given name and, if it is a directory, every member inside it (sorted by name).
+        Empty if there is no such member.
+
+        name: str -> member name, as returned by entries()"""
+        name = name.strip('/')
+        entry = next(self._entries_from(name), None)
+
+        if entry is None or entry.name != name:
+            return []
+
+        found = [entry]
+
+        # Names are sorted, so the members inside a directory are next to each other
+        if entry.kind == 'directory':
+            for entry in self._entries_from(name + '/'):
+                if not entry.name.startswith(name + '/'):
+                    break
+                found.append(entry)
+
+        return found
+
+    def read(self, entry: PackEntry) -> Iterator[bytes]:
+        """Yields the decompressed contents of a member.
+
+        entry: PackEntry -> member to read"""
+        self._file.seek(entry.offset)
+        size = 0
+
+        try:
+            for data in decompress_chunks(self._stored_chunks(entry), self._codec, constants.PACK_CHUNK_SIZE):
+                size += len(data)
+                yield data
+        except ValueError as error:
+            raise CorruptedFile(f'{entry.name}: packed contents are corrupted: {error}') from error
+
+        if size != entry.size:
+            raise CorruptedFile(f'{entry.name}: packed contents are corrupted')
+
+    def extract(self, entries: Iterable, output_directory: str, jobs: int = None):
+        """Extracts members in the given directory, creating their parent directories. Existing files are not
+        overwritten (FileExistsError). Files are written in a thread pool (see FileWriter).
+
+        entries: Iterable -> PackEntry of the members to extract, sorted by name
+        output_directory: str -> path to parent directory for the extracted members
+        jobs: int -> files written at once, constants.EXTRACTION_JOBS if None"""
+        directories = []
+        symlinks = set()
+
+        with FileWriter(jobs, exclusive=True) as writer:
+            for entry in entries:
+                parts = entry.name.split('/')
+
+                # Members can not be written through a symbolic link extracted before
+                if any('/'.join(parts[:depth]) in symlinks for depth in range(1, len(parts))):
+                    raise CorruptedFile(f'{entry.name}: packed inside a symbolic link')
+
+                target = os_join(output_directory, *parts)
+                makedirs(dirname(target), exist_ok=True)
+
+                if entry.kind == 'directory':
+                    makedirs(target, exist_ok=True)
+                    directories.append((target, entry))
+                elif entry.kind == 'symlink':
+                    symlink(fsdecode(b''.join(self.read(entry))), target)
+                    utime(target, ns=(entry.mtime_ns, entry.mtime_ns), follow_symlinks=False)
+                    symlinks.add(entry.name)
+                else:
+                    writer.write(target, self.read(entry), entry.size, partial(_set_attributes, entry))
+
+        # Writing inside a directory changes its modification time, and its mode could forbid it
+        for target, entry in reversed(directories):
+            _set_attributes(entry, target)
+
+    def _entries_from(self, name: str) -> Iterator[PackEntry]:
+        # Members whose name is not lower than name, in order
+        page = max(bisect_right(self._first_names, name) - 1, 0)
+        entries = self._page(page)
+
+        yield from entries[bisect_left([entry.name for entry in entries], name):]
+
+        for page in range(page + 1, len(self._fence)):
+            yield from self._page(page)
+
+    def _page(self, page: int) -> list:
+        if self._page_cache[0] != page:
+            _, offset, size = self._fence[page]
+            self._page_cache = (page, [_entry(values) for values in self._read_index(offset, size)])
+
+        return self._page_cache[1]
+
+    def _read_index(self, offset: int, size: int) -> list:
+        self._file.seek(offset)
+        data = self._file.read(size)
+
+        try:
+            if len(data) != size:
+                raise ValueError('truncated')
+            return json.loads(zlib.decompress(data))
+        except (ValueError, zlib.error) as error:
+            raise CorruptedFile(f'pack index is corrupted: {error}') from error
+
+    def _stored_chunks(self, entry: PackEntry) -> Iterator[bytes]:
+        remaining = entry.stored_size
+
+        while remaining:
+            data = self._file.read(min(remaining, constants.PACK_CHUNK_SIZE))
+            if not data:
+                raise CorruptedFile(f'{entry.name}: packed contents are truncated')
+
+            remaining -= len(data)
+            yield data
+
+
+def _entry(values: list) -> PackEntry:
+    try:
+        entry = PackEntry(*values)
+    except TypeError as error:
+        raise CorruptedFile('pack index is corrupted') from error
+
+    # Names come from the pack, they must stay inside the extraction directory
+    parts = entry.name.split('/') if isinstance(entry.name, str) else ['']
+    if entry.kind not in KINDS or any(part in ('', '.', '..') for part in parts) or not all(
+            isinstance(value, int) and value >= 0 for value in entry[2:]):
+        raise CorruptedFile('pack index is corrupted')
+
+    return entry
+
+
+def _set_attributes(entry: PackEntry, target: str):
+    # Mode and modification time of an extracted member
+    chmod(target, entry.mode)
+    utime(target, ns=(entry.mtime_ns, entry.mtime_ns))
+
+
+def _read_file(member_file: BinaryIO, status: list) -> Iterator[bytes]:
+    # Contents of an opened file (closed at the end), status[0] is replaced by its fstat() result
+    with member_file:
+        status[0] = fstat(member_file.fileno())
+        yield from iter(lambda: member_file.read(constants.PACK_CHUNK_SIZE), b'')
+
+
+def _counted(chunks: Iterable, size: list) -> Iterator[bytes]:
+    for chunk in chunks:
+        size[0] += len(chunk)
+        yield chunk
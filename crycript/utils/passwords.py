@@ -1,29 +1,24 @@
-from base64 import urlsafe_b64encode
+from abc import ABC, abstractmethod
 from getpass import getpass
+from secrets import randbelow, token_bytes
 from string import ascii_lowercase as lower, ascii_uppercase as upper, digits, punctuation
-from time import time
+from threading import RLock
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.hashes import SHA3_512
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-
-from .errors import kill
+from . import agent
+from .errors import PasswordPolicyError
+from .kdf import derive_key
 from .. import constants
 
 
-def new_token() -> str:
-    """Returns a 6 digits string with the format: nn nn nn."""
-    # Generate seed
-    token = (time() * int(str(time())[:11:-1]))
+def new_salt() -> bytes:
+    """Returns a random key derivation salt of crycript.constants.SALT_SIZE bytes, stored in file headers."""
+    return token_bytes(constants.SALT_SIZE)
 
-    # Salt generation
-    for i in range(constants.PBKDF2_ITERATIONS):
-        token = (
-                      token * ((time() % 1) + 1)
-              ) % 1_000_000
 
+def new_token() -> str:
+    """Returns a 6 digits string with the format: nn nn nn (salt of legacy files)."""
     # Make sure there are 6 digits
-    token = str(int(token)).zfill(6)
+    token = str(randbelow(1_000_000)).zfill(6)
 
     return ' '.join(
         [token[:2],
@@ -41,7 +36,7 @@ def token_validator(token: str) -> str:
 
     # Make sure there are 6 digits
     if len(token) != 6:
-        kill('Aborted: invalid token format (six digits only)')
+        raise PasswordPolicyError('invalid token format (six digits only)')
 
     return ' '.join(
         [str(token)[:2],
@@ -50,78 +45,236 @@ def token_validator(token: str) -> str:
     )
 
 
-def password_to_key(
-        confirm_password: bool = True,
-        generate_token: bool = True,
-        password_message: str = 'Password: ',
-        confirmation_message: str = 'Repeat Password: '
-) -> bytes:
-    """Returns a valid cryptography.fernet.Fernet key using PBKDF2 and SHA512.
-
-    confirm_password: bool -> if set to True, ask for password twice and make sure they are identical
-    generate_token: str -> generate a random token if True, ask for token if False
-    password_message: str -> password prompt
-    confirmation_message: str -> repeat password prompt"""
-    # Use user input to get a password
-    try:
-        password = getpass(password_message).strip()
-    except (KeyboardInterrupt, EOFError):
-        # Raise exit on user ^C or ^D
-        raise SystemExit
+def check_password(password: str) -> str:
+    """Returns the given password, raise PasswordPolicyError if it does not follow the password policy.
 
+    password: str -> password to check"""
     # Verify password length
     if len(password) < constants.MINIMUM_PASSWORD_LENGTH or len(password) > constants.MAXIMUM_PASSWORD_LENGTH:
-        kill(f'Aborted: password should be between {constants.MINIMUM_PASSWORD_LENGTH}'
-             f' and {constants.MAXIMUM_PASSWORD_LENGTH} characters')
+        raise PasswordPolicyError(f'password should be between {constants.MINIMUM_PASSWORD_LENGTH}'
+                                  f' and {constants.MAXIMUM_PASSWORD_LENGTH} characters')
 
     # At least one lowercase
     if not any(char in lower for char in password):
-        kill('Aborted: your password must have at least 1 lowercase')
+        raise PasswordPolicyError('your password must have at least 1 lowercase')
 
     # At least one uppercase
     if not any(char in upper for char in password):
-        kill('Aborted: your password must have at least 1 uppercase')
+        raise PasswordPolicyError('your password must have at least 1 uppercase')
 
     # At least one number
     if not any(char in digits for char in password):
-        kill('Aborted: your password must have at least 1 digit')
+        raise PasswordPolicyError('your password must have at least 1 digit')
 
     # At least one special character
     if not any(char in punctuation for char in password):
-        kill('Aborted: your password must have at least 1 of: ' + punctuation)
+        raise PasswordPolicyError('your password must have at least 1 of: ' + punctuation)
+
+    return password
+
+
+def ask_password(
+        confirm_password: bool = True,
+        password_message: str = 'Password: ',
+        confirmation_message: str = 'Repeat Password: '
+) -> str:
+    """Returns a password that follows the password policy, asked using getpass.
+
+    Raise PasswordPolicyError if it does not follow the policy (see check_password()) or the confirmation
+    does not match.
+
+    confirm_password: bool -> if set to True, ask for password twice and make sure they are identical
+    password_message: str -> password prompt
+    confirmation_message: str -> repeat password prompt"""
+    # Use user input to get a password
+    try:
+        password = check_password(getpass(password_message).strip())
+    except (KeyboardInterrupt, EOFError):
+        # Raise exit on user ^C or ^D
+        raise SystemExit
 
     # Ask for password twice
     if confirm_password:
         try:
             # Verify both passwords match
             if getpass(confirmation_message).strip() != password:
-                kill('Aborted: passwords do not match')
+                raise PasswordPolicyError('passwords do not match')
         except (KeyboardInterrupt, EOFError):
             # Raise exit on user ^C or ^D
             raise SystemExit
 
-    if generate_token:
-        salt = new_token()
-        print(f'Your token is: [{salt}] (put this somewhere safe)')
-    else:
-        try:
-            salt = token_validator(getpass('Enter your token: '))
-        except (KeyboardInterrupt, EOFError):
-            # Raise exit on user ^C or ^D
-            raise SystemExit
+    return password
 
-    # Set the key derivation function
-    kdf = PBKDF2HMAC(
-        algorithm=SHA3_512(),
-        length=32,
-        salt=salt.encode(),
-        iterations=constants.PBKDF2_ITERATIONS,
-        backend=default_backend()
-    )
 
-    # Return a valid key
-    return urlsafe_b64encode(
-        kdf.derive(
-            password.encode()
-        )
-    )
+def ask_token() -> bytes:
+    """Returns the salt of a token based file, asking for its token using getpass."""
+    try:
+        return token_validator(getpass('Enter your token: ')).encode()
+    except (KeyboardInterrupt, EOFError):
+        # Raise exit on user ^C or ^D
+        raise SystemExit
+
+
+class KeyProvider(ABC):
+    """Gives the keys of encrypt(), decrypt() and change_password(), see PasswordKeys.
+
+    Subclasses must implement key() and new_key() (an incomplete one raises TypeError when it is created).
+    Subclasses built with everything they need must never prompt, so they can be used without a terminal."""
+
+    @abstractmethod
+    def key(self, salt: bytes = None) -> bytes:
+        """Returns the key of an existing file.
+
+        salt: bytes -> salt stored in the file header, None for token based files"""
+
+    @abstractmethod
+    def new_key(self, token: bool = False) -> tuple:
+        """Returns a (salt, key) tuple for a new file.
+
+        token: bool -> use a 6 digits token instead of a random salt (legacy files)"""
+
+
+class PasswordKeys(KeyProvider):
+    """Keys derived from one password, asked at most once (never, when it is given).
+
+    Each key is derived once per salt, new files share one random salt, and the key agent is used when asked
+    to and running (no password is asked while it is unlocked). Safe to share between threads."""
+
+    def __init__(
+            self,
+            confirm_password: bool = True,
+            password_message: str = 'Password: ',
+            confirmation_message: str = 'Repeat Password: ',
+            use_agent: bool = None,
+            password: str = None,
+            token: str = None
+    ):
+        """confirm_password: bool -> if set to True, ask for password twice and make sure they are identical
+        password_message: str -> password prompt
+        confirmation_message: str -> repeat password prompt
+        use_agent: bool -> use the key agent (never for new passwords), crycript.constants.USE_KEY_AGENT if None
+        password: str -> password to use instead of asking for it (raise PasswordPolicyError if it is not valid)
+        token: str -> token of legacy files to use instead of asking for it"""
+        self._prompt = (confirm_password, password_message, confirmation_message)
+        self._use_agent = constants.USE_KEY_AGENT if use_agent is None else use_agent
+        self._keys = {}
+        self._salt = None
+        self._token_salt = None if token is None else token_validator(token).encode()
+        self._new_token_salt = None
+        self._lock = RLock()
+
+        if password is not None:
+            self._password = check_password(password)
+
+        # An unlocked agent already knows the password
+        elif self._use_agent and agent.unlocked():
+            self._password = None
+        else:
+            self._password = ask_password(*self._prompt)
+
+    def key(self, salt: bytes = None) -> bytes:
+        """Returns the key for the given salt.
+
+        salt: bytes -> salt stored in the file header, None for token based files (the token is asked once)"""
+        with self._lock:
+            if salt is None:
+                if self._token_salt is None:
+                    self._token_salt = ask_token()
+                salt = self._token_salt
+
+            if salt not in self._keys:
+                self._keys[salt] = self._derive(salt)
+
+            return self._keys[salt]
+
+    def new_key(self, token: bool = False) -> tuple:
+        """Returns a (salt, key) tuple for a new file.
+
+        token: bool -> use a printed 6 digits token instead of a random salt (legacy files)"""
+        with self._lock:
+            if token:
+                if self._new_token_salt is None:
+                    new = new_token()
+                    print(f'Your token is: [{new}] (put this somewhere safe)')
+                    self._new_token_salt = new.encode()
+                salt = self._new_token_salt
+            else:
+                if self._salt is None:
+                    self._salt = new_salt()
+                salt = self._salt
+
+            return salt, self.key(salt)
+
+    def _derive(self, salt: bytes) -> bytes:
+        key = agent.cached_key(salt, self._password) if self._use_agent else None
+
+        if key is None:
+            # The agent was locked or stopped meanwhile
+            if self._password is None:
+                self._password = ask_password(*self._prompt)
+
+            key = derive_key(self._password, salt)
+
+            if self._use_agent:
+                agent.store_key(salt, self._password, key)
+
+        return key
+
+
+def file_key(key=None, salt: bytes = None, **password_options) -> bytes:
+    """Returns the key of an existing file.
+
+    key: bytes | KeyProvider -> key to use as is, keys of a password, or None to ask for the password
+    salt: bytes -> salt stored in the file header, None for token based files
+    password_options -> PasswordKeys() arguments, used if key is None"""
+    if isinstance(key, KeyProvider):
+        return key.key(salt)
+
+    if type(key) == bytes:
+        return key
+
+    return PasswordKeys(**password_options).key(salt)
+
+
+def new_file_key(key=None, token: bool = False, **password_options) -> tuple:
+    """Returns a (salt, key) tuple for a new file, salt is None when key is used as is.
+
+    key: bytes | KeyProvider -> key to use as is, keys of a password, or None to ask for the password
+    token: bool -> use a printed 6 digits token instead of a random salt (legacy files)
+    password_options -> PasswordKeys() arguments, used if key is None"""
+    if isinstance(key, KeyProvider):
+        return key.new_key(token)
+
+    if type(key) == bytes:
+        return None, key
+
+    return PasswordKeys(**password_options).new_key(token)
+
+
+def password_to_key(
+        confirm_password: bool = True,
+        generate_token: bool = True,
+        password_message: str = 'Password: ',
+        confirmation_message: str = 'Repeat Password: ',
+        use_agent: bool = None,
+        salt: bytes = None
+) -> bytes:
+    """Returns a valid cryptography.fernet.Fernet key using PBKDF2 and SHA512.
+
+    With the key agent (use_agent), derived keys are reused from it, and no password is asked while it is unlocked.
+
+    confirm_password: bool -> if set to True, ask for password twice and make sure they are identical
+    generate_token: str -> generate a random token if True, ask for token if False (ignored if salt is given)
+    password_message: str -> password prompt
+    confirmation_message: str -> repeat password prompt
+    use_agent: bool -> use the key agent (never for new passwords), crycript.constants.USE_KEY_AGENT if None
+    salt: bytes -> salt stored in the file header, instead of a token"""
+    keys = PasswordKeys(confirm_password, password_message, confirmation_message, use_agent)
+
+    if salt is not None:
+        return keys.key(salt)
+
+    if generate_token:
+        return keys.new_key(token=True)[1]
+
+    return keys.key()
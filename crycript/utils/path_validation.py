@@ -1,25 +1,107 @@
-from os import access, R_OK, W_OK, walk
-from os.path import isdir, isfile, dirname, abspath, exists, isabs, join as os_join, basename
+from concurrent.futures import ThreadPoolExecutor
+from os import access, geteuid, getegid, getgroups, scandir, stat, stat_result, R_OK, W_OK
+from os.path import dirname, abspath, isabs, basename
+from stat import S_ISDIR, S_ISREG
+from typing import NamedTuple
 
 from .errors import kill
 from .. import constants
 
+# Problems listed when a path is not valid, the rest are counted
+MAXIMUM_REPORTED_PROBLEMS: int = 20
 
-def path_validator(paths: list, sort: bool = False, action: tuple = (False, False, False)) -> tuple:
+# Permission bits that apply to this process
+_EUID: int = geteuid()
+_GROUPS: set = {getegid(), *getgroups()}
+
+
+class TreeEntry(NamedTuple):
+    """File, directory or symbolic link found while scanning a tree, with its lstat() result."""
+    path: str
+    relative_path: str
+    status: stat_result
+
+
+def scan_tree(path: str, jobs: int = None) -> list:
+    """Returns the TreeEntry of path and of everything inside it, parents before their contents, sorted by name.
+
+    Every entry is read with a single os.scandir() pass, the stat results come from the directory entries
+    (no extra system call on most filesystems). Symbolic links are not followed.
+
+    path: str -> absolute path to a file or directory
+    jobs: int -> directories read at once (helps on network filesystems), constants.PATH_VALIDATION_JOBS if None"""
+    jobs = constants.PATH_VALIDATION_JOBS if jobs is None else jobs
+
+    root = TreeEntry(path, '', stat(path, follow_symlinks=False))
+    if not S_ISDIR(root.status.st_mode):
+        return [root]
+
+    # Directory contents, read level by level so one level can be read in parallel
+    contents = {}
+    level = [root]
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        while level:
+            next_level = []
+
+            for directory, children in zip(level, executor.map(_read_directory, level)):
+                contents[directory.path] = children
+                next_level.extend(child for child in children if S_ISDIR(child.status.st_mode))
+
+            level = next_level
+
+    entries = []
+    pending = [root]
+
+    while pending:
+        entry = pending.pop()
+        entries.append(entry)
+        pending.extend(reversed(contents.get(entry.path, ())))
+
+    return entries
+
+
+def tree_size(path: str, entries: list = None) -> int:
+    """Returns the size of a file, or of every regular file inside a directory (in bytes).
+
+    path: str -> absolute path to a file or directory
+    entries: list -> scan_tree() result of path (e.g. from path_validator()), path is scanned if None"""
+    entries = scan_tree(path) if entries is None else entries
+    return sum(entry.status.st_size for entry in entries if S_ISREG(entry.status.st_mode))
+
+
+def path_validator(
+        paths: list,
+        sort: bool = False,
+        action: tuple = (False, False, False),
+        jobs: int = None,
+        writable: bool = True,
+        trees: dict = None
+) -> tuple:
     """Make sure a path:
     1) Is an absolute path
     2) Exists
     3) Is a file or a directory
-    4) Has read and write permissions
+    4) Has read and write permissions (only read permission if writable is False)
 
     Then, depending on action tuple (encrypt, decrypt, change password),
     Make sure is a valid file
 
+    Every path is checked before reporting, so all the problems are shown at once.
+    Directories to encrypt are scanned once (see scan_tree()) to check everything inside, give trees to reuse
+    that scan: encrypt() archives those entries (every file is stat again when it is read) and run_batch() sizes
+    its progress bar with them. Entries added meanwhile are not archived, and so they are not deleted either.
+
     paths: list -> list of strings of paths
-    sort: bool -> sort new list before returning it if set to True"""
+    sort: bool -> sort new list before returning it if set to True
+    jobs: int -> directories read at once, constants.PATH_VALIDATION_JOBS if None
+    writable: bool -> paths and their parent dirs must be writable, False for actions that only read (verify)
+    trees: dict -> if given, the scan_tree() result of every directory to encrypt is stored by its absolute path"""
 
     new_paths = []
     new_filenames = []
+    problems = []
+    parents = {}
 
     for path in paths:
         # Make path absolute
@@ -28,60 +110,126 @@ def path_validator(paths: list, sort: bool = False, action: tuple = (False, Fals
 
         filename = basename(path)
 
-        if not exists(path):
-            kill(f'Aborted: {filename}: path does not exist')
+        try:
+            status = stat(path)
+        except OSError:
+            problems.append(f'{filename}: path does not exist')
+            continue
+
+        if not S_ISREG(status.st_mode) and not S_ISDIR(status.st_mode):
+            problems.append(f'{filename}: path is not a file or a directory')
+            continue
 
-        if not isfile(path) and not isdir(path):
-            kill(f'Aborted: {filename}: path is not a file or a directory')
+        if not _permitted(path, status, writable):
+            problems.append(f'{filename}: path must have read and write permissions' if writable
+                            else f'{filename}: path must have read permission')
+            continue
 
-        if not (access(path, R_OK) and access(path, W_OK)):
-            kill(f'Aborted: {filename}: path must have read and write permissions')
+        parent = dirname(path)
+        if writable and parent not in parents:
+            try:
+                parents[parent] = _permitted(parent, stat(parent))
+            except OSError:
+                parents[parent] = False
 
-        if not (access(dirname(path), R_OK) and access(dirname(path), W_OK)):
-            kill(f'Aborted: {filename}: parent dir must have read and write permissions')
+        if writable and not parents[parent]:
+            problems.append(f'{filename}: parent dir must have read and write permissions')
+            continue
 
         if action[0]:
             # Check for encrypted file
             if path.endswith(constants.ENCRYPTED_FILE_EXTENSION):
-                kill(f'Aborted: {filename}: file already encrypted')
-
-            if isdir(path):
-                for root, dirs, files in walk(path):
-
-                    for d in dirs:
-                        current = os_join(root, d)
-                        if not (access(current, R_OK) and access(current, W_OK)):
-                            kill(
-                                f'Aborted: {filename}: everything inside must have read and write permissions')
-
-                    for f in files:
-                        current = os_join(root, f)
-                        if not (access(current, R_OK) and access(current, W_OK)):
-                            kill(
-                                f'Aborted: {filename}: everything inside must have read and write permissions')
+                problems.append(f'{filename}: file already encrypted')
+                continue
+
+            if S_ISDIR(status.st_mode):
+                try:
+                    entries = scan_tree(path, jobs)
+                except OSError as error:
+                    problems.append(f'{filename}: {error.strerror or error}: {error.filename}')
+                    continue
+
+                denied = [
+                    entry.relative_path for entry in entries[1:]
+                    if not _permitted(entry.path, entry.status)
+                ]
+
+                if denied:
+                    problems.extend(
+                        f'{filename}: everything inside must have read and write permissions ({relative_path})'
+                        for relative_path in denied
+                    )
+                    continue
+
+                if trees is not None:
+                    trees[path] = entries
 
         elif action[1] or action[2]:
             # Check for unencrypted file
             if not path.endswith(constants.ENCRYPTED_FILE_EXTENSION):
-                kill(f'Aborted: {filename}: file not encrypted')
+                problems.append(f'{filename}: file not encrypted')
+                continue
 
             # Path must be a file
-            if not isfile(path):
-                kill(f'Aborted: {filename}: path is not a file')
+            if not S_ISREG(status.st_mode):
+                problems.append(f'{filename}: path is not a file')
+                continue
 
             # Check file version
             with open(path, 'rb') as file:
                 version = file.readline()[:-1]
-                if version != constants.BYTES_VERSION:
-                    message = f'Aborted: {filename}: invalid version\n'
+                if version not in constants.SUPPORTED_BYTES_VERSIONS:
+                    message = f'{filename}: invalid version\n'
                     message += f'crycript version: {constants.STRING_VERSION}\n'
-                    message += f'file version: {version.decode()}'
-                    kill(message)
+                    message += f'file version: {version.decode(errors="replace")}'
+                    problems.append(message)
+                    continue
 
         new_paths.append(path)
         new_filenames.append(filename)
 
+    if len(problems) == 1:
+        kill(f'Aborted: {problems[0]}')
+    elif problems:
+        message = f'Aborted: {len(problems)} problems found'
+        for problem in problems[:MAXIMUM_REPORTED_PROBLEMS]:
+            message += f'\n{problem}'
+        if len(problems) > MAXIMUM_REPORTED_PROBLEMS:
+            message += f'\n... and {len(problems) - MAXIMUM_REPORTED_PROBLEMS} more'
+        kill(message)
+
     if sort:
         new_paths.sort()
 
     return new_paths, new_filenames
+
+
+def _read_directory(directory: TreeEntry) -> list:
+    with scandir(directory.path) as children:
+        return sorted(
+            (
+                TreeEntry(
+                    child.path,
+                    f'{directory.relative_path}/{child.name}' if directory.relative_path else child.name,
+                    child.stat(follow_symlinks=False)
+                )
+                for child in children
+            ),
+            key=lambda child: child.path
+        )
+
+
+def _permitted(path: str, status: stat_result, writable: bool = True) -> bool:
+    # Permission bits answer without a system call, access() only double checks denials (ACLs, capabilities...)
+    if _EUID == 0:
+        return True
+
+    if status.st_uid == _EUID:
+        bits = status.st_mode >> 6
+    elif status.st_gid in _GROUPS:
+        bits = status.st_mode >> 3
+    else:
+        bits = status.st_mode
+
+    wanted = 0o6 if writable else 0o4
+    return bits & wanted == wanted or access(path, R_OK | W_OK if writable else R_OK)
@@ -0,0 +1,169 @@
+import tracemalloc
+from contextlib import contextmanager
+from cProfile import Profile
+from threading import Lock, local
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+_END = object()
+
+
+class Phase(NamedTuple):
+    """Totals of one phase of an action."""
+    seconds: float = 0.0
+    bytes: int = 0
+    chunks: int = 0
+
+
+class Stats:
+    """Per-phase durations, bytes and chunks of an action (key derivation, tar, compression, encryption, write...).
+
+    A phase measured while another one is running only counts once: compressing does not include reading what
+    is compressed. Phases run by several threads at once (encryption with jobs > 1) add up the time of every thread.
+    Thread safe, so one Stats can also collect the totals of many actions.
+
+    Override record() in a subclass to be called back on every measure (e.g. to export metrics)."""
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def record(self, phase: str, seconds: float, size: int = 0, chunks: int = 0) -> None:
+        """Adds a measure to the totals of a phase.
+
+        phase: str -> phase name
+        seconds: float -> time spent, not counting the phases measured meanwhile
+        size: int -> bytes processed
+        chunks: int -> chunks (or calls) processed"""
+        with self._lock:
+            total = self.phases.get(phase, Phase())
+            self.phases[phase] = Phase(total.seconds + seconds, total.bytes + size, total.chunks + chunks)
+
+    @contextmanager
+    def measure(self, phase: str, size: int = 0, chunks: int = 1) -> Iterator[None]:
+        """Measures the code run inside as one call of a phase.
+
+        phase: str -> phase name
+        size: int -> bytes processed
+        chunks: int -> chunks processed"""
+        start = self._start()
+
+        try:
+            yield
+        finally:
+            self._stop(phase, start, size, chunks)
+
+    def iterate(self, phase: str, iterable: Iterable, size: Callable = len) -> Iterator:
+        """Yields every item of iterable, measuring the time taken to produce each one as a phase.
+
+        phase: str -> phase name
+        iterable: Iterable -> iterable to measure, e.g. a generator reading or compressing chunks
+        size: Callable -> returns the bytes of an item"""
+        iterator = iter(iterable)
+
+        while True:
+            start = self._start()
+            item = _END
+
+            try:
+                item = next(iterator, _END)
+            finally:
+                if item is _END:
+                    self._stop(phase, start, 0, 0)
+                else:
+                    self._stop(phase, start, size(item), 1)
+
+            if item is _END:
+                return
+
+            yield item
+
+    def merge(self, other: 'Stats') -> None:
+        """Adds the totals of another Stats to these ones."""
+        for phase, total in list(other.phases.items()):
+            self.record(phase, *total)
+
+    def as_dict(self) -> dict:
+        """Returns a JSON serializable dict of every phase, in the order they started."""
+        with self._lock:
+            phases = dict(self.phases)
+
+        return {
+            phase: {
+                'seconds': round(total.seconds, 4),
+                'bytes': total.bytes,
+                'chunks': total.chunks,
+                'bytes_per_second': round(total.bytes / total.seconds) if total.bytes and total.seconds > 0 else None
+            }
+            for phase, total in phases.items()
+        }
+
+    def __str__(self) -> str:
+        lines = []
+
+        for phase, total in self.as_dict().items():
+            line = f'{phase}: {total["seconds"]} seconds'
+
+            if total['bytes']:
+                line += f', {round(total["bytes"] / 1_000_000, 1)} MB in {total["chunks"]} chunks'
+                if total['bytes_per_second'] is not None:
+                    line += f' ({round(total["bytes_per_second"] / 1_000_000, 1)} MB/s)'
+
+            lines.append(line)
+
+        return '\n'.join(lines)
+
+    def _start(self) -> float:
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+
+        return perf_counter()
+
+    def _stop(self, phase: str, start: float, size: int, chunks: int) -> None:
+        elapsed = perf_counter() - start
+        stack = self._local.stack
+
+        # Time of the measures nested inside this one belongs to them
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+
+        self.record(phase, elapsed - nested, size, chunks)
+
+
+@contextmanager
+def profiling(profile_path: str = None, trace_memory: bool = False) -> Iterator[dict]:
+    """Profiles the code run inside, to diagnose slow hosts (both modes slow everything down, use them on demand).
+
+    Yields a dict, filled on exit with peak_traced_bytes and largest_live_allocations if trace_memory is True.
+
+    profile_path: str -> write cProfile statistics of the calling thread to this file (python -m pstats reads it)
+    trace_memory: bool -> trace Python memory allocations with tracemalloc"""
+    report = {}
+    profile = None if profile_path is None else Profile()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield report
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path)
+
+        if trace_memory:
+            report['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            report['largest_live_allocations'] = [
+                {
+                    'location': f'{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}',
+                    'bytes': statistic.size,
+                    'count': statistic.count
+                }
+                for statistic in tracemalloc.take_snapshot().statistics('lineno')[:10]
+            ]
+            tracemalloc.stop()
@@ -0,0 +1,32 @@
+import pytest
+from cryptography.fernet import Fernet
+
+from crycript import constants
+
+# Small chunks so that every boundary is a few bytes away
+CHUNK_SIZE: int = 1000
+
+# Passwords that follow the policy, keys are derived with few iterations to keep tests fast
+PASSWORD: str = 'Correct-Horse-1'
+PBKDF2_ITERATIONS: int = 1000
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    """Quiet defaults with small chunks, restored after every test."""
+    monkeypatch.setattr(constants, 'QUIET', True)
+    monkeypatch.setattr(constants, 'INVALID_PASSWORD_DELAY', 0.0)
+    monkeypatch.setattr(constants, 'ENCRYPTION_BUFFER_SIZE', CHUNK_SIZE)
+    monkeypatch.setattr(constants, 'AUTOMATIC_BUFFER_SIZE', False)
+    monkeypatch.setattr(constants, 'CIPHER', 'fernet')
+    monkeypatch.setattr(constants, 'FILE_COMPRESSION', 'none')
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', False)
+    monkeypatch.setattr(constants, 'PRESERVE_ORIGINAL_FILES', False)
+    monkeypatch.setattr(constants, 'PACK_DIRECTORIES', False)
+    monkeypatch.setattr(constants, 'USE_KEY_AGENT', False)
+    monkeypatch.setattr(constants, 'PBKDF2_ITERATIONS', PBKDF2_ITERATIONS)
+
+
+@pytest.fixture
+def key() -> bytes:
+    return Fernet.generate_key()
@@ -0,0 +1,156 @@
+import subprocess
+import sys
+from os import chmod, getcwd
+from os.path import exists
+from signal import SIGINT
+from time import sleep
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils import agent
+from crycript.utils.kdf import derive_key
+from crycript.utils.passwords import KeyProvider, PasswordKeys
+from .conftest import PASSWORD, PBKDF2_ITERATIONS
+
+SALT: bytes = b's' * constants.SALT_SIZE
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch) -> str:
+    """Path of the socket of a key agent started for the test, stopped (with ^C) after it."""
+    directory = tmp_path / 'agent'
+    path = str(directory / 'agent.sock')
+    monkeypatch.setenv('CRYCRIPT_AGENT_SOCK', path)
+
+    code = (f'from crycript import constants; from crycript.utils import agent; '
+            f'constants.PBKDF2_ITERATIONS = {PBKDF2_ITERATIONS}; agent.serve({path!r}, 60.0)')
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=getcwd(), stderr=subprocess.DEVNULL)
+
+    try:
+        for _ in range(500):
+            if agent.request({'command': 'status'}, path) is not None:
+                break
+            sleep(0.01)
+        else:
+            pytest.fail('the key agent did not start')
+
+        yield path
+    finally:
+        process.send_signal(SIGINT)
+        process.wait(10)
+
+    assert not exists(path)
+
+
+def test_cache_and_expiry(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(agent, 'monotonic', lambda: clock[0])
+    key_agent = agent.KeyAgent(10.0)
+    hashed_password = agent.password_hash(PASSWORD)
+
+    assert key_agent.key(SALT) is None
+    key_agent.store(SALT, hashed_password, b'key')
+    assert key_agent.key(SALT, hashed_password) == b'key'
+    assert key_agent.key(SALT, agent.password_hash(PASSWORD + 'x')) is None
+
+    key_agent.unlock(PASSWORD, 5.0)
+    assert key_agent.key(b't' * constants.SALT_SIZE) == derive_key(PASSWORD, b't' * constants.SALT_SIZE)
+
+    clock[0] += 6.0
+    assert not key_agent.unlocked()
+    assert key_agent.key(SALT, hashed_password) == b'key'
+
+    clock[0] += 5.0
+    assert key_agent.key(SALT, hashed_password) is None
+
+    key_agent.unlock(PASSWORD)
+    key_agent.store(SALT, hashed_password, b'key')
+    key_agent.lock()
+    assert not key_agent.unlocked()
+    assert key_agent.key(SALT, hashed_password) is None
+
+
+def test_invalid_requests():
+    key_agent = agent.KeyAgent(10.0)
+
+    assert 'error' in key_agent.handle({'command': 'forget'})
+    assert key_agent.handle({'command': 'status'}) == {'unlocked': False, 'ttl': 10.0}
+
+    with pytest.raises(KeyError):
+        key_agent.handle({'command': 'store', 'salt': SALT.hex()})
+
+
+def test_unlocked_agent(socket_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'USE_KEY_AGENT', True)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'contents')
+
+    assert not agent.unlocked()
+    assert agent.request({'command': 'unlock', 'password': PASSWORD}) == {'unlocked': True}
+    assert agent.unlocked()
+
+    # New passwords are never taken from the agent
+    encrypted = crycript.encrypt(str(path), PasswordKeys(password=PASSWORD)).output_path
+
+    # No password is asked (reading stdin fails under pytest) while the agent is unlocked
+    crycript.decrypt(encrypted, PasswordKeys(confirm_password=False))
+    assert path.read_bytes() == b'contents'
+
+    agent.request({'command': 'lock'})
+    assert not agent.unlocked()
+    assert agent.cached_key(SALT) is None
+
+
+def test_derived_keys_are_shared(socket_path):
+    assert agent.cached_key(SALT, PASSWORD) is None
+
+    PasswordKeys(password=PASSWORD, use_agent=True).key(SALT)
+    assert agent.cached_key(SALT, PASSWORD) == derive_key(PASSWORD, SALT)
+    assert agent.cached_key(SALT, PASSWORD + 'x') is None
+
+
+def test_second_agent_is_refused(socket_path):
+    with pytest.raises(OSError, match='already listening'):
+        agent.serve(socket_path)
+
+    assert agent.request({'command': 'status'}) is not None
+
+
+def test_public_socket_is_ignored(socket_path):
+    chmod(socket_path.rsplit('/', 1)[0], 0o755)
+
+    try:
+        with pytest.raises(PermissionError):
+            agent.check_socket_path(socket_path)
+
+        assert agent.request({'command': 'status'}) is None
+        assert not agent.unlocked()
+    finally:
+        chmod(socket_path.rsplit('/', 1)[0], 0o700)
+
+
+def test_incomplete_key_provider():
+    class SaltlessKeys(KeyProvider):
+        def key(self, salt: bytes = None) -> bytes:
+            return derive_key(PASSWORD, salt)
+
+    with pytest.raises(TypeError):
+        SaltlessKeys()
+
+
+def test_key_provider(tmp_path):
+    class FixedKeys(KeyProvider):
+        def key(self, salt: bytes = None) -> bytes:
+            return derive_key(PASSWORD, salt)
+
+        def new_key(self, token: bool = False) -> tuple:
+            return SALT, self.key(SALT)
+
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'contents')
+    encrypted = crycript.encrypt(str(path), FixedKeys()).output_path
+
+    with crycript.open(encrypted, PasswordKeys(password=PASSWORD)) as reader:
+        assert reader.read() == b'contents'
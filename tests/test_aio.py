@@ -0,0 +1,138 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import aio, constants
+from crycript.utils.ciphers import CIPHERS
+from crycript.utils.compression import CODECS
+from .conftest import CHUNK_SIZE
+
+CONTENTS: bytes = bytes(index % 251 for index in range(4 * CHUNK_SIZE + 1))
+
+
+class _Writer(BytesIO):
+    # StreamWriter stand-in that keeps everything written
+    drains = 0
+
+    async def drain(self):
+        self.drains += 1
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    # StreamReader holding data, then EOF (call it inside a running loop)
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def _encrypt(data: bytes, key: bytes, **options) -> bytes:
+    # Encrypted stream of data
+    async def encrypt() -> bytes:
+        writer = _Writer()
+        result = await aio.encrypt_stream(_reader(data), writer, key, 'data.bin', **options)
+        assert (result.name, result.size) == ('data.bin', len(data))
+        return writer.getvalue()
+
+    return asyncio.run(encrypt())
+
+
+def _decrypt(encrypted: bytes, key: bytes) -> tuple:
+    # (contents, StreamResult, bytes left in the reader) of an encrypted stream
+    async def decrypt() -> tuple:
+        reader, writer = _reader(encrypted), _Writer()
+        result = await aio.decrypt_stream(reader, writer, key)
+        return writer.getvalue(), result, await reader.read()
+
+    return asyncio.run(decrypt())
+
+
+@pytest.mark.parametrize('size', (0, 1, CHUNK_SIZE, CHUNK_SIZE + 1, len(CONTENTS)))
+@pytest.mark.parametrize('codec', ('none', 'gzip', 'xz'))
+@pytest.mark.parametrize('cipher', CIPHERS)
+def test_round_trip(key, cipher, codec, size):
+    encrypted = _encrypt(CONTENTS[:size], key, compression=codec, cipher=cipher)
+    contents, result, rest = _decrypt(encrypted + b'next message', key)
+
+    assert contents == CONTENTS[:size]
+    assert (result.name, result.size) == ('data.bin', size)
+    assert rest == b'next message'
+
+
+@pytest.mark.parametrize('codec', tuple(name for name, codec in CODECS.items() if codec.available))
+def test_saved_stream_decrypts(tmp_path, key, codec):
+    encrypted = tmp_path / f'data{constants.ENCRYPTED_FILE_EXTENSION}'
+    encrypted.write_bytes(_encrypt(CONTENTS, key, compression=codec))
+
+    assert crycript.decrypt(str(encrypted), key).output_path == str(tmp_path / 'data.bin')
+    assert (tmp_path / 'data.bin').read_bytes() == CONTENTS
+
+
+def test_saved_file_streams(tmp_path, key):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+    encrypted = crycript.encrypt(str(path), key).output_path
+
+    with open(encrypted, 'rb') as encrypted_file:
+        contents, result, _ = _decrypt(encrypted_file.read(), key)
+
+    assert contents == CONTENTS
+    assert result.name == 'data.bin'
+
+
+def test_socket(key):
+    async def run() -> bytes:
+        received = asyncio.get_running_loop().create_future()
+
+        async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            output = _Writer()
+            await aio.decrypt_stream(reader, output, key)
+            received.set_result(output.getvalue())
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            await aio.encrypt_stream(_reader(CONTENTS), writer, key, compression='gzip')
+            writer.close()
+            await writer.wait_closed()
+
+            return await asyncio.wait_for(received, 10)
+
+    assert asyncio.run(run()) == CONTENTS
+
+
+@pytest.mark.parametrize('cipher', CIPHERS)
+def test_tampered_frame(key, cipher):
+    encrypted = bytearray(_encrypt(CONTENTS, key, cipher=cipher))
+    encrypted[-2 * CHUNK_SIZE] ^= 1
+
+    with pytest.raises(crycript.TamperedBlock):
+        _decrypt(bytes(encrypted), key)
+
+
+@pytest.mark.parametrize('codec', ('none', 'gzip'))
+def test_truncated_stream(key, codec):
+    encrypted = _encrypt(CONTENTS, key, compression=codec)
+
+    for end in (len(encrypted) - 1, len(encrypted) - 100, 200, 20):
+        with pytest.raises(crycript.CorruptedFile):
+            _decrypt(encrypted[:end], key)
+
+
+def test_invalid_streams(key):
+    with pytest.raises(crycript.VersionMismatch):
+        _decrypt(b'not a crycript stream', key)
+
+    with pytest.raises(crycript.InvalidPassword):
+        _decrypt(_encrypt(CONTENTS, key), Fernet.generate_key())
+
+    with pytest.raises(crycript.UnsupportedCodec):
+        _encrypt(CONTENTS, key, compression='brotli')
+
+    with pytest.raises(crycript.UnsupportedCipher):
+        _encrypt(CONTENTS, key, cipher='rot13')
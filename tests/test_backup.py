@@ -0,0 +1,215 @@
+import socket
+from importlib import import_module
+from os import chmod, listdir, mkfifo, stat, symlink, utime
+from os.path import join as os_join
+from threading import Thread
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import constants
+from crycript.actions.backup import CHUNKS_DIRECTORY, SNAPSHOTS_DIRECTORY, Repository
+
+# crycript.actions.backup is the backup() function once crycript is imported
+backup_module = import_module('crycript.actions.backup')
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(constants, 'BACKUP_CHUNK_SIZE', 1000)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Directory with files, an empty directory and a symbolic link."""
+    root = tmp_path / 'tree'
+    (root / 'nested' / 'empty').mkdir(parents=True)
+    (root / 'empty.bin').write_bytes(b'')
+    (root / 'small.bin').write_bytes(b'small')
+    (root / 'nested' / 'large.bin').write_bytes(bytes(index % 251 for index in range(3500)))
+    (root / 'nested' / 'copy.bin').write_bytes(bytes(index % 251 for index in range(3500)))
+    symlink('nested/large.bin', root / 'link')
+    chmod(root / 'small.bin', 0o640)
+    utime(root / 'small.bin', ns=(1_000_000_000, 1_000_000_000))
+    return root
+
+
+def _files(root) -> dict:
+    # Relative path -> contents (link target for symbolic links, None for directories) of everything inside root
+    return {
+        str(path.relative_to(root)): (
+            str(path.readlink()) if path.is_symlink() else None if path.is_dir() else path.read_bytes()
+        )
+        for path in sorted(root.rglob('*'))
+    }
+
+
+def _in_thread(function, *arguments):
+    # Result of function, failing instead of blocking the tests forever
+    result = []
+    thread = Thread(target=lambda: result.append(function(*arguments)), daemon=True)
+    thread.start()
+    thread.join(30)
+
+    assert result, f'{function.__name__} did not finish'
+    return result[0]
+
+
+def test_round_trip(tmp_path, key, tree):
+    repository = str(tmp_path / 'repository')
+    files = _files(tree)
+
+    result = crycript.backup(str(tree), repository, key)
+    assert crycript.is_repository(repository)
+    assert result.output_path.startswith(os_join(repository, SNAPSHOTS_DIRECTORY))
+    assert result.stats.phases['deduplicated'].chunks == 4
+
+    crycript.restore(repository, str(tmp_path / 'restored'), key=key)
+    restored = tmp_path / 'restored' / 'tree'
+    assert _files(restored) == files
+    assert stat(restored / 'small.bin').st_mode & 0o777 == 0o640
+    assert stat(restored / 'small.bin').st_mtime_ns == 1_000_000_000
+
+    with pytest.raises(crycript.CrycriptError, match='already exists'):
+        crycript.restore(repository, str(tmp_path / 'restored'), key=key)
+
+
+def test_incremental(tmp_path, key, tree):
+    repository = str(tmp_path / 'repository')
+    crycript.backup(str(tree), repository, key)
+    chunks = sum(len(listdir(tmp_path / 'repository' / CHUNKS_DIRECTORY / name))
+                 for name in listdir(tmp_path / 'repository' / CHUNKS_DIRECTORY))
+
+    (tree / 'small.bin').write_bytes(b'changed')
+    (tree / 'new.bin').write_bytes(b'new')
+    stats = crycript.backup(str(tree), repository, key).stats
+
+    # Only the changed and new files are read, the other ones reuse their chunks
+    assert stats.phases['read'].bytes == len(b'changed') + len(b'new')
+    assert stats.phases['unchanged'].bytes == 2 * 3500
+    assert sum(len(listdir(tmp_path / 'repository' / CHUNKS_DIRECTORY / name))
+               for name in listdir(tmp_path / 'repository' / CHUNKS_DIRECTORY)) == chunks + 2
+
+    snapshots = crycript.snapshots(repository, key)
+    assert [info.files for info in snapshots] == [4, 5]
+    assert snapshots[0].size == 5 + 2 * 3500 and snapshots[1].size == 7 + 3 + 2 * 3500
+
+    crycript.restore(repository, str(tmp_path / 'old'), snapshots[0].name, key)
+    assert (tmp_path / 'old' / 'tree' / 'small.bin').read_bytes() == b'small'
+    assert not (tmp_path / 'old' / 'tree' / 'new.bin').exists()
+
+    crycript.restore(repository, str(tmp_path / 'new'), key=key)
+    assert _files(tmp_path / 'new' / 'tree') == _files(tree)
+
+
+def test_special_files_are_skipped(tmp_path, key, tree):
+    repository = str(tmp_path / 'repository')
+    mkfifo(tree / 'pipe')
+
+    with socket.socket(socket.AF_UNIX) as listener:
+        listener.bind(str(tree / 'sock'))
+        result = _in_thread(crycript.backup, str(tree), repository, key)
+
+    assert result.stats.phases['skipped'].chunks == 2
+
+    crycript.restore(repository, str(tmp_path / 'restored'), key=key)
+    assert not {'pipe', 'sock'} & set(listdir(tmp_path / 'restored' / 'tree'))
+
+
+def test_tampered_repository(tmp_path, key, tree):
+    repository = tmp_path / 'repository'
+    crycript.backup(str(tree / 'small.bin'), str(repository), key)
+    chunk_directory, = listdir(repository / CHUNKS_DIRECTORY)
+    chunk, = (repository / CHUNKS_DIRECTORY / chunk_directory).iterdir()
+    token = bytearray(chunk.read_bytes())
+    token[-1] ^= 1
+    chunk.write_bytes(token)
+
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.restore(str(repository), str(tmp_path / 'restored'), key=key)
+
+    chunk.unlink()
+    with pytest.raises(crycript.CorruptedFile, match='missing'):
+        crycript.restore(str(repository), str(tmp_path / 'missing'), key=key)
+
+    snapshot, = (repository / SNAPSHOTS_DIRECTORY).iterdir()
+    snapshot.write_bytes(snapshot.read_bytes()[:-1])
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.snapshots(str(repository), key)
+
+
+def test_invalid_repositories(tmp_path, key, tree):
+    with pytest.raises(crycript.CrycriptError, match='inside'):
+        crycript.backup(str(tree), str(tree / 'repository'), key)
+
+    (tmp_path / 'other').mkdir()
+    (tmp_path / 'other' / 'file').write_bytes(b'')
+    with pytest.raises(crycript.CrycriptError, match='not empty'):
+        crycript.backup(str(tree), str(tmp_path / 'other'), key)
+
+    with pytest.raises(crycript.CrycriptError, match='not a crycript repository'):
+        crycript.restore(str(tree), str(tmp_path), key=key)
+
+    repository = str(tmp_path / 'repository')
+    crycript.backup(str(tree), repository, key)
+
+    with pytest.raises(crycript.InvalidPassword):
+        crycript.snapshots(repository, Fernet.generate_key())
+
+
+def test_concurrent_creation(tmp_path, key):
+    repository = str(tmp_path / 'repository')
+    paths = []
+
+    for index in range(8):
+        (tmp_path / f'file-{index}').write_bytes(bytes((index,)) * 100)
+        paths.append(str(tmp_path / f'file-{index}'))
+
+    results = crycript.run_batch(crycript.backup, paths, repository, key, workers=8)
+
+    assert [result.message for result in results if not result.succeeded] == []
+    assert len(crycript.snapshots(repository, key)) == 8
+    assert sorted(listdir(tmp_path)) == sorted([*(f'file-{index}' for index in range(8)), 'repository'])
+
+
+def test_created_meanwhile(tmp_path, monkeypatch, key):
+    repository = str(tmp_path / 'repository')
+    created = []
+
+    original_rename = backup_module.rename
+
+    def rename(source: str, destination: str):
+        # Another backup creates the repository between the emptiness check and the rename
+        backup_module.rename = original_rename
+        created.append(Repository.create(destination, key))
+        original_rename(source, destination)
+
+    monkeypatch.setattr(backup_module, 'rename', rename)
+    opened = Repository.create(repository, key)
+
+    assert opened.chunk_name(b'x') == created[0].chunk_name(b'x')
+    assert listdir(tmp_path) == ['repository']
+
+    with pytest.raises(crycript.CrycriptError, match='not empty'):
+        Repository.create(repository, key)
+
+
+def test_created_after_check(tmp_path, monkeypatch, key):
+    repository = str(tmp_path / 'repository')
+    Repository.create(repository, key)
+
+    (tmp_path / 'data.bin').write_bytes(b'data')
+    checks = []
+
+    def is_repository(path: str) -> bool:
+        # Another backup creates the repository right after the first check
+        checks.append(path)
+        return len(checks) > 1 and original_is_repository(path)
+
+    original_is_repository = backup_module.is_repository
+    monkeypatch.setattr(backup_module, 'is_repository', is_repository)
+
+    crycript.backup(str(tmp_path / 'data.bin'), repository, key)
+
+    assert len(crycript.snapshots(repository, key)) == 1
@@ -0,0 +1,110 @@
+from os import listdir
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.actions import batch
+from .conftest import CHUNK_SIZE
+
+
+class _RecordedBar:
+    # tqdm stand-in that keeps every update
+    def __init__(self, total: int, **options):
+        self.total = total
+        self.updates = []
+        self.messages = []
+        bars.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def update(self, size: int):
+        self.updates.append(size)
+
+    def write(self, message: str):
+        self.messages.append(message)
+
+    def set_postfix(self, **values):
+        pass
+
+
+bars = []
+
+
+@pytest.fixture
+def paths(tmp_path) -> list:
+    """Two files and a directory, of different sizes."""
+    (tmp_path / 'small.bin').write_bytes(b's')
+    (tmp_path / 'large.bin').write_bytes(b'l' * (5 * CHUNK_SIZE))
+    (tmp_path / 'tree' / 'nested').mkdir(parents=True)
+    (tmp_path / 'tree' / 'nested' / 'data.bin').write_bytes(b'd' * (2 * CHUNK_SIZE + 1))
+    return [str(tmp_path / name) for name in ('small.bin', 'large.bin', 'tree')]
+
+
+@pytest.mark.parametrize('workers', (1, 3))
+def test_round_trip(tmp_path, key, paths, workers):
+    results = crycript.run_batch(crycript.encrypt, paths, key, workers=workers)
+
+    assert [result.path for result in results] == paths
+    assert all(result.succeeded and result.stats is not None for result in results)
+    assert [result.size for result in results] == [1, 5 * CHUNK_SIZE, 2 * CHUNK_SIZE + 1]
+
+    encrypted = [str(tmp_path / name) for name in sorted(listdir(tmp_path))]
+    assert len(encrypted) == 3 and all(path.endswith(constants.ENCRYPTED_FILE_EXTENSION) for path in encrypted)
+
+    results = crycript.run_batch(crycript.decrypt, encrypted, key, workers=workers)
+    assert all(result.succeeded for result in results)
+    assert (tmp_path / 'large.bin').read_bytes() == b'l' * (5 * CHUNK_SIZE)
+    assert (tmp_path / 'tree' / 'nested' / 'data.bin').read_bytes() == b'd' * (2 * CHUNK_SIZE + 1)
+
+
+def test_failures_do_not_stop_the_batch(tmp_path, key, paths):
+    (tmp_path / 'missing.bin').write_bytes(b'm')
+    paths.insert(1, str(tmp_path / 'missing.bin'))
+    (tmp_path / 'missing.bin').unlink()
+
+    def encrypt(path: str, key: bytes, stats: crycript.Stats = None) -> crycript.ActionResult:
+        if path.endswith('large.bin'):
+            raise ValueError('unexpected bug')
+
+        return crycript.encrypt(path, key, stats)
+
+    results = crycript.run_batch(encrypt, paths, key, workers=2)
+
+    assert [result.succeeded for result in results] == [True, False, False, True]
+    assert results[1].message.startswith('Aborted: ')
+    assert results[2].message == 'Aborted: ValueError: unexpected bug'
+    assert results[2].stats is None
+
+    summary = crycript.batch_summary(results, 2.0)
+    assert (summary['paths'], summary['succeeded'], summary['failed']) == (4, 2, 2)
+    assert summary['bytes'] == sum(result.size for result in results)
+    assert summary['results'][0]['stats'] == results[0].stats.as_dict()
+
+
+def test_progress_follows_chunks(monkeypatch, key, paths):
+    monkeypatch.setattr(constants, 'QUIET', False)
+    monkeypatch.setattr(batch, 'tqdm', _RecordedBar)
+    bars.clear()
+
+    crycript.run_batch(crycript.encrypt, paths[1:2], key)
+
+    # One update per chunk read, not one for the whole path
+    assert bars[0].total == 5 * CHUNK_SIZE
+    assert bars[0].updates == [CHUNK_SIZE] * 5
+    assert constants.QUIET is False
+
+
+def test_progress_of_failed_paths(monkeypatch, key, paths):
+    monkeypatch.setattr(constants, 'QUIET', False)
+    monkeypatch.setattr(batch, 'tqdm', _RecordedBar)
+    bars.clear()
+
+    crycript.run_batch(crycript.decrypt, paths, key)
+
+    assert sum(bars[0].updates) == bars[0].total
+    assert len(bars[0].messages) == 3
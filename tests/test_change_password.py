@@ -0,0 +1,121 @@
+from os import listdir, pwrite, stat
+from os.path import exists
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from crycript.utils.ciphers import CIPHERS
+from .conftest import CHUNK_SIZE
+
+CONTENTS: bytes = bytes(range(256)) * (2 * CHUNK_SIZE // 256 + 1)
+
+
+@pytest.fixture(params=tuple(CIPHERS))
+def encrypted(request, tmp_path, monkeypatch, key) -> str:
+    """Path of CONTENTS encrypted with every cipher engine."""
+    monkeypatch.setattr(constants, 'CIPHER', request.param)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+    return crycript.encrypt(str(path), key).output_path
+
+
+def _read(path: str) -> bytes:
+    # Whole contents of a file
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def _header_size(path: str) -> int:
+    # Size of the header of an encrypted file, the frames start after it
+    with open(path, 'rb') as encrypted_file:
+        return container.read_header(encrypted_file, path).size
+
+
+def _assert_decrypts(path: str, key: bytes):
+    # The file opens with key, and only with it
+    with pytest.raises(crycript.InvalidPassword):
+        crycript.verify(path, Fernet.generate_key())
+
+    with crycript.open(path, key) as reader:
+        assert reader.read() == CONTENTS
+
+
+def test_in_place(encrypted, key):
+    new_key = Fernet.generate_key()
+    inode = stat(encrypted).st_ino
+    frames = _read(encrypted)[_header_size(encrypted):]
+
+    assert crycript.change_password(encrypted, key, new_key).output_path == encrypted
+    assert stat(encrypted).st_ino == inode
+    assert _read(encrypted)[_header_size(encrypted):] == frames
+    assert listdir(encrypted.rsplit('/', 1)[0]) == [encrypted.rsplit('/', 1)[1]]
+
+    with pytest.raises(crycript.InvalidPassword):
+        crycript.change_password(encrypted, key, Fernet.generate_key())
+
+    _assert_decrypts(encrypted, new_key)
+
+
+def test_interrupted_rewrite(encrypted, key, monkeypatch):
+    journal_path = encrypted + constants.JOURNAL_FILE_EXTENSION
+    original = _read(encrypted)
+
+    def torn_pwrite(file_descriptor: int, data: bytes, offset: int) -> int:
+        pwrite(file_descriptor, data[:len(data) // 2], offset)
+        raise OSError('power failure')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(container, 'pwrite', torn_pwrite)
+
+        with pytest.raises(OSError):
+            crycript.change_password(encrypted, key, Fernet.generate_key())
+
+    assert _read(encrypted) != original
+    assert _read(journal_path)
+
+    # The next password change restores the old header first
+    new_key = Fernet.generate_key()
+    crycript.change_password(encrypted, key, new_key)
+    assert not exists(journal_path)
+    _assert_decrypts(encrypted, new_key)
+
+
+def test_decrypt_recovers(encrypted, key, monkeypatch):
+    def torn_pwrite(file_descriptor: int, data: bytes, offset: int) -> int:
+        pwrite(file_descriptor, bytes(len(data)), offset)
+        raise OSError('power failure')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(container, 'pwrite', torn_pwrite)
+
+        with pytest.raises(OSError):
+            crycript.change_password(encrypted, key, Fernet.generate_key())
+
+    path = crycript.decrypt(encrypted, key).output_path
+    assert _read(path) == CONTENTS
+    assert listdir(path.rsplit('/', 1)[0]) == [path.rsplit('/', 1)[1]]
+
+
+def test_incomplete_journal(encrypted, key):
+    journal_path = encrypted + constants.JOURNAL_FILE_EXTENSION
+    original = _read(encrypted)
+
+    # Crash while the journal was written: the header was not modified yet
+    with open(journal_path, 'wb') as journal:
+        journal.write(original[:container.JOURNAL_DIGEST_SIZE // 2])
+
+    assert container.recover_header(encrypted) is False
+    assert _read(encrypted) == original
+    assert listdir(encrypted.rsplit('/', 1)[0]) == [encrypted.rsplit('/', 1)[1]]
+
+    # So is a journal whose digest does not match the saved header
+    with open(journal_path, 'wb') as journal:
+        journal.write(bytes(container.JOURNAL_DIGEST_SIZE) + original[:_header_size(encrypted)])
+
+    new_key = Fernet.generate_key()
+    crycript.change_password(encrypted, key, new_key)
+    assert listdir(encrypted.rsplit('/', 1)[0]) == [encrypted.rsplit('/', 1)[1]]
+    _assert_decrypts(encrypted, new_key)
@@ -0,0 +1,45 @@
+from os.path import getsize
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from crycript.utils.ciphers import CIPHERS
+from .conftest import CHUNK_SIZE
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+@pytest.mark.parametrize('cipher', CIPHERS)
+def test_frame_positions(tmp_path, monkeypatch, key, cipher, jobs):
+    monkeypatch.setattr(constants, 'CIPHER', cipher)
+    monkeypatch.setattr(constants, 'PARALLEL_JOBS', jobs)
+    path = tmp_path / 'data.bin'
+    contents = bytes(index % 251 for index in range(5 * CHUNK_SIZE + 1))
+    path.write_bytes(contents)
+    encrypted = crycript.encrypt(str(path), key).output_path
+
+    with open(encrypted, 'rb') as encrypted_file:
+        header = container.read_header(encrypted_file, encrypted)
+        assert header.chunk_size == CHUNK_SIZE
+        assert header.frame_count(getsize(encrypted)) == 6
+
+        for index in range(6):
+            assert encrypted_file.tell() == header.frame_offset(index)
+            _, flags = container.read_frame(encrypted_file, header.maximum_payload)
+            assert flags == (container.FLAG_FINAL if index == 5 else 0)
+
+    crycript.decrypt(encrypted, key)
+    assert path.read_bytes() == contents
+
+
+def test_unknown_chunk_size():
+    header = container.Header(constants.BYTES_VERSION, b'', {}, b'', b'', 200)
+
+    assert header.frame_stride is None
+
+    with pytest.raises(crycript.CorruptedFile):
+        header.frame_offset(1)
+
+    with pytest.raises(crycript.CorruptedFile):
+        header.frame_count(1000)
@@ -0,0 +1,177 @@
+import tarfile
+from io import BytesIO
+from os import listdir, readlink, stat, symlink
+from os.path import getsize
+from random import Random
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from .conftest import CHUNK_SIZE
+
+FILES: dict = {
+    **{f'many/{index:02}.bin': bytes((index,)) * index for index in range(40)},
+    'small.bin': b'small',
+    'nested/large.bin': Random(0).randbytes(3 * CHUNK_SIZE + 1)
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Directory with FILES, an empty directory and a symbolic link to a directory."""
+    directory = tmp_path / 'tree'
+    (directory / 'nested' / 'empty').mkdir(parents=True)
+    (directory / 'many').mkdir()
+
+    for name, contents in FILES.items():
+        (directory / name).write_bytes(contents)
+
+    symlink('nested', str(directory / 'link'))
+    (directory / 'small.bin').chmod(0o600)
+    return directory
+
+
+@pytest.fixture
+def encrypted(tree, monkeypatch, key) -> str:
+    """Path of the tree encrypted as a (random, so uncompressed) tar stream spanning many frames."""
+    monkeypatch.setattr(constants, 'DIRECTORY_COMPRESSION', 'none')
+    return crycript.encrypt(str(tree), key).output_path
+
+
+def _assert_tree(directory, names: tuple = tuple(FILES)):
+    # The given FILES (and nothing else among them) are in directory
+    for name, contents in FILES.items():
+        if name in names:
+            assert (directory / name).read_bytes() == contents
+        else:
+            assert not (directory / name).exists()
+
+
+def _encrypted_tar(tmp_path, key, members: list) -> str:
+    # Encrypts a tar of the given (TarInfo, contents) members as the directory 'tree'
+    archive = BytesIO()
+
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        for member, contents in members:
+            member.size = len(contents or b'')
+            tar.addfile(member, BytesIO(contents) if contents is not None else None)
+
+    path = tmp_path / ('tree' + constants.TAR_GZ_FILE_EXTENSION)
+    path.write_bytes(archive.getvalue())
+    return crycript.encrypt(str(path), key).output_path
+
+
+def _member(name: str, kind: bytes = tarfile.REGTYPE, linkname: str = '') -> tarfile.TarInfo:
+    member = tarfile.TarInfo(name)
+    member.type = kind
+    member.linkname = linkname
+    member.mode = 0o755 if kind == tarfile.DIRTYPE else 0o644
+    return member
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_decrypt(tmp_path, tree, encrypted, monkeypatch, key, jobs):
+    monkeypatch.setattr(constants, 'EXTRACTION_JOBS', jobs)
+
+    assert crycript.decrypt(encrypted, key).output_path == str(tree)
+
+    _assert_tree(tree)
+    assert (tree / 'nested' / 'empty').is_dir()
+    assert readlink(str(tree / 'link')) == 'nested'
+    assert stat(str(tree / 'small.bin')).st_mode & 0o777 == 0o600
+    assert listdir(tmp_path) == ['tree']
+
+
+def test_decrypt_existing(tmp_path, tree, encrypted, key):
+    tree.mkdir()
+
+    with pytest.raises(crycript.CrycriptError, match='already exists'):
+        crycript.decrypt(encrypted, key)
+
+    # Nothing is merged into it, and the encrypted directory is kept
+    assert listdir(tree) == []
+    assert sorted(listdir(tmp_path)) == sorted(['tree', encrypted.rsplit('/', 1)[1]])
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_tampered(tmp_path, encrypted, monkeypatch, key, jobs):
+    monkeypatch.setattr(constants, 'EXTRACTION_JOBS', jobs)
+
+    with open(encrypted, 'rb') as encrypted_file:
+        header = container.read_header(encrypted_file, encrypted)
+
+    # The many/ files come first, they are written before the modified frame is read
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.frame_offset(header.frame_count(getsize(encrypted)) - 2) + 100)
+        byte = encrypted_file.read(1)
+        encrypted_file.seek(-1, 1)
+        encrypted_file.write(bytes((byte[0] ^ 1,)))
+
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.decrypt(encrypted, key)
+
+    assert listdir(tmp_path) == [encrypted.rsplit('/', 1)[1]]
+
+
+def test_truncated(tmp_path, encrypted, key):
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.truncate(encrypted_file.seek(0, 2) - CHUNK_SIZE)
+
+    with pytest.raises(crycript.CorruptedFile):
+        crycript.decrypt(encrypted, key)
+
+    assert listdir(tmp_path) == [encrypted.rsplit('/', 1)[1]]
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_extract_names(tmp_path, encrypted, monkeypatch, key, jobs):
+    monkeypatch.setattr(constants, 'EXTRACTION_JOBS', jobs)
+    destination = tmp_path / 'destination'
+
+    result = crycript.extract(encrypted, ['tree/nested/', 'tree/many/07.bin'], str(destination), key)
+
+    assert result.output_path == str(destination / 'tree' / 'nested')
+    _assert_tree(destination / 'tree', ('nested/large.bin', 'many/07.bin'))
+    assert sorted(listdir(destination / 'tree')) == ['many', 'nested']
+    assert listdir(destination / 'tree' / 'many') == ['07.bin']
+
+
+def test_extract_all(tmp_path, tree, encrypted, key):
+    result = crycript.extract(encrypted, destination=str(tmp_path / 'destination'), key=key)
+
+    assert result.output_path == str(tmp_path / 'destination' / 'tree')
+    _assert_tree(tmp_path / 'destination' / 'tree')
+
+    # The encrypted directory is never deleted
+    assert sorted(listdir(tmp_path)) == sorted(['destination', encrypted.rsplit('/', 1)[1]])
+
+
+def test_extract_missing_name(tmp_path, encrypted, key):
+    with pytest.raises(crycript.CrycriptError, match='not in the encrypted directory'):
+        crycript.extract(encrypted, ['tree/small.bin', 'tree/missing.bin'], str(tmp_path / 'destination'), key)
+
+
+@pytest.mark.parametrize('members', (
+    [(_member('tree', tarfile.DIRTYPE), None), (_member('tree/../../outside.bin'), b'x')],
+    [(_member('tree', tarfile.DIRTYPE), None), (_member('/tmp/outside.bin'), b'x')],
+    [(_member('tree', tarfile.DIRTYPE), None), (_member('tree/link', tarfile.LNKTYPE, '../../outside.bin'), None)],
+    [(_member('tree', tarfile.DIRTYPE), None), (_member('tree/link', tarfile.SYMTYPE, '..'), None),
+     (_member('tree/link/outside.bin'), b'x')],
+    [(_member('tree', tarfile.DIRTYPE), None), (_member('tree/link', tarfile.SYMTYPE, '..'), None),
+     (_member('tree/hard', tarfile.LNKTYPE, 'tree/link/outside.bin'), None)]
+), ids=('parent', 'absolute', 'hard link', 'symbolic link', 'hard link through a symbolic link'))
+def test_outside_extraction_directory(tmp_path, key, members):
+    encrypted = _encrypted_tar(tmp_path, key, members)
+
+    with pytest.raises(crycript.CorruptedFile):
+        crycript.decrypt(encrypted, key)
+
+    assert listdir(tmp_path) == [encrypted.rsplit('/', 1)[1]]
+    assert not (tmp_path.parent / 'outside.bin').exists()
+
+    with pytest.raises(crycript.CorruptedFile):
+        crycript.extract(encrypted, destination=str(tmp_path / 'destination'), key=key)
+
+    assert not (tmp_path / 'destination' / 'outside.bin').exists()
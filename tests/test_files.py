@@ -0,0 +1,78 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from os import listdir
+
+import pytest
+
+import crycript
+from crycript import constants, utils
+from crycript.actions import encryption
+
+
+def test_reserve_filename(tmp_path):
+    (tmp_path / 'taken').write_bytes(b'contents')
+
+    assert utils.reserve_filename(str(tmp_path), ('taken', 'free', 'other')) == 'free'
+    assert (tmp_path / 'free').read_bytes() == b''
+    assert (tmp_path / 'taken').read_bytes() == b'contents'
+
+    with pytest.raises(FileExistsError):
+        utils.reserve_filename(str(tmp_path), ('taken', 'free'))
+
+
+def test_concurrent_reservations(tmp_path):
+    def reserve(_) -> str:
+        return utils.reserve_filename(str(tmp_path), (f'file-{index}' for index in count()))
+
+    with ThreadPoolExecutor(8) as executor:
+        filenames = list(executor.map(reserve, range(200)))
+
+    assert sorted(filenames) == sorted(set(filenames)) == sorted(listdir(tmp_path))
+
+
+def test_commit_file(tmp_path):
+    utils.write_atomically(str(tmp_path / 'file'), b'old')
+    utils.write_atomically(str(tmp_path / 'file'), b'new')
+
+    assert (tmp_path / 'file').read_bytes() == b'new'
+    assert listdir(tmp_path) == ['file']
+
+
+def test_encrypted_filename(tmp_path, key):
+    path = tmp_path / 'document.txt'
+    path.write_bytes(b'contents')
+
+    encrypted = crycript.encrypt(str(path), key).output_path
+    assert re.fullmatch(r'do-[a-z]{6}\.cry', encrypted.rsplit('/', 1)[1])
+
+
+def test_encrypted_filename_collision(tmp_path, monkeypatch, key):
+    # The first random names are taken, the encryption must not touch them
+    names = iter('aaaaaa' 'aaaaaa' 'bbbbbb')
+    monkeypatch.setattr(encryption, 'choice', lambda charset: next(names))
+    (tmp_path / f'do-aaaaaa{constants.ENCRYPTED_FILE_EXTENSION}').write_bytes(b'other')
+    path = tmp_path / 'document.txt'
+    path.write_bytes(b'contents')
+
+    encrypted = crycript.encrypt(str(path), key).output_path
+
+    assert encrypted == str(tmp_path / f'do-bbbbbb{constants.ENCRYPTED_FILE_EXTENSION}')
+    assert (tmp_path / f'do-aaaaaa{constants.ENCRYPTED_FILE_EXTENSION}').read_bytes() == b'other'
+
+
+def test_decrypted_filename_collision(tmp_path, key):
+    path = tmp_path / 'document.txt'
+    path.write_bytes(b'contents')
+    first = crycript.encrypt(str(path), key).output_path
+    path.write_bytes(b'second')
+    second = crycript.encrypt(str(path), key).output_path
+    path.write_bytes(b'existing')
+
+    decrypted = {crycript.decrypt(encrypted, key).output_path for encrypted in (first, second)}
+
+    assert path.read_bytes() == b'existing'
+    assert len(decrypted) == 2 and str(path) not in decrypted
+    assert all(re.fullmatch(r'[a-z]+document\.txt', name.rsplit('/', 1)[1]) for name in decrypted)
+    assert sorted(open(name, 'rb').read() for name in decrypted) == [b'contents', b'second']
+    assert sorted(listdir(tmp_path)) == sorted(['document.txt', *(name.rsplit('/', 1)[1] for name in decrypted)])
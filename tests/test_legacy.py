@@ -0,0 +1,92 @@
+import tarfile
+from math import ceil
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import constants
+from .conftest import CHUNK_SIZE
+
+
+def _legacy_encrypt(path, key: bytes, filename: str) -> str:
+    # Writes path as a 2021.05.06 file (one Fernet key per line), the way crycript encrypted files back then
+    contents = path.read_bytes()
+    rounds = ceil(len(contents) / CHUNK_SIZE)
+    file_keys = tuple(Fernet.generate_key() for _ in range(rounds + 1))
+    lines = [
+        constants.LEGACY_BYTES_VERSION,
+        Fernet(key).encrypt(b' '.join(file_keys)),
+        Fernet(file_keys[0]).encrypt(filename.encode())
+    ]
+
+    for index, file_key in enumerate(file_keys[1:]):
+        lines.append(Fernet(file_key).encrypt(contents[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]))
+
+    encrypted = path.parent / f'legacy{constants.ENCRYPTED_FILE_EXTENSION}'
+    encrypted.write_bytes(b'\n'.join(lines) + b'\n')
+    path.unlink()
+    return str(encrypted)
+
+
+@pytest.mark.parametrize('size', (0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 3 * CHUNK_SIZE))
+def test_decrypt_file(tmp_path, key, size):
+    path = tmp_path / 'data.bin'
+    contents = bytes(index % 251 for index in range(size))
+    path.write_bytes(contents)
+    encrypted = _legacy_encrypt(path, key, path.name)
+
+    assert not crycript.verify(encrypted, key).corrupted_frames
+    assert crycript.decrypt(encrypted, key).output_path == str(path)
+    assert path.read_bytes() == contents
+
+
+def test_decrypt_directory(tmp_path, key):
+    directory = tmp_path / 'tree'
+    (directory / 'nested').mkdir(parents=True)
+    (directory / 'nested' / 'data.bin').write_bytes(b'x' * (2 * CHUNK_SIZE + 1))
+    archive = tmp_path / f'tree{constants.TAR_GZ_FILE_EXTENSION}'
+
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(directory, arcname=directory.name)
+
+    (directory / 'nested' / 'data.bin').unlink()
+    (directory / 'nested').rmdir()
+    directory.rmdir()
+    encrypted = _legacy_encrypt(archive, key, archive.name)
+
+    crycript.decrypt(encrypted, key)
+    assert (directory / 'nested' / 'data.bin').read_bytes() == b'x' * (2 * CHUNK_SIZE + 1)
+    assert not archive.exists()
+
+
+def test_tampered_line(tmp_path, key):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'x' * (3 * CHUNK_SIZE))
+    encrypted = _legacy_encrypt(path, key, path.name)
+    lines = open(encrypted, 'rb').read().split(b'\n')
+    middle = len(lines[4]) // 2
+    lines[4] = lines[4][:middle] + (b'B' if lines[4][middle:middle + 1] == b'A' else b'A') + lines[4][middle + 1:]
+    open(encrypted, 'wb').write(b'\n'.join(lines))
+
+    assert crycript.verify(encrypted, key).corrupted_frames == (1,)
+
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.decrypt(encrypted, key)
+
+    assert not path.exists()
+
+
+def test_change_password(tmp_path, key):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'x' * (CHUNK_SIZE + 1))
+    encrypted = _legacy_encrypt(path, key, path.name)
+    new_key = Fernet.generate_key()
+
+    crycript.change_password(encrypted, key, new_key)
+
+    with pytest.raises(crycript.InvalidPassword):
+        crycript.decrypt(encrypted, key)
+
+    crycript.decrypt(encrypted, new_key)
+    assert path.read_bytes() == b'x' * (CHUNK_SIZE + 1)
@@ -0,0 +1,156 @@
+from os import listdir, readlink, stat, symlink
+from random import Random
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from .conftest import CHUNK_SIZE
+
+FILES: dict = {
+    'empty.bin': b'',
+    'small.bin': b'small',
+    'nested/chunk.bin': bytes(range(256)) * (CHUNK_SIZE // 256),
+    'nested/large.bin': Random(0).randbytes(3 * CHUNK_SIZE + 1)
+}
+
+
+@pytest.fixture
+def pack(tmp_path, monkeypatch, key) -> str:
+    """Path of a directory encrypted as a pack, large.bin (random, so it is not compressed) spans several frames."""
+    monkeypatch.setattr(constants, 'PACK_DIRECTORIES', True)
+    monkeypatch.setattr(constants, 'PACK_CHUNK_SIZE', CHUNK_SIZE)
+
+    directory = tmp_path / 'tree'
+    (directory / 'nested' / 'empty').mkdir(parents=True)
+    for name, contents in FILES.items():
+        (directory / name).write_bytes(contents)
+    symlink('nested', str(directory / 'link'))
+
+    (directory / 'small.bin').chmod(0o600)
+
+    return crycript.encrypt(str(directory), key).output_path
+
+
+def _assert_tree(directory, names: tuple = tuple(FILES)):
+    # The given FILES (and nothing else among them) are in directory
+    for name, contents in FILES.items():
+        if name in names:
+            assert (directory / name).read_bytes() == contents
+        else:
+            assert not (directory / name).exists()
+
+
+def test_list_pack(pack, key):
+    entries = crycript.list_pack(pack, key)
+
+    assert [entry.name for entry in entries] == sorted(
+        ['tree', 'tree/link', 'tree/nested', 'tree/nested/empty', *(f'tree/{name}' for name in FILES)]
+    )
+
+    kinds = {entry.name: entry.kind for entry in entries}
+    assert kinds['tree/nested/empty'] == 'directory'
+    assert kinds['tree/link'] == 'symlink'
+    assert {entry.name: entry.size for entry in entries}['tree/nested/large.bin'] == len(FILES['nested/large.bin'])
+
+
+def test_not_a_pack(tmp_path, key):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'data')
+    encrypted = crycript.encrypt(str(path), key).output_path
+
+    with pytest.raises(crycript.CrycriptError, match='not a pack'):
+        crycript.list_pack(encrypted, key)
+
+    with pytest.raises(crycript.CrycriptError, match='not a pack'):
+        crycript.extract(encrypted, ['data.bin'], key=key)
+
+
+def test_decrypt(tmp_path, pack, key):
+    assert crycript.decrypt(pack, key).output_path == str(tmp_path / 'tree')
+
+    _assert_tree(tmp_path / 'tree')
+    assert (tmp_path / 'tree' / 'nested' / 'empty').is_dir()
+    assert readlink(str(tmp_path / 'tree' / 'link')) == 'nested'
+    assert stat(str(tmp_path / 'tree' / 'small.bin')).st_mode & 0o777 == 0o600
+    assert listdir(tmp_path) == ['tree']
+
+
+def test_decrypt_existing(tmp_path, pack, key):
+    (tmp_path / 'tree').mkdir()
+
+    with pytest.raises(crycript.CrycriptError, match='already exists'):
+        crycript.decrypt(pack, key)
+
+    # Nothing is merged into it, and the pack is kept
+    assert listdir(tmp_path / 'tree') == []
+    assert sorted(listdir(tmp_path)) == sorted(['tree', pack.rsplit('/', 1)[1]])
+
+
+def test_extract_all(tmp_path, pack, key):
+    result = crycript.extract(pack, key=key)
+
+    assert result.output_path == str(tmp_path / 'tree')
+    _assert_tree(tmp_path / 'tree')
+    assert (tmp_path / 'tree' / 'nested' / 'empty').is_dir()
+
+    # The pack is never deleted
+    assert sorted(listdir(tmp_path)) == sorted(['tree', pack.rsplit('/', 1)[1]])
+
+
+def test_extract_names(tmp_path, pack, key):
+    destination = tmp_path / 'destination'
+    result = crycript.extract(pack, ['tree/nested/', 'tree/small.bin'], str(destination), key)
+
+    assert result.output_path == str(destination / 'tree' / 'nested')
+    _assert_tree(destination / 'tree', ('nested/chunk.bin', 'nested/large.bin', 'small.bin'))
+    assert sorted(listdir(destination / 'tree')) == ['nested', 'small.bin']
+
+    # Only the frames holding them are read
+    assert result.stats.phases['extract'].bytes == sum(
+        len(FILES[name]) for name in ('nested/chunk.bin', 'nested/large.bin', 'small.bin')
+    )
+
+
+def test_extract_missing_name(tmp_path, pack, key):
+    with pytest.raises(crycript.CrycriptError, match='not in the pack'):
+        crycript.extract(pack, ['tree/small.bin', 'tree/missing.bin'], str(tmp_path / 'destination'), key)
+
+    assert not (tmp_path / 'destination').exists()
+
+
+def test_extract_existing(tmp_path, pack, key):
+    destination = tmp_path / 'destination'
+    crycript.extract(pack, ['tree/nested'], str(destination), key)
+    (destination / 'tree' / 'nested' / 'chunk.bin').unlink()
+
+    # A repeated extraction fails before writing anything
+    with pytest.raises(crycript.CrycriptError, match='already exists'):
+        crycript.extract(pack, ['tree/nested'], str(destination), key)
+
+    assert not (destination / 'tree' / 'nested' / 'chunk.bin').exists()
+
+    # Existing directories are extracted into
+    crycript.extract(pack, ['tree/small.bin'], str(destination), key)
+    assert (destination / 'tree' / 'small.bin').read_bytes() == FILES['small.bin']
+
+
+def test_tampered(tmp_path, pack, key):
+    with open(pack, 'rb') as encrypted_file:
+        header = container.read_header(encrypted_file, pack)
+
+    with open(pack, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.frame_offset(2) + header.frame_stride // 2)
+        byte = encrypted_file.read(1)
+        encrypted_file.seek(-1, 1)
+        encrypted_file.write(bytes((byte[0] ^ 1,)))
+
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.decrypt(pack, key)
+
+    # Members extracted before the modified frame are removed too
+    assert listdir(tmp_path) == [pack.rsplit('/', 1)[1]]
+
+    with pytest.raises(crycript.TamperedBlock):
+        crycript.extract(pack, ['tree/nested/large.bin'], str(tmp_path / 'destination'), key)
@@ -0,0 +1,140 @@
+from os import chdir, getcwd, listdir, symlink
+
+import pytest
+
+import crycript
+from crycript import constants, utils
+from crycript.utils import compression, packs, path_validation
+from crycript.utils.errors import Aborted
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Directory with nested files, an empty directory and a symbolic link to a directory (and a file next to it)."""
+    (tmp_path / 'c').write_bytes(b'c' * 30)
+    root = tmp_path / 'tree'
+    (root / 'b' / 'empty').mkdir(parents=True)
+    (root / 'a').mkdir()
+    (root / 'a' / 'file').write_bytes(b'a' * 10)
+    (root / 'b' / 'file').write_bytes(b'b' * 20)
+    (root / 'c').write_bytes(b'c' * 30)
+    symlink('a', root / 'link')
+    return root
+
+
+@pytest.fixture
+def scans(monkeypatch) -> list:
+    """Path of every scan_tree() call."""
+    scanned = []
+    original_scan_tree = path_validation.scan_tree
+
+    def scan_tree(path: str, jobs: int = None) -> list:
+        scanned.append(path)
+        return original_scan_tree(path, jobs)
+
+    for module in (utils, path_validation, compression, packs):
+        monkeypatch.setattr(module, 'scan_tree', scan_tree)
+
+    return scanned
+
+
+def _aborted(paths: list, **options) -> str:
+    # Message of the Aborted raised by path_validator()
+    with pytest.raises(Aborted) as raised:
+        crycript.path_validator(paths, **options)
+
+    return raised.value.message
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_scan_tree(tree, jobs):
+    entries = utils.scan_tree(str(tree), jobs)
+
+    assert [entry.relative_path for entry in entries] == [
+        '', 'a', 'a/file', 'b', 'b/empty', 'b/file', 'c', 'link'
+    ]
+    assert all(entry.path == str(tree / entry.relative_path) or entry.path == str(tree) for entry in entries)
+    assert utils.tree_size(str(tree)) == utils.tree_size(str(tree), entries) == 60
+    assert utils.tree_size(str(tree / 'c')) == 30
+
+
+def test_valid_paths(tmp_path, tree):
+    encrypted = tmp_path / f'data{constants.ENCRYPTED_FILE_EXTENSION}'
+    encrypted.write_bytes(constants.BYTES_VERSION + b'\n')
+    trees = {}
+    cwd = getcwd()
+    chdir(tmp_path)
+
+    try:
+        paths, filenames = crycript.path_validator(['tree', str(tree / 'c')], action=(True, False, False), trees=trees)
+    finally:
+        chdir(cwd)
+
+    assert paths == [str(tree), str(tree / 'c')] and filenames == ['tree', 'c']
+    assert list(trees) == [str(tree)]
+    assert [entry.relative_path for entry in trees[str(tree)]][-1] == 'link'
+
+    assert crycript.path_validator([str(encrypted)], action=(False, True, False))[0] == [str(encrypted)]
+
+
+def test_problems_are_reported_together(tmp_path, tree):
+    encrypted = tmp_path / f'data{constants.ENCRYPTED_FILE_EXTENSION}'
+    encrypted.write_bytes(b'1999.01.01\n')
+    paths = [str(tmp_path / 'missing'), str(encrypted), str(tree)]
+
+    message = _aborted(paths, action=(True, False, False))
+    assert message.splitlines() == [
+        'Aborted: 2 problems found', 'missing: path does not exist', f'{encrypted.name}: file already encrypted'
+    ]
+
+    message = _aborted(paths, action=(False, True, False))
+    assert 'Aborted: 3 problems found' in message
+    assert 'file version: 1999.01.01' in message and 'tree: file not encrypted' in message
+
+    assert _aborted([str(tree / 'link' / 'missing')]) == 'Aborted: missing: path does not exist'
+
+
+def test_many_problems_are_counted(tmp_path):
+    message = _aborted([str(tmp_path / f'missing-{index}') for index in range(25)])
+
+    assert message.splitlines()[0] == 'Aborted: 25 problems found'
+    assert message.splitlines()[-1] == f'... and {25 - path_validation.MAXIMUM_REPORTED_PROBLEMS} more'
+
+
+@pytest.mark.parametrize('pack', (False, True))
+def test_encrypt_reuses_the_scan(tree, monkeypatch, key, scans, pack):
+    monkeypatch.setattr(constants, 'PACK_DIRECTORIES', pack)
+    trees = {}
+    crycript.path_validator([str(tree)], action=(True, False, False), trees=trees)
+
+    # Changed after validation: appended contents are archived, new entries are neither archived nor deleted
+    (tree / 'c').write_bytes(b'c' * 40)
+    (tree / 'b' / 'file').unlink()
+    (tree / 'a' / 'new').write_bytes(b'new')
+
+    encrypted = crycript.encrypt(str(tree), key, entries=trees[str(tree)]).output_path
+    assert scans == [str(tree)]
+    assert sorted(listdir(tree)) == ['a']
+    assert listdir(tree / 'a') == ['new']
+
+    (tree / 'a' / 'new').unlink()
+    (tree / 'a').rmdir()
+    tree.rmdir()
+    crycript.decrypt(encrypted, key)
+
+    assert (tree / 'c').read_bytes() == b'c' * 40
+    assert (tree / 'a' / 'file').read_bytes() == b'a' * 10
+    assert sorted(listdir(tree / 'b')) == ['empty']
+    assert not (tree / 'a' / 'new').exists()
+
+
+def test_batch_reuses_the_scan(tree, key, scans):
+    trees = {}
+    paths, _ = crycript.path_validator([str(tree), str(tree.parent / 'c')], action=(True, False, False), trees=trees)
+
+    results = crycript.run_batch(crycript.encrypt, paths, key, trees=trees)
+
+    # Only the directory is walked, and only once (files are sized with one lstat())
+    assert scans.count(str(tree)) == 1
+    assert [result.size for result in results if result.succeeded] == [60, 30]
+    assert not tree.exists()
@@ -0,0 +1,200 @@
+import json
+from os import listdir, utime
+from random import Random
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from crycript.utils.errors import CorruptedFile
+from .conftest import CHUNK_SIZE
+
+# Random, so compressed frames are as many as plain ones
+CONTENTS: bytes = Random(0).randbytes(10 * CHUNK_SIZE + 100)
+
+# Leftovers of an encryption that never finished
+LEFTOVERS: tuple = (
+    constants.ENCRYPTED_FILE_EXTENSION, constants.TEMPORAL_FILE_EXTENSION, constants.PROGRESS_FILE_EXTENSION
+)
+
+
+class Crash(BaseException):
+    """Stops an encryption like a killed process would: nothing is cleaned up on the way out."""
+
+
+@pytest.fixture
+def crash(monkeypatch):
+    """Makes the nth frame write crash the encryption, call it with n."""
+    write_frame = container.write_frame
+
+    def arm(n: int):
+        writes = [0]
+
+        def crashing_write(*args, **kwargs):
+            writes[0] += 1
+            if writes[0] == n:
+                monkeypatch.setattr(container, 'write_frame', write_frame)
+                raise Crash()
+            return write_frame(*args, **kwargs)
+
+        monkeypatch.setattr(container, 'write_frame', crashing_write)
+
+    monkeypatch.setattr(constants, 'PROGRESS_JOURNAL_INTERVAL', 2 * CHUNK_SIZE)
+    return arm
+
+
+def _crashed_encryption(path, key, crash, n: int = 7) -> dict:
+    # Encrypts path until the nth frame is written, returns the progress journal left behind
+    crash(n)
+    with pytest.raises(Crash):
+        crycript.encrypt(str(path), key)
+
+    leftovers = listdir(path.parent)
+    assert all(any(name.endswith(extension) for name in leftovers) for extension in LEFTOVERS), leftovers
+
+    with open(str(path) + constants.PROGRESS_FILE_EXTENSION, 'rb') as progress_file:
+        return json.load(progress_file)
+
+
+def _assert_encrypted(path, key, contents: bytes):
+    # Only the encrypted file is left and it decrypts to contents
+    encrypted = listdir(path.parent)
+    assert len(encrypted) == 1 and encrypted[0].endswith(constants.ENCRYPTED_FILE_EXTENSION), encrypted
+
+    crycript.decrypt(str(path.parent / encrypted[0]), key)
+    assert path.read_bytes() == contents
+
+
+def test_resume(tmp_path, monkeypatch, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    progress = _crashed_encryption(path, key, crash)
+    assert 0 < progress['frames'] < 7
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    result = crycript.encrypt(str(path), key)
+
+    # Only the chunks after the last checkpoint are read again
+    assert result.stats.phases['read'].bytes == len(CONTENTS) - progress['frames'] * CHUNK_SIZE
+    assert result.output_path.endswith(progress['output'])
+    _assert_encrypted(path, key, CONTENTS)
+
+
+def test_resume_twice(tmp_path, monkeypatch, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    first = _crashed_encryption(path, key, crash, 5)
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    second = _crashed_encryption(path, key, crash, 4)
+    assert second['output'] == first['output'] and second['frames'] > first['frames']
+
+    crycript.encrypt(str(path), key)
+    _assert_encrypted(path, key, CONTENTS)
+
+
+def test_leftovers_removed_without_resume(tmp_path, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    _crashed_encryption(path, key, crash)
+    result = crycript.encrypt(str(path), key)
+
+    assert result.stats.phases['read'].bytes == len(CONTENTS)
+    _assert_encrypted(path, key, CONTENTS)
+
+
+def test_changed_file_not_resumed(tmp_path, monkeypatch, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    _crashed_encryption(path, key, crash)
+
+    changed = CONTENTS[::-1]
+    path.write_bytes(changed)
+    utime(str(path), ns=(0, 0))
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    result = crycript.encrypt(str(path), key)
+
+    assert result.stats.phases['read'].bytes == len(changed)
+    _assert_encrypted(path, key, changed)
+
+
+def test_other_key_not_resumed(tmp_path, monkeypatch, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    _crashed_encryption(path, key, crash)
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    with pytest.raises(crycript.InvalidPassword):
+        crycript.encrypt(str(path), Fernet.generate_key())
+
+    assert path.read_bytes() == CONTENTS
+
+
+def test_tampered_partial_output(tmp_path, monkeypatch, key, crash):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+
+    progress = _crashed_encryption(path, key, crash)
+    temporal_path = tmp_path / (progress['output'] + constants.TEMPORAL_FILE_EXTENSION)
+
+    with open(str(temporal_path), 'r+b') as temporal_file:
+        temporal_file.seek(progress['offset'] - 10)
+        byte = temporal_file.read(1)
+        temporal_file.seek(-1, 1)
+        temporal_file.write(bytes((byte[0] ^ 1,)))
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    with pytest.raises(CorruptedFile):
+        crycript.encrypt(str(path), key)
+
+    # Nothing is resumed on top of it, or deleted, until resuming is turned off
+    assert path.read_bytes() == CONTENTS
+    assert temporal_path.exists()
+
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', False)
+    crycript.encrypt(str(path), key)
+    _assert_encrypted(path, key, CONTENTS)
+
+
+@pytest.mark.parametrize('kind', ('gzip', 'aead', 'directory', 'pack'))
+def test_not_resumable(tmp_path, monkeypatch, key, crash, kind):
+    if kind == 'gzip':
+        monkeypatch.setattr(constants, 'FILE_COMPRESSION', 'gzip:1')
+    elif kind == 'aead':
+        monkeypatch.setattr(constants, 'CIPHER', 'aes-256-gcm')
+    elif kind == 'pack':
+        monkeypatch.setattr(constants, 'PACK_DIRECTORIES', True)
+        monkeypatch.setattr(constants, 'PACK_CHUNK_SIZE', CHUNK_SIZE)
+
+    if kind in ('directory', 'pack'):
+        path = tmp_path / 'tree'
+        path.mkdir()
+        for index in range(10):
+            (path / f'{index}.bin').write_bytes(CONTENTS)
+    else:
+        path = tmp_path / 'data.bin'
+        path.write_bytes(CONTENTS)
+
+    progress = _crashed_encryption(path, key, crash, 3)
+    assert progress['resumable'] is False and progress['frames'] == 0
+
+    # Starts over with resuming on, removing the leftovers of the crash
+    monkeypatch.setattr(constants, 'RESUME_ENCRYPTION', True)
+    result = crycript.encrypt(str(path), key)
+
+    assert listdir(str(tmp_path)) == [result.output_path.rsplit('/', 1)[1]]
+
+    crycript.decrypt(result.output_path, key)
+    if kind in ('directory', 'pack'):
+        assert sorted(listdir(str(path))) == [f'{index}.bin' for index in range(10)]
+        assert all((path / f'{index}.bin').read_bytes() == CONTENTS for index in range(10))
+    else:
+        assert path.read_bytes() == CONTENTS
@@ -0,0 +1,77 @@
+from os import listdir
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils.ciphers import CIPHERS
+from crycript.utils.compression import CODECS
+from .conftest import CHUNK_SIZE
+
+SIZES = (0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 3 * CHUNK_SIZE - 1, 3 * CHUNK_SIZE, 3 * CHUNK_SIZE + 1)
+
+
+def _codec(name: str) -> str:
+    # Skip the codecs whose package is not installed
+    if not CODECS[name].available:
+        pytest.skip(f'{CODECS[name].module} is not installed')
+
+    return name
+
+
+def _contents(size: int) -> bytes:
+    # Compressible but not constant, so every codec has something to do
+    return bytes(index * 7 % 251 for index in range(size))
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('cipher', CIPHERS)
+def test_file_round_trip(tmp_path, monkeypatch, key, cipher, codec, size):
+    monkeypatch.setattr(constants, 'CIPHER', cipher)
+    monkeypatch.setattr(constants, 'FILE_COMPRESSION', _codec(codec))
+    path = tmp_path / 'data.bin'
+    path.write_bytes(_contents(size))
+
+    encrypted = crycript.encrypt(str(path), key).output_path
+    assert listdir(tmp_path) == [encrypted.rsplit('/', 1)[1]]
+    assert not crycript.verify(encrypted, key).corrupted_frames
+
+    with crycript.open(encrypted, key) as reader:
+        assert reader.read() == _contents(size)
+
+    # A range across the last chunk boundary
+    offset = max(size - CHUNK_SIZE - 1, 0)
+    expected = _contents(size)[offset:offset + CHUNK_SIZE + 2]
+    assert crycript.read_range(encrypted, offset, CHUNK_SIZE + 2, key) == expected
+
+    assert crycript.decrypt(encrypted, key).output_path == str(path)
+    assert path.read_bytes() == _contents(size)
+    assert listdir(tmp_path) == ['data.bin']
+
+
+@pytest.mark.parametrize('pack', (False, True))
+@pytest.mark.parametrize('cipher', CIPHERS)
+def test_directory_round_trip(tmp_path, monkeypatch, key, cipher, pack):
+    monkeypatch.setattr(constants, 'CIPHER', cipher)
+    monkeypatch.setattr(constants, 'PACK_DIRECTORIES', pack)
+    directory = tmp_path / 'tree'
+    (directory / 'nested' / 'empty').mkdir(parents=True)
+    files = {
+        'empty.bin': b'',
+        'small.bin': _contents(1),
+        'nested/chunk.bin': _contents(CHUNK_SIZE),
+        'nested/large.bin': _contents(3 * CHUNK_SIZE + 1)
+    }
+
+    for name, contents in files.items():
+        (directory / name).write_bytes(contents)
+
+    encrypted = crycript.encrypt(str(directory), key).output_path
+    assert not directory.exists()
+
+    crycript.decrypt(encrypted, key)
+    assert (directory / 'nested' / 'empty').is_dir()
+
+    for name, contents in files.items():
+        assert (directory / name).read_bytes() == contents
@@ -0,0 +1,116 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+
+import crycript
+from crycript import constants
+from crycript.utils import profiling
+from crycript.utils.stats import Phase
+from .conftest import CHUNK_SIZE
+
+
+def test_nested_phases():
+    stats = crycript.Stats()
+
+    with stats.measure('outer', 10):
+        sleep(0.02)
+        with stats.measure('inner', 5, 2):
+            sleep(0.05)
+
+    assert stats.phases['inner'].bytes == 5 and stats.phases['inner'].chunks == 2
+    assert stats.phases['inner'].seconds >= 0.05
+    assert 0.02 <= stats.phases['outer'].seconds < stats.phases['inner'].seconds
+    assert list(stats.as_dict()) == ['inner', 'outer']
+
+
+def test_iterate_and_merge():
+    stats = crycript.Stats()
+    chunks = list(stats.iterate('read', iter((b'ab', b'cde', b''))))
+
+    assert chunks == [b'ab', b'cde', b'']
+    assert stats.phases['read'][1:] == (5, 3)
+
+    total = crycript.Stats()
+    total.merge(stats)
+    total.merge(stats)
+    assert total.phases['read'][1:] == (10, 6)
+    assert 'read: ' in str(total) and '0.0 MB in 6 chunks' in str(total)
+
+
+def test_phase_errors_are_measured():
+    stats = crycript.Stats()
+
+    with pytest.raises(ValueError):
+        with stats.measure('failing'):
+            raise ValueError
+
+    assert stats.phases['failing'].chunks == 1
+
+
+def test_threads():
+    stats = crycript.Stats()
+
+    def measure(_):
+        with stats.measure('work', 1):
+            with stats.measure('nested', 2):
+                pass
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(measure, range(1000)))
+
+    assert stats.phases['work'][1:] == (1000, 1000)
+    assert stats.phases['nested'][1:] == (2000, 1000)
+
+
+def test_record_callback():
+    recorded = []
+
+    class Recorded(crycript.Stats):
+        def record(self, phase: str, seconds: float, size: int = 0, chunks: int = 0) -> None:
+            super().record(phase, seconds, size, chunks)
+            recorded.append((phase, size))
+
+    stats = Recorded()
+    stats.record('custom', 1.0, 3, 1)
+
+    assert recorded == [('custom', 3)]
+    assert stats.phases['custom'] == Phase(1.0, 3, 1)
+
+
+@pytest.mark.parametrize('jobs', (1, 3))
+def test_action_phases(tmp_path, monkeypatch, key, jobs):
+    monkeypatch.setattr(constants, 'PARALLEL_JOBS', jobs)
+    monkeypatch.setattr(constants, 'FILE_COMPRESSION', 'gzip')
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'x' * (3 * CHUNK_SIZE))
+
+    encrypted = crycript.encrypt(str(path), key)
+    phases = encrypted.stats.as_dict()
+    assert {'key', 'read', 'compress', 'encrypt', 'write', 'commit', 'delete'} <= set(phases)
+    assert phases['read']['bytes'] == 3 * CHUNK_SIZE
+
+    verified = crycript.verify(encrypted.output_path, key).stats.as_dict()
+    assert {'header', 'key', 'read', 'authenticate'} <= set(verified)
+
+    stats = crycript.Stats()
+    assert crycript.decrypt(encrypted.output_path, key, stats).stats is stats
+    assert {'header', 'key', 'read', 'decrypt', 'decompress', 'write', 'commit'} <= set(stats.phases)
+    assert stats.phases['write'].bytes == 3 * CHUNK_SIZE
+
+
+def test_profiling(tmp_path):
+    profile_path = tmp_path / 'profile'
+
+    with profiling(str(profile_path), trace_memory=True) as report:
+        data = [bytes(1000) for _ in range(100)]
+
+    assert data and report['peak_traced_bytes'] >= 100_000
+    assert report['largest_live_allocations'][0]['bytes'] > 0
+    assert pstats.Stats(str(profile_path)).total_calls > 0
+
+    with profiling() as report:
+        pass
+
+    assert report == {}
@@ -0,0 +1,109 @@
+from os import listdir
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crycript
+from crycript import constants
+from crycript.utils import container
+from crycript.utils.ciphers import CIPHERS
+from .conftest import CHUNK_SIZE
+
+CONTENTS: bytes = bytes(range(256)) * (3 * CHUNK_SIZE // 256 + 1)
+
+
+@pytest.fixture(params=tuple(CIPHERS))
+def encrypted(request, tmp_path, monkeypatch, key) -> str:
+    """Path of CONTENTS encrypted with every cipher engine, in 4 frames (the last one holds a partial chunk)."""
+    monkeypatch.setattr(constants, 'CIPHER', request.param)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(CONTENTS)
+    return crycript.encrypt(str(path), key).output_path
+
+
+def _header(path: str) -> container.Header:
+    # Header of an encrypted file, frame positions are computed from it
+    with open(path, 'rb') as encrypted_file:
+        return container.read_header(encrypted_file, path)
+
+
+def _assert_rejected(path: str, key: bytes, error: type) -> Exception:
+    # decrypt() fails, keeps the encrypted file and leaves nothing else behind
+    with pytest.raises(error) as raised:
+        crycript.decrypt(path, key)
+
+    assert listdir(path.rsplit('/', 1)[0]) == [path.rsplit('/', 1)[1]]
+    return raised.value
+
+
+def test_tampered_frame(encrypted, key):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.frame_offset(1) + header.frame_stride // 2)
+        byte = encrypted_file.read(1)
+        encrypted_file.seek(-1, 1)
+        encrypted_file.write(bytes((byte[0] ^ 1,)))
+
+    assert crycript.verify(encrypted, key).corrupted_frames == (1,)
+    assert _assert_rejected(encrypted, key, crycript.TamperedBlock).index == 1
+
+
+def test_tampered_header(encrypted, key):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.size - 1)
+        byte = encrypted_file.read(1)
+        encrypted_file.seek(-1, 1)
+        encrypted_file.write(bytes((byte[0] ^ 1,)))
+
+    _assert_rejected(encrypted, key, crycript.CrycriptError)
+
+
+@pytest.mark.parametrize('frames', (0, 1, 3))
+def test_truncated_at_frame(encrypted, key, frames):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.truncate(header.frame_offset(frames))
+
+    _assert_rejected(encrypted, key, crycript.CorruptedFile)
+
+
+def test_truncated_inside_frame(encrypted, key):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.truncate(header.frame_offset(2) - 1)
+
+    _assert_rejected(encrypted, key, crycript.CorruptedFile)
+
+
+def test_appended_frame(encrypted, key):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.frame_offset(0))
+        frame = encrypted_file.read(header.frame_stride)
+        encrypted_file.seek(0, 2)
+        encrypted_file.write(frame)
+
+    _assert_rejected(encrypted, key, crycript.CorruptedFile)
+
+
+def test_reordered_frames(encrypted, key):
+    header = _header(encrypted)
+
+    with open(encrypted, 'r+b') as encrypted_file:
+        encrypted_file.seek(header.frame_offset(0))
+        frames = encrypted_file.read(2 * header.frame_stride)
+        encrypted_file.seek(header.frame_offset(0))
+        encrypted_file.write(frames[header.frame_stride:] + frames[:header.frame_stride])
+
+    assert crycript.verify(encrypted, key).corrupted_frames == (0, 1)
+    assert _assert_rejected(encrypted, key, crycript.TamperedBlock).index == 0
+
+
+def test_wrong_key(encrypted):
+    _assert_rejected(encrypted, Fernet.generate_key(), crycript.InvalidPassword)